@@ -0,0 +1,99 @@
+"""Benchmarks for fcitools.geo
+
+Benchmarks are written for airspeed velocity (asv).  Chunking policies
+from :func:`fcitools.geo.get_chunks` are compared on the 2 km full disk
+grid, in the number of tasks in the dask graph, wall-clock time, and peak
+memory.  Geolocation comparisons are also measured for windows of several
+sizes.  Where the EUMETSAT geolocation is not available, a synthetic
+stand-in is used, see :func:`benchmarks.synthetic.make_eumsecret`.
+"""
+
+import sys
+import types
+import importlib
+
+import dask
+
+import fcitools.geo
+import fcitools.resample
+
+from . import synthetic
+
+policies = [128, 1024, "auto", "native"]
+dtypes = ["f4", "f8"]
+
+
+def _count_tasks(*arrays):
+    return len(set().union(*(a.__dask_graph__().keys() for a in arrays)))
+
+
+class LonLats:
+    params = [policies, dtypes]
+    param_names = ["chunks", "dtype"]
+    timeout = 300
+
+    def setup(self, chunks, dtype):
+        self.area = fcitools.resample.get_fci_fulldisk_area(2000)
+        self.chunks = fcitools.geo.get_chunks(self.area.shape, chunks, dtype)
+        self.dtype = dtype
+
+    def _get_lonlats(self):
+        return self.area.get_lonlats(chunks=self.chunks, dtype=self.dtype)
+
+    def track_tasks(self, chunks, dtype):
+        return _count_tasks(*self._get_lonlats())
+
+    def time_lonlats(self, chunks, dtype):
+        (lons, lats) = self._get_lonlats()
+        dask.compute(lons.mean(), lats.mean())
+
+    def peakmem_lonlats(self, chunks, dtype):
+        (lons, lats) = self._get_lonlats()
+        dask.compute(lons.mean(), lats.mean())
+
+
+def _get_scene():
+    try:
+        importlib.import_module("fcitools.eumsecret")
+    except ImportError:
+        sys.modules["fcitools.eumsecret"] = synthetic.make_eumsecret()
+    return {"vis_06": types.SimpleNamespace(
+            area=fcitools.resample.get_fci_fulldisk_area(2000))}
+
+
+class CompareGeolocation:
+    params = [policies, dtypes]
+    param_names = ["chunks", "dtype"]
+    timeout = 600
+
+    def setup(self, chunks, dtype):
+        self.sc = _get_scene()
+
+    def _get_pair(self, chunks, dtype):
+        return fcitools.geo.get_lat_lon_pair(
+                self.sc, "vis_06", chunks=chunks, dtype=dtype)
+
+    def track_tasks(self, chunks, dtype):
+        return _count_tasks(*self._get_pair(chunks, dtype))
+
+    def time_lat_lon_pair(self, chunks, dtype):
+        dask.compute(*(a.mean() for a in self._get_pair(chunks, dtype)))
+
+
+class CompareGeolocationWindow:
+    params = [[256, 1024, 4096]]
+    param_names = ["window"]
+    timeout = 600
+
+    def setup(self, window):
+        self.sc = _get_scene()
+        start = (5568 - window) // 2
+        self.window = (slice(start, start + window),) * 2
+
+    def time_compare_geolocation_window(self, window):
+        fcitools.geo.compare_geolocation_window(
+                self.sc, "vis_06", *self.window)
+
+    def peakmem_compare_geolocation_window(self, window):
+        fcitools.geo.compare_geolocation_window(
+                self.sc, "vis_06", *self.window)
@@ -0,0 +1,84 @@
+"""Benchmarks for the unpack, load, resample and write pipeline
+
+Benchmarks are written for airspeed velocity (asv), with ``time_``
+benchmarks for wall-clock time and ``peakmem_`` benchmarks for the peak
+resident memory of the process.  Input archives are synthetic, see
+:mod:`benchmarks.synthetic`.  Rendering reads the unpacked synthetic
+archive with the satpy FCI reader, then resamples and writes, for each
+area in ``etc/areas.yaml``.
+"""
+
+import os
+import shutil
+import tempfile
+import pathlib
+
+import fcitools.ioutil
+import fcitools.resample
+import fcitools.vis
+
+from . import synthetic
+
+_areas = sorted(fcitools.vis.get_fcitools_areas())
+
+
+class Unpack:
+    params = [["gz", "bz2", "xz"], [1, None]]
+    param_names = ["compression", "threads"]
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup_cache(self):
+        # asv calls this in a temporary working directory
+        return {comp: synthetic.make_fci_archive(
+                    pathlib.Path(comp).absolute(), compression=comp)
+                for comp in self.params[0]}
+
+    def setup(self, archives, compression, threads):
+        self.cache = tempfile.mkdtemp(prefix="fcitools-bench-cache-")
+        os.environ["XDG_CACHE_HOME"] = self.cache
+
+    def teardown(self, archives, compression, threads):
+        shutil.rmtree(self.cache, ignore_errors=True)
+
+    def time_unpack_tgz(self, archives, compression, threads):
+        fcitools.ioutil.unpack_tgz(archives[compression], threads=threads)
+
+    def peakmem_unpack_tgz(self, archives, compression, threads):
+        fcitools.ioutil.unpack_tgz(archives[compression], threads=threads)
+
+
+class ShowTestdata:
+    params = [_areas]
+    param_names = ["area"]
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup_cache(self):
+        return synthetic.make_fci_archive(pathlib.Path("show").absolute())
+
+    def setup(self, archive, area):
+        self.d = pathlib.Path(tempfile.mkdtemp(prefix="fcitools-bench-"))
+        os.environ["XDG_CACHE_HOME"] = str(self.d / "cache")
+        self.files = list(fcitools.ioutil.unpack_tgz(archive))
+        # prepare lookup tables, such that runs measure the steady state
+        for src in fcitools.resample.get_source_areas(self.files):
+            fcitools.resample.get_index(
+                    src, fcitools.vis.get_fcitools_areas()[area])
+
+    def teardown(self, archive, area):
+        fcitools.ioutil.release_unpacked()
+        shutil.rmtree(self.d, ignore_errors=True)
+
+    def _show(self, area):
+        fcitools.vis.show_testdata_from_dir(
+                self.files, [], ["vis_06", "ir_105"], [area],
+                self.d / "out", "{area:s}_{dataset:s}.png")
+
+    def time_show_testdata_from_dir(self, archive, area):
+        self._show(area)
+
+    def peakmem_show_testdata_from_dir(self, archive, area):
+        self._show(area)
@@ -0,0 +1,217 @@
+"""Synthetic FCI-shaped test data for benchmarks
+
+Real FCI test data are large and not redistributable.  The routines here
+generate archives with the same layout, file names, array shapes and
+types, and similar compressibility, as the FDHSI test data, which the
+satpy ``fci_l1c_nc`` reader reads like the real ones.  A stand-in for the
+EUMETSAT geolocation module makes the geolocation comparison work without
+the latter.
+"""
+
+import tarfile
+import types
+import pathlib
+
+import numpy
+
+import fcitools.resample
+
+# FDHSI channels and their resolution in metre
+channel_resolutions = {
+        **{ch: 1000 for ch in ("vis_04", "vis_05", "vis_06", "vis_08",
+                               "vis_09", "nir_13", "nir_16", "nir_22")},
+        **{ch: 2000 for ch in ("ir_38", "wv_63", "wv_73", "ir_87", "ir_97",
+                               "ir_105", "ir_123", "ir_133")}}
+
+# constants for the conversion to brightness temperature, as for ir_105
+_conversion = {
+        "radiance_to_bt_conversion_coefficient_wavenumber": 930.659,
+        "radiance_to_bt_conversion_coefficient_a": 0.9991,
+        "radiance_to_bt_conversion_coefficient_b": 0.1287,
+        "radiance_to_bt_conversion_constant_c1": 1.19104271e-16,
+        "radiance_to_bt_conversion_constant_c2": 0.01438775,
+        "radiance_unit_conversion_coefficient": 1.0,
+        "channel_effective_solar_irradiance": 1.0}
+
+_state = {
+        "celestial": {"earth_sun_distance": 1.5e8,
+                      "subsolar_latitude": 10.0,
+                      "subsolar_longitude": 5.0,
+                      "sun_satellite_distance": 1.5e8},
+        "platform": {"platform_altitude": 35786400.0,
+                     "subsatellite_latitude": 0.0,
+                     "subsatellite_longitude": 0.0}}
+
+
+def get_chunk_filename(kind, chunk, repeat_cycle=72):
+    """Get name of FDHSI chunk file as in the FCI test data
+    """
+    return (f"W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-FDHSI-FD--"
+            f"CHK-{kind:s}--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_"
+            f"20130804120330_20130804120345_N__T_{repeat_cycle:>04d}_"
+            f"{chunk:>04d}.nc")
+
+
+def make_fci_archive(d, channels=("vis_06", "ir_105"), compression="gz"):
+    """Make an archive with synthetic FDHSI chunk files
+
+    Write 40 BODY chunk files and one TRAIL file to an archive.  Each BODY
+    file contains, per channel, uint16 effective radiance counts for its
+    share of the full disk lines at the resolution of the channel, with
+    smooth values plus noise, and the other variables that the satpy
+    reader needs.  The remaining FDHSI channels are present with a
+    single pixel only, such that they cannot be loaded.
+
+    Args:
+        d (pathlib.Path): Directory to write archive to.
+        channels (Sequence[str]): Channels to include.  The reader needs
+            vis_06 and ir_105, which are always included.
+        compression (str): Compression, "gz", "bz2", or "xz".
+
+    Returns:
+        pathlib.Path to archive.
+    """
+    import xarray
+    d = pathlib.Path(d)
+    sd = d / "RC0072"
+    sd.mkdir(parents=True, exist_ok=True)
+    channels = set(channels) | {"vis_06", "ir_105"}
+    rng = numpy.random.default_rng(0)
+    for chunk in range(1, 41):
+        write_chunk_file(sd / get_chunk_filename("BODY", chunk), chunk,
+                         channels, rng)
+    xarray.Dataset({"index_map": (("chunk",), numpy.arange(1, 41))}).\
+        to_netcdf(sd / get_chunk_filename("TRAIL", 41))
+    out = d / f"fci_synthetic.tar.{compression:s}"
+    with tarfile.open(out, f"w:{compression:s}") as tf:
+        tf.add(sd, arcname=sd.name)
+    return out
+
+
+def write_chunk_file(p, chunk, channels, rng):
+    """Write synthetic FDHSI BODY chunk file
+
+    See :func:`make_fci_archive`.  Chunk 1 is the southernmost.
+    """
+    import netCDF4
+    with netCDF4.Dataset(p, "w") as nc:
+        nc.platform = "MTI1"
+        data = nc.createGroup("data")
+        data.createVariable("mtg_geos_projection", "i4").setncatts(
+                {"sweep_angle_axis": "y",
+                 "perspective_point_height": 35786400.0,
+                 "semi_major_axis": 6378137.0,
+                 "longitude_of_projection_origin": 0.0,
+                 "inverse_flattening": 298.257223563})
+        for (ch, res) in channel_resolutions.items():
+            _write_channel(data, ch, res, chunk, rng, ch in channels)
+        data.createVariable("swath_direction", "i1")[...] = 0
+        data.createVariable("swath_number", "i2")[...] = 1
+        nc.createDimension("index", 1)
+        nc.createVariable("index", "u2", ("index",))[:] = chunk
+        nc.createVariable("time", "f8", ("index",))[:] = 0
+        for (g, values) in _state.items():
+            grp = nc.createGroup("state").createGroup(g)
+            grp.createDimension("index", 1)
+            for (k, v) in values.items():
+                grp.createVariable(k, "f8", ("index",))[:] = v
+
+
+def _write_channel(data, ch, res, chunk, rng, full):
+    (step, offset, size) = fcitools.resample._fci_grids[res]
+    bounds = numpy.linspace(0, size, 41).round().astype("i4")
+    # lines and columns counted from 1, lines from the south
+    if full:
+        (r0, r1) = (bounds[chunk - 1] + 1, bounds[chunk])
+        (c0, c1) = (1, size)
+    else:
+        (r0, r1) = (c0, c1) = (bounds[chunk], bounds[chunk])
+    m = data.createGroup(ch).createGroup("measured")
+    m.createDimension("y", r1 - r0 + 1)
+    m.createDimension("x", c1 - c0 + 1)
+    m.createVariable("start_position_row", "i4")[...] = r0
+    m.createVariable("end_position_row", "i4")[...] = r1
+    for (k, v) in _conversion.items():
+        m.createVariable(k, "f4")[...] = v
+    x = m.createVariable("x", "u2", ("x",))
+    x[:] = numpy.arange(c0, c1 + 1)
+    x.setncatts({"scale_factor": -step, "add_offset": offset})
+    y = m.createVariable("y", "u2", ("y",))
+    y[:] = numpy.arange(r0, r1 + 1)
+    y.setncatts({"scale_factor": step, "add_offset": -offset})
+    (rows, cols) = numpy.ogrid[r0:r1 + 1, c0:c1 + 1]
+    base = 2000 + 1000 * numpy.sin(rows / 300) * numpy.cos(cols / 300)
+    er = m.createVariable("effective_radiance", "u2", ("y", "x"),
+                          zlib=True, fill_value=65535)
+    er.setncatts({"scale_factor": 0.005, "add_offset": 0.0,
+                  "units": "mW m-2 sr-1 (cm-1)-1",
+                  "valid_range": numpy.array([0, 4095], "u2"),
+                  "warm_scale_factor": 0.005, "warm_add_offset": 0.0,
+                  "long_name": "Effective radiance",
+                  "ancillary_variables": "pixel_quality"})
+    er.set_auto_maskandscale(False)
+    er[:] = (base + rng.integers(0, 64, base.shape)) % 4096
+    for k in ("pixel_quality", "index_map"):
+        v = m.createVariable(k, "u2", ("y", "x"), zlib=True)
+        v.set_auto_maskandscale(False)
+        v[:] = 1
+
+
+def make_eumsecret(displacement=0.1):
+    """Make a stand-in for the EUMETSAT geolocation module
+
+    Make a module that can stand in for ``fcitools.eumsecret``, see
+    :func:`fcitools.geo.get_lat_lon_pair`.  It calculates the geolocation
+    of the FCI full disk grid, see
+    :func:`fcitools.resample.get_fci_fulldisk_area`, from the scan angles
+    with pyproj, with the grid displaced by a fraction of a pixel such
+    that the comparison has something to show.  This is not the EUMETSAT
+    algorithm, but costs roughly as much.
+
+    Args:
+        displacement (float): Displacement in pixels, in both directions.
+
+    Returns:
+        module with ``pixcoord2geocoord`` and the constants it takes.
+    """
+    m = types.ModuleType("fcitools.eumsecret")
+    proj = fcitools.resample._fci_projection
+    (m.r_eq, m.f, m.h, m.lambda_d) = (
+            proj["a"], 1 / proj["rf"], proj["h"], proj["lon_0"])
+    m.grid_params = {}
+    for res in fcitools.resample._fci_grids:
+        ar = fcitools.resample.get_fci_fulldisk_area(res)
+        (x0, y0, x1, y1) = ar.area_extent
+        (dx, dy) = ((x1 - x0) / ar.width, (y0 - y1) / ar.height)
+        # scan angles of the first column and line, and their steps
+        m.grid_params[res] = {
+                "lamb": (x0 + (0.5 + displacement) * dx) / m.h,
+                "phi": (y1 + (0.5 + displacement) * dy) / m.h,
+                "azimuth_grid_sampling": dx / m.h,
+                "elevation_grid_sampling": dy / m.h}
+
+    def pixcoord2geocoord(x, y, r_eq, f, h, lambda_d, lamb, phi,
+                          azimuth_grid_sampling, elevation_grid_sampling):
+        import pyproj
+        import dask.array
+        geos = pyproj.Proj(proj="geos", a=r_eq, rf=1 / f, h=h,
+                           lon_0=lambda_d, sweep="y")
+
+        def calc(x, y):
+            # x counts lines and y columns, both from 1
+            (lon, lat) = geos(
+                    (lamb + (y - 1) * azimuth_grid_sampling) * h,
+                    (phi + (x - 1) * elevation_grid_sampling) * h,
+                    inverse=True, errcheck=False)
+            ll = numpy.stack([lat, lon]).astype(x.dtype)
+            ll[~numpy.isfinite(ll)] = numpy.nan
+            return ll
+        if isinstance(x, dask.array.Array):
+            ll = dask.array.map_blocks(
+                    calc, x, y, new_axis=0, chunks=((2,),) + x.chunks,
+                    dtype=x.dtype)
+        else:
+            ll = calc(numpy.asarray(x), numpy.asarray(y))
+        return (ll[0], ll[1])
+    m.pixcoord2geocoord = pixcoord2geocoord
+    return m
@@ -0,0 +1,225 @@
+"""Registry of known areas with a footprint index
+
+Areas are defined in the area files known to satpy and in the fcitools
+``etc/areas.yaml``.  Parsing those and building each area definition takes
+most of a second, so the parsed areas are stored in a pickle in the
+fcitools cache directory and read from there, unless any area file was
+modified since.  Within a process, the registry is read once.
+
+For each area, the registry also keeps the FCI BODY chunk files covering
+it, such that the chunks needed for an area, see
+:func:`fcitools.vis.get_needed_chunks`, or the areas covered by a chunk,
+see :func:`get_areas_for_chunk`, are looked up rather than calculated.
+"""
+
+import os
+import pickle
+import logging
+import pathlib
+import tempfile
+import collections
+
+logger = logging.getLogger(__name__)
+
+_areas_file = pathlib.Path(__file__).parent / "etc" / "areas.yaml"
+
+# FCI full disk BODY chunk files, numbered from south to north
+_n_chunks = 40
+
+# number of points per dimension at which an area is sampled to determine
+# its footprint on the FCI grid
+_n_sample = 101
+
+Registry = collections.namedtuple(
+        "Registry", ["sources", "areas", "fcitools", "chunks", "index"])
+Registry.__doc__ = """Parsed areas and their footprints
+
+Attributes:
+    sources (Dict[str, int]): Area files and their modification times in
+        ns, from which the registry was built.
+    areas (Dict[str, AreaDefinition]): All areas, where those from
+        fcitools take precedence.
+    fcitools (List[str]): Names of areas defined in fcitools.
+    chunks (Dict[str, FrozenSet[int]]): For each area, the numbers of the
+        chunks covering it, see :func:`calc_chunks`.
+    index (Dict[int, FrozenSet[str]]): For each chunk number, the names of
+        the areas it covers.
+"""
+
+# registry read in this process
+_registry = None
+
+
+def get_cache_path():
+    """Get path to cached registry
+    """
+    import sattools.io
+    cd = sattools.io.get_cache_dir(subdir="fcitools") / "areas"
+    cd.mkdir(parents=True, exist_ok=True)
+    return cd / "registry.pickle"
+
+
+def get_area_files():
+    """Get area files, in order of increasing precedence
+    """
+    try:
+        from satpy.area import get_area_file
+    except ImportError:  # satpy before 0.53
+        from satpy.resample import get_area_file
+    return [*get_area_file(), str(_areas_file)]
+
+
+def _get_sources():
+    return {f: os.stat(f).st_mtime_ns for f in get_area_files()}
+
+
+def calc_chunks(area):
+    """Calculate numbers of FCI chunks covering area
+
+    Sample the area on a regular grid of up to 101 by 101 pixel centres,
+    including its edges, and determine the range of FCI full disk lines
+    these fall in.  Chunk boundaries are approximated by dividing the
+    full disk into chunks with equal numbers of lines.
+
+    Args:
+        area (AreaDefinition): Area to cover.
+
+    Returns:
+        FrozenSet[int] of chunk numbers, where chunk 1 is southernmost.
+        Empty if the area is not on the disk or has no fixed shape.
+    """
+    import numpy
+    import pyresample.geometry
+    from . import resample
+    if not isinstance(area, pyresample.geometry.AreaDefinition):  # dynamic
+        return frozenset()
+    src = resample.get_fci_fulldisk_area(2000)
+    (n_rows, n_cols) = area.shape
+    rows = numpy.unique(numpy.linspace(0, n_rows - 1, _n_sample).round())
+    cols = numpy.unique(numpy.linspace(0, n_cols - 1, _n_sample).round())
+    (x0, y0) = area.pixel_upper_left
+    (xx, yy) = numpy.meshgrid(x0 + cols * area.pixel_size_x,
+                              y0 - rows * area.pixel_size_y)
+    with numpy.errstate(invalid="ignore"):
+        (lons, lats) = area.get_lonlat_from_projection_coordinates(xx, yy)
+        (_, src_rows) = src.get_array_indices_from_lonlat(lons, lats)
+    src_rows = numpy.ma.compressed(src_rows)
+    if src_rows.size == 0:
+        return frozenset()
+    # the first line of the FCI grid is in the south
+    first = src_rows.min() * _n_chunks // src.height
+    last = src_rows.max() * _n_chunks // src.height
+    return frozenset(int(j + 1) for j in range(first, last + 1))
+
+
+def build_registry():
+    """Build registry by parsing all area files
+
+    Returns:
+        :class:`Registry`
+    """
+    import pyresample.area_config
+    sources = _get_sources()
+    areas = {}
+    for f in sources:
+        loaded = {ar.area_id: ar for ar in
+                  pyresample.area_config.load_area(f)}
+        areas.update(loaded)
+        if f == str(_areas_file):
+            fcitools = list(loaded)
+    chunks = {}
+    for (name, ar) in areas.items():
+        try:
+            chunks[name] = calc_chunks(ar)
+        except ValueError as e:
+            logger.debug(f"Cannot determine footprint of {name:s}: {e!s}")
+            chunks[name] = frozenset()
+    index = collections.defaultdict(set)
+    for (name, cs) in chunks.items():
+        for c in cs:
+            index[c].add(name)
+    return Registry(sources, areas, fcitools, chunks,
+                    {c: frozenset(index[c]) for c in range(1, _n_chunks + 1)})
+
+
+def get_registry():
+    """Get registry, from memory, disk, or by building it
+
+    The registry is rebuilt and stored if any area file changed since it
+    was built.
+
+    Returns:
+        :class:`Registry`
+    """
+    global _registry
+    sources = _get_sources()
+    if _registry is not None and _registry.sources == sources:
+        return _registry
+    p = get_cache_path()
+    try:
+        with p.open("rb") as fp:
+            reg = pickle.load(fp)
+    except FileNotFoundError:
+        reg = None
+    except Exception as e:  # corrupt, or from a different version
+        logger.warning(f"Cannot read area registry {p!s}: {e!s}")
+        reg = None
+    if reg is None or reg.sources != sources:
+        logger.debug("Building area registry")
+        reg = build_registry()
+        (fd, tmp) = tempfile.mkstemp(suffix=".pickle", dir=p.parent)
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(reg, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, p)
+    _registry = reg
+    return reg
+
+
+def get_all_areas():
+    """Get all known areas
+
+    Returns:
+        Dict[str, AreaDefinition] with the areas known to satpy and those
+        in the fcitools ``etc/areas.yaml``, which take precedence.
+    """
+    return dict(get_registry().areas)
+
+
+def get_fcitools_areas():
+    """Get areas defined in fcitools
+
+    Returns:
+        Dict[str, AreaDefinition] with the areas in ``etc/areas.yaml``.
+    """
+    reg = get_registry()
+    return {name: reg.areas[name] for name in reg.fcitools}
+
+
+def get_area_chunks(area):
+    """Get numbers of FCI chunks covering area
+
+    Look up the chunks for a registered area, or calculate them with
+    :func:`calc_chunks` for another area.
+
+    Args:
+        area (AreaDefinition): Area to cover.
+
+    Returns:
+        FrozenSet[int] of chunk numbers, where chunk 1 is southernmost.
+    """
+    reg = get_registry()
+    if reg.areas.get(area.area_id) == area:
+        return reg.chunks[area.area_id]
+    return calc_chunks(area)
+
+
+def get_areas_for_chunk(chunk):
+    """Get names of registered areas covered by a chunk
+
+    Args:
+        chunk (int): Chunk number, where chunk 1 is southernmost.
+
+    Returns:
+        FrozenSet[str] of area names.
+    """
+    return get_registry().index.get(chunk, frozenset())
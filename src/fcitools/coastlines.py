@@ -0,0 +1,162 @@
+"""Coastline overlays with persistent rasters
+
+Adding coastlines with pycoast reads and rasterises the shapefiles for each
+image, although for a fixed area the result is the same for every
+composite, channel, and repeat cycle.  This module rasterises the
+coastlines and borders for an area once, stores the line coverage on disk,
+and memory-maps it on later runs, such that adding coastlines to an image
+reduces to blending arrays.
+
+The rasters are stored in the fcitools cache directory and keyed on the
+coastline resolution and a hash of the area definition, the line width,
+and the coastline directory.
+"""
+
+import os
+import logging
+import pathlib
+import tempfile
+
+import numpy
+import sattools.io
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_dir():
+    """Get directory where coastline rasters are stored
+    """
+    cd = sattools.io.get_cache_dir(subdir="fcitools") / "coastlines"
+    cd.mkdir(parents=True, exist_ok=True)
+    return cd
+
+
+def get_coast_resolution(area):
+    """Get coastline resolution suitable for area
+
+    Choose the GSHHS resolution as pycoast does when none is given.
+
+    Args:
+        area (AreaDefinition): Area to draw coastlines on.
+
+    Returns:
+        str, one of 'c', 'l', 'i', 'h', or 'f', from crude to full.
+    """
+    res = min(abs(r) for r in area.resolution)
+    if area.crs.is_geographic:
+        res *= 111_000  # m per degree
+    for (threshold, resolution) in ((25_000, "c"), (5_000, "l"),
+                                    (1_000, "i"), (200, "h")):
+        if res > threshold:
+            return resolution
+    return "f"
+
+
+def get_raster_path(area, coast_dir, resolution, width):
+    """Get path to coastline raster for area
+    """
+    h = area.update_hash()
+    h.update(f"{width!r}\0{pathlib.Path(coast_dir).resolve()!s}".encode())
+    return get_cache_dir() / (
+            f"{area.area_id:s}-{resolution:s}-{h.hexdigest()[:16]:s}.npy")
+
+
+def rasterise(area, coast_dir, resolution, width=0.5):
+    """Rasterise coastlines and borders for area
+
+    Draw GSHHS coastlines and WDBII political borders with pycoast, as
+    satpy does for an overlay, onto a transparent image.
+
+    Args:
+        area (AreaDefinition): Area to draw on.
+        coast_dir (str): Directory containing the shapefiles.
+        resolution (str): GSHHS resolution, see
+            :func:`get_coast_resolution`.
+        width (float): Line width in pixels.
+
+    Returns:
+        uint8 ndarray with the shape of the area, with the coverage of each
+        pixel by lines, from 0 to 255.
+    """
+    from PIL import Image
+    from pycoast import ContourWriterAGG
+    img = Image.new("RGBA", (area.width, area.height), (0, 0, 0, 0))
+    params = {"outline": (255, 255, 255), "width": width, "level": 1,
+              "resolution": resolution}
+    ContourWriterAGG(str(coast_dir)).add_overlay_from_dict(
+            {"coasts": dict(params), "borders": dict(params)}, area,
+            background=img)
+    return numpy.asarray(img)[..., 3].copy()
+
+
+def get_raster(area, coast_dir, resolution=None, width=0.5):
+    """Get coastline raster from cache, rasterising if needed
+
+    Args:
+        area (AreaDefinition): Area to draw on.
+        coast_dir (str): Directory containing the shapefiles.
+        resolution (Optional[str]): GSHHS resolution.  If not given, choose
+            with :func:`get_coast_resolution`.
+        width (float): Line width in pixels.
+
+    Returns:
+        Memory-mapped raster as described in :func:`rasterise`.
+    """
+    if resolution is None:
+        resolution = get_coast_resolution(area)
+    p = get_raster_path(area, coast_dir, resolution, width)
+    if not p.exists():
+        logger.debug(f"Rasterising coastlines for {area.area_id:s} at "
+                     f"resolution {resolution:s}")
+        raster = rasterise(area, coast_dir, resolution, width)
+        (fd, tmp) = tempfile.mkstemp(suffix=".npy", dir=p.parent)
+        with os.fdopen(fd, "wb") as fp:
+            numpy.save(fp, raster)
+        os.replace(tmp, p)
+    else:
+        logger.debug(f"Reading coastline raster from {p!s}")
+    return numpy.load(p, mmap_mode="r")
+
+
+def add_coastlines(img, area, coast_dir, color="red", width=0.5,
+                   resolution=None):
+    """Add coastlines to image by blending in a cached raster
+
+    Args:
+        img (trollimage.xrimage.XRImage): Enhanced image.
+        area (AreaDefinition): Area of the image.
+        coast_dir (str): Directory containing the shapefiles.
+        color (str or Tuple[int, int, int]): Line colour, as a name or
+            as RGB values from 0 to 255.
+        width (float): Line width in pixels.
+        resolution (Optional[str]): GSHHS resolution, see
+            :func:`get_raster`.
+
+    Returns:
+        trollimage.xrimage.XRImage in RGB or RGBA mode, where lines are
+        drawn over the image.
+    """
+    import xarray
+    import dask.array
+    from PIL import ImageColor
+    from trollimage.xrimage import XRImage
+    mode = "RGBA" if img.mode.endswith("A") else "RGB"
+    data = img.convert(mode).data
+    raster = get_raster(area, coast_dir, resolution, width)
+    cover = xarray.DataArray(
+            dask.array.from_array(
+                raster, chunks=(data.chunks[data.get_axis_num("y")],
+                                data.chunks[data.get_axis_num("x")]))
+            / numpy.float32(255),
+            dims=("y", "x"))
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    values = [c / 255 for c in color[:3]] + [1.0]
+    color = xarray.DataArray(
+            numpy.array(values[:len(mode)], dtype="f4"), dims=("bands",),
+            coords={"bands": list(mode)})
+    # drawing over missing values makes the lines opaque there
+    blended = (data.fillna(0) * (1 - cover) + color * cover).where(
+            cover > 0, data)
+    blended.attrs = data.attrs
+    return XRImage(blended.transpose(*data.dims))
@@ -0,0 +1,141 @@
+"""Geolocation differences over many test data releases
+
+Compare the pytroll geolocation with the EUMETSAT geolocation, see
+:mod:`fcitools.geo`, for many archives of FCI test data, and collect the
+difference statistics for each in a table, such that changes over test
+data releases and repeat cycles can be tracked.
+
+The EUMETSAT reference grid depends only on the resolution and is read from
+the on-disk cache after the first archive, see
+:func:`fcitools.geo.get_cached_grids`, so only the pytroll side is
+calculated for each new area.
+"""
+
+import csv
+import logging
+import pathlib
+import concurrent.futures
+
+from . import ioutil
+
+logger = logging.getLogger(__name__)
+
+
+def compare_archive(path, chan, reader="fci_l1c_nc", quantiles=(0.5, 0.95),
+                    n_rim=100, chunks=1024):
+    """Calculate geolocation difference statistics for one archive
+
+    Args:
+        path (pathlib.Path)
+            Path to ``.tar.gz`` file containing test data.
+        chan (str)
+            Channel for which to compare the geolocation.
+        reader (str)
+            Satpy reader to use.
+        quantiles, n_rim, chunks
+            Passed on to :func:`fcitools.geo.calc_distance_statistics`.
+
+    Returns:
+        Dict with one row for the table, see :func:`compare_archives`.
+    """
+    import satpy
+    from . import geo
+    paths = ioutil.unpack_tgz(path)
+    try:
+        sc = satpy.Scene(filenames=[str(p) for p in paths], reader=reader)
+        sc.load([chan])
+        stats = geo.calc_distance_statistics(
+                sc, chan, quantiles=quantiles, n_rim=n_rim, chunks=chunks,
+                cache=True)
+    finally:
+        ioutil.release_unpacked()
+    row = {"archive": pathlib.Path(path).name,
+           "start_time": sc.start_time.isoformat(),
+           "channel": chan,
+           "resolution": abs(round(sc[chan].area.resolution[0])),
+           "count": stats["count"],
+           "median": stats["median"]}
+    for q in quantiles:
+        row[f"q{q:g}"] = stats["quantiles"][q]
+    row["rim_median"] = stats["rim"]["median"]
+    for q in quantiles:
+        row[f"rim_q{q:g}"] = stats["rim"]["quantiles"][q]
+    return row
+
+
+def compare_archives(paths, chan, reader="fci_l1c_nc", jobs=1, **kwargs):
+    """Calculate geolocation difference statistics for many archives
+
+    Compare geolocations for each archive with :func:`compare_archive`.
+    With more than one job, archives are distributed over a pool of
+    worker processes.  A failure for one archive does not affect the
+    others.
+
+    Args:
+        paths (List[pathlib.Path])
+            Paths to ``.tar.gz`` files containing test data.
+        chan (str)
+            Channel for which to compare the geolocation.
+        reader (str)
+            Satpy reader to use.
+        jobs (int)
+            Number of archives to process in parallel.
+        Remaining keyword arguments are passed on to
+        :func:`compare_archive`.
+
+    Returns:
+        Tuple with a list of rows, one dict per successful archive, sorted
+        by start time, and a dict mapping each failed path to the
+        exception raised.  Each row contains the archive name, start time,
+        channel, resolution, number of valid pixels, and the median and
+        quantiles of the difference in metre, both for the full disk and
+        for the pixels nearest the rim.
+    """
+    rows = []
+    failed = {}
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            try:
+                rows.append(compare_archive(path, chan, reader, **kwargs))
+            except Exception as e:
+                logger.exception(f"Failed to compare {path!s}")
+                failed[path] = e
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(paths))) as executor:
+            futures = {executor.submit(compare_archive, path, chan, reader,
+                                       **kwargs): path
+                       for path in paths}
+            for fut in concurrent.futures.as_completed(futures):
+                path = futures[fut]
+                try:
+                    rows.append(fut.result())
+                except Exception as e:
+                    logger.error(f"Failed to compare {path!s}: {e!s}")
+                    failed[path] = e
+    rows.sort(key=lambda row: (row["start_time"], row["archive"]))
+    return (rows, failed)
+
+
+def write_table(rows, out):
+    """Write rows of statistics to CSV or Parquet
+
+    Args:
+        rows (List[Dict])
+            Rows as returned by :func:`compare_archives`, all with the same
+            keys.
+        out (pathlib.Path)
+            Path to write to.  If it ends with ``.parquet``, write Parquet,
+            which needs pandas and pyarrow, as installed with the
+            ``parquet`` extra.  Otherwise, write CSV.
+    """
+    out = pathlib.Path(out)
+    if out.suffix == ".parquet":
+        import pandas
+        pandas.DataFrame.from_records(rows).to_parquet(out, index=False)
+        return
+    with out.open("w", newline="") as fp:
+        writer = csv.DictWriter(
+                fp, fieldnames=list(rows[0].keys()) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
@@ -38,16 +38,86 @@ the 100 pixels closest to the rim, the median is 73 metre, and 5% of those
 pixels have more than 287 metre difference, in two opposite directions.  See
 https://pytroll.slack.com/files/UGU1HTMUG/F011RMANGJD/grafik.png for a pretty
 400% zoom visualising the differences near the edge.
+
+Those statistics can be calculated without holding the full disk distance
+field in memory, in one pass over its chunks and with approximate
+quantiles for the full disk::
+
+    stats = fcitools.geo.calc_distance_statistics(
+            fciscene, "vis_09", quantiles=(0.5, 0.95), n_rim=100)
+    print(stats["quantiles"][0.5], stats["rim"]["quantiles"][0.95])
+
+For full disk data at high resolution, the arrays involved do not fit in
+memory.  To calculate the comparison tile by tile and write it directly to
+a tiled GeoTIFF or to Zarr, use::
+
+    fcitools.geo.write_geolocation_comparison(
+            fciscene, "vis_06", "/tmp/comparison.tif", tile_size=1024)
 """
 
+import os
+import math
+import shutil
+import logging
+import pathlib
+import tempfile
+
+import numpy
+import dask
 import dask.array
+import sattools.io
 
 from sattools.geo import (calc_heading_distance_accurate,
                           calc_rgb_from_heading_distance)
 
+from . import ioutil
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+_grid_names = ("pyt_lat", "pyt_lon", "eum_lat", "eum_lon")
+
+
+def get_chunks(shape, chunks=128, dtype="f4", memory_budget="64MiB"):
+    """Get chunks for lat/lon arrays according to a chunking policy
+
+    Small chunks mean many tasks, and on the full disk the scheduler
+    overhead may then exceed the time spent calculating.  Large chunks
+    mean more memory use.
+
+    Args:
+        shape (Tuple[int, int])
+            Shape of the array to chunk.
+        chunks (int, tuple, or str)
+            Chunking policy.  An int or tuple is used as is, as for
+            :func:`dask.array.from_array`.  With "auto", choose chunks
+            such that one chunk for one array takes at most
+            ``memory_budget``.  With "native", align chunks with the line
+            blocks in the FCI chunk files, dividing the full disk in 40
+            blocks of full lines.  As in the grid of the satpy reader,
+            the first line and chunk 1 are in the south.
+        dtype (str)
+            Data type of the arrays.
+        memory_budget (int or str)
+            Memory budget per chunk for "auto", in bytes or as a string
+            like "64MiB".
+    Returns:
+        Tuple[Tuple[int, ...], Tuple[int, ...]] with chunk sizes along
+        both dimensions.
+    """
+    if chunks == "native":
+        from .areas import _n_chunks
+        bounds = [round(i * shape[0] / _n_chunks)
+                  for i in range(_n_chunks + 1)]
+        chunks = (tuple(b - a for (a, b) in zip(bounds[:-1], bounds[1:])
+                        if b > a), shape[1])
+    return dask.array.core.normalize_chunks(
+            chunks, shape, limit=memory_budget, dtype=dtype)
+
 
 def get_lat_lon_pair(sc, chan, _x_start=1, _y_start=1,
-                     _x_end=None, _y_end=None):
+                     _x_end=None, _y_end=None, cache=False,
+                     chunks=128, dtype="f4"):
     """Get a pair of lat/lons
 
     Args:
@@ -56,30 +126,236 @@ def get_lat_lon_pair(sc, chan, _x_start=1, _y_start=1,
         chan (str)
             Channel (or otherwise satpy dataset) for which to calculate the
             geolocation.  Channel must be loaded first.
+        cache (bool)
+            If true, read the lat/lons from an on-disk cache, calculating
+            them first if needed.  See :func:`get_cached_grids`.
+        chunks (int, tuple, or str)
+            Chunking policy, see :func:`get_chunks`.
+        dtype (str)
+            Precision for calculations, "f4" or "f8".  The cache stores
+            single precision only.
     Returns:
         (lat_pyt, lon_pyt, lat_eum, lon_eum)
     """
     ar = sc[chan].area
     _x_end = _x_end if _x_end is not None else ar.x_size + 1
     _y_end = _y_end if _y_end is not None else ar.y_size + 1
-    xc = dask.array.arange(_x_start, _x_end, dtype="f4", chunks=128)
-    yc = dask.array.arange(_y_start, _y_end, dtype="f4", chunks=128)
+    if dtype not in {"f4", "f8"}:
+        raise ValueError(f"dtype must be f4 or f8, got {dtype!s}")
+    if cache:
+        if dtype != "f4":
+            raise ValueError("Cached lat/lon grids are single precision")
+        (pyt_lat, pyt_lon, eum_lat, eum_lon) = (
+                dask.array.from_array(
+                    a, chunks=get_chunks(a.shape, chunks, dtype))
+                for a in get_cached_grids(ar))
+        sl = (slice(_x_start - 1, _x_end - 1), slice(_y_start - 1, _y_end - 1))
+        return (pyt_lat, pyt_lon, eum_lat[sl], eum_lon[sl])
+    (x_chunks, y_chunks) = get_chunks(
+            (_x_end - _x_start, _y_end - _y_start), chunks, dtype)
+    xc = dask.array.arange(_x_start, _x_end, dtype=dtype, chunks=x_chunks)
+    yc = dask.array.arange(_y_start, _y_end, dtype=dtype, chunks=y_chunks)
     (y, x) = dask.array.meshgrid(yc, xc)
+    (eum_lat, eum_lon) = _get_eum_lat_lon(ar, x, y)
+    (pyt_lon, pyt_lat) = ar.get_lonlats(
+            chunks=get_chunks(ar.shape, chunks, dtype), dtype=dtype)
+
+    return (pyt_lat, pyt_lon, eum_lat, eum_lon)
+
+
+def _get_eum_lat_lon(ar, x, y):
+    """Get EUMETSAT lat/lon for (1-based) pixel coordinates in area
+    """
     res = abs(round(ar.resolution[0]))
     from . import eumsecret
-    (eum_lat, eum_lon) = eumsecret.pixcoord2geocoord(
+    return eumsecret.pixcoord2geocoord(
             x, y, eumsecret.r_eq, eumsecret.f, eumsecret.h,
             eumsecret.lambda_d, eumsecret.grid_params[res]["lamb"],
             eumsecret.grid_params[res]["phi"],
             eumsecret.grid_params[res]["azimuth_grid_sampling"],
             eumsecret.grid_params[res]["elevation_grid_sampling"])
-    (pyt_lon, pyt_lat) = ar.get_lonlats(chunks=128, dtype="f4")
 
-    return (pyt_lat, pyt_lon, eum_lat, eum_lon)
+
+def iter_windows(shape, tile_size=1024):
+    """Iterate over windows tiling an array
+
+    Args:
+        shape (Tuple[int, int])
+            Number of rows and columns of the array to tile.
+        tile_size (int)
+            Maximum number of rows and columns per window.
+    Returns:
+        Iterator over (rows, cols) pairs of slices, row by row.
+    """
+    (n_rows, n_cols) = shape
+    for r in range(0, n_rows, tile_size):
+        for c in range(0, n_cols, tile_size):
+            yield (slice(r, min(r + tile_size, n_rows)),
+                   slice(c, min(c + tile_size, n_cols)))
+
+
+def get_lat_lon_pair_window(sc, chan, rows, cols, cache=False):
+    """Get a pair of lat/lons for a window
+
+    Like :func:`get_lat_lon_pair`, but for a window of the channel's area
+    only, and with in-memory arrays.  As in :func:`get_lat_lon_pair`, the
+    EUMETSAT x-coordinate runs along the rows of the pytroll array.
+
+    Args:
+        sc (satpy.Scene)
+            satpy Scene object to use for the calculations.
+        chan (str)
+            Channel (or otherwise satpy dataset) for which to calculate the
+            geolocation.  Channel must be loaded first.
+        rows (slice)
+            Rows of the window, with step 1.
+        cols (slice)
+            Columns of the window, with step 1.
+        cache (bool)
+            If true, read the lat/lons from an on-disk cache, calculating
+            them first if needed.  See :func:`get_cached_grids`.
+    Returns:
+        (lat_pyt, lon_pyt, lat_eum, lon_eum), each with the shape of the
+        window.
+    """
+    ar = sc[chan].area
+    if cache:
+        return tuple(numpy.array(a[rows, cols]) for a in get_cached_grids(ar))
+    return _calc_lat_lon_pair_window(ar, rows, cols)
+
+
+def _calc_lat_lon_pair_window(ar, rows, cols):
+    """Calculate a pair of lat/lons for a window of an area
+    """
+    return _calc_pyt_window(ar, rows, cols) + _calc_eum_window(ar, rows, cols)
+
+
+def _calc_pyt_window(ar, rows, cols):
+    """Calculate pytroll lat/lon for a window of an area
+    """
+    (pyt_lon, pyt_lat) = ar.get_lonlats(data_slice=(rows, cols), dtype="f4")
+    return (pyt_lat, pyt_lon)
+
+
+def _calc_eum_window(ar, rows, cols):
+    """Calculate EUMETSAT lat/lon for a window of an area
+    """
+    xc = numpy.arange(rows.start + 1, rows.stop + 1, dtype="f4")
+    yc = numpy.arange(cols.start + 1, cols.stop + 1, dtype="f4")
+    (y, x) = numpy.meshgrid(yc, xc)
+    return tuple(_get_eum_lat_lon(ar, x, y))
+
+
+def get_grid_cache_dir():
+    """Get directory where lat/lon grids are cached
+    """
+    cd = sattools.io.get_cache_dir(subdir="fcitools") / "geo"
+    cd.mkdir(parents=True, exist_ok=True)
+    return cd
+
+
+def get_grid_cache_path(ar):
+    """Get path to directory with cached pytroll lat/lon grids for area
+
+    The path is keyed on a hash of the area definition.
+    """
+    res = abs(round(ar.resolution[0]))
+    return get_grid_cache_dir() / (
+            f"{ar.area_id:s}-{res:d}m-{ar.update_hash().hexdigest()[:16]:s}")
+
+
+def get_reference_cache_path(ar):
+    """Get path to directory with cached EUMETSAT lat/lon grids for area
+
+    The EUMETSAT grid depends only on the resolution and size of the area,
+    so the path is keyed on those and on a hash of the EUMETSAT grid
+    parameters for the resolution.  Areas differing otherwise share the
+    reference grid.
+    """
+    import hashlib
+    res = abs(round(ar.resolution[0]))
+    from . import eumsecret
+    h = hashlib.sha256(
+            repr((eumsecret.r_eq, eumsecret.f, eumsecret.h,
+                  eumsecret.lambda_d,
+                  sorted(eumsecret.grid_params[res].items()))).encode())
+    (n_rows, n_cols) = ar.shape
+    return get_grid_cache_dir() / (
+            f"eum-{res:d}m-{n_rows:d}x{n_cols:d}-{h.hexdigest()[:16]:s}")
+
+
+def get_cached_grids(ar, tile_size=1024):
+    """Get pytroll and EUMETSAT lat/lon grids from cache
+
+    The lat/lon grids for an area do not change, but calculating them is
+    expensive.  Get them from an on-disk cache of float32 ``.npy`` files,
+    calculating and storing them first if needed.  Calculation goes tile
+    by tile, such that the full grids are never held in memory.  As in
+    :func:`get_lat_lon_pair_window`, the EUMETSAT x-coordinate runs along
+    the rows.
+
+    The pytroll and EUMETSAT grids are cached separately, see
+    :func:`get_grid_cache_path` and :func:`get_reference_cache_path`.
+
+    Args:
+        ar (AreaDefinition)
+            Area for which to get the grids.
+        tile_size (int)
+            Number of rows and columns calculated at once when filling
+            the cache.
+    Returns:
+        (lat_pyt, lon_pyt, lat_eum, lon_eum) as read-only memory-mapped
+        arrays with the shape of the area.
+    """
+    return (_get_cached(get_grid_cache_path(ar), _grid_names[:2], ar.shape,
+                        lambda rows, cols: _calc_pyt_window(ar, rows, cols),
+                        tile_size)
+            + _get_cached(get_reference_cache_path(ar), _grid_names[2:],
+                          ar.shape,
+                          lambda rows, cols: _calc_eum_window(ar, rows, cols),
+                          tile_size))
+
+
+def _get_cached(d, names, shape, calc, tile_size):
+    """Get arrays from cache directory, calculating them tile by tile if needed
+
+    Concurrent callers for the same directory wait for the one calculating
+    it, then read the result, such that the arrays are calculated once.
+    """
+    if not d.exists():
+        with ioutil._locked(d):
+            if not d.exists():  # unless calculated while waiting
+                _calc_cached(d, names, shape, calc, tile_size)
+    else:
+        logger.debug(f"Reading {', '.join(names):s} from {d!s}")
+    return tuple(numpy.load(d / f"{name:s}.npy", mmap_mode="r")
+                 for name in names)
+
+
+def _calc_cached(d, names, shape, calc, tile_size):
+    """Calculate arrays tile by tile into cache directory d
+    """
+    logger.debug(f"Calculating {', '.join(names):s} for {d.name:s}")
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=f".{d.name:s}-",
+                                        dir=d.parent))
+    try:
+        grids = [numpy.lib.format.open_memmap(
+                    tmp / f"{name:s}.npy", mode="w+", dtype="f4",
+                    shape=shape) for name in names]
+        for (rows, cols) in iter_windows(shape, tile_size):
+            for (g, val) in zip(grids, calc(rows, cols)):
+                g[rows, cols] = val
+        for g in grids:
+            g.flush()
+        del grids
+        os.rename(tmp, d)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
 
 
 def compare_geolocation(sc, chan, _x_start=1, _y_start=1,
-                        _x_end=None, _y_end=None):
+                        _x_end=None, _y_end=None, cache=False,
+                        chunks=128, dtype="f4", compute=False):
     """Compare pytroll and EUM geolocation
 
     Compare geolocation as calculated by satpy and the one provided by
@@ -91,20 +367,376 @@ def compare_geolocation(sc, chan, _x_start=1, _y_start=1,
         chan (str)
             Channel (or otherwise satpy dataset) for which to calculate the
             geolocation.  Channel must be already loaded.
+        cache (bool)
+            If true, use cached lat/lon grids, see :func:`get_cached_grids`.
+        chunks (int, tuple, or str)
+            Chunking policy, see :func:`get_chunks`.
+        dtype (str)
+            Precision for calculating lat/lons, "f4" or "f8".
+        compute (bool)
+            If true, compute the result in a "compute" stage within the
+            "compare_geolocation" stage, see :mod:`fcitools.profiling`.
+            Otherwise, for dask input, the result is lazy and the stage
+            covers building the graph only.
     Returns:
         ndarray [n_x, n_y, 3] RGB image corresponding to the full disk size of
-        the channel.  The hue of each pixel corresponds to the direction of the
-        displacement between EUMETSAT and pytroll, the brightness value
-        corresponds to the magnitude.  For a legend, call :func:`get_legend`.
+        the channel, lazy for dask input unless computed.  The hue of each
+        pixel corresponds to the direction of the displacement between
+        EUMETSAT and pytroll, the brightness value corresponds to the
+        magnitude.  For a legend, call :func:`get_legend`.
     """
 
+    with profiling.stage("compare_geolocation") as rec:
+        (pyt_lat, pyt_lon, eum_lat, eum_lon) = get_lat_lon_pair(
+                sc, chan, _x_start=_x_start, _y_start=_y_start,
+                _x_end=_x_end, _y_end=_y_end, cache=cache,
+                chunks=chunks, dtype=dtype)
+
+        (heading, distance) = calc_heading_distance_accurate(
+                eum_lat, eum_lon, pyt_lat, pyt_lon)
+
+        rgb = calc_rgb_from_heading_distance(heading, distance)
+
+        if dask.is_dask_collection(rgb):
+            rec["tasks"] = len(rgb.__dask_graph__())
+        if compute:
+            with profiling.stage("compute"):
+                rgb = numpy.asarray(rgb)
+
+    return rgb
+
+
+def compare_geolocation_fused(sc, chan, cache=False, chunks=128,
+                              dtype="f4"):
+    """Compare pytroll and EUM geolocation as 8-bit RGB
+
+    Like :func:`compare_geolocation`, but return 8-bit RGB, calculated
+    with :func:`calc_rgb_block` in one task per block.
+
+    The result matches :func:`compare_geolocation` scaled to 0–255 to
+    within rounding, that is, to within 1 in each channel.  Pixels
+    without valid geolocation are black.
+
+    Args:
+        sc (satpy.Scene)
+            satpy Scene object to use for the calculations.
+        chan (str)
+            Channel (or otherwise satpy dataset) for which to calculate the
+            geolocation.  Channel must be already loaded.
+        cache (bool)
+            If true, use cached lat/lon grids, see :func:`get_cached_grids`.
+        chunks (int, tuple, or str)
+            Chunking policy, see :func:`get_chunks`.
+        dtype (str)
+            Precision for calculating lat/lons, "f4" or "f8".
+    Returns:
+        dask array [n_x, n_y, 3] of uint8 RGB, see
+        :func:`compare_geolocation`.
+    """
     (pyt_lat, pyt_lon, eum_lat, eum_lon) = get_lat_lon_pair(
-            sc, chan, _x_start=_x_start, _y_start=_y_start,
-            _x_end=_x_end, _y_end=_y_end)
+            sc, chan, cache=cache, chunks=chunks, dtype=dtype)
+    return dask.array.map_blocks(
+            calc_rgb_block, eum_lat, eum_lon, pyt_lat, pyt_lon,
+            new_axis=2, chunks=eum_lat.chunks + ((3,),), dtype="u1",
+            meta=numpy.empty((0, 0, 0), dtype="u1"))
+
+
+def calc_rgb_block(lat1, lon1, lat2, lon2):
+    """Calculate uint8 RGB from two sets of lat/lons for one block
+
+    Applies :func:`calc_heading_distance_accurate` followed by
+    :func:`calc_rgb_from_heading_distance` to in-memory arrays, and scales
+    the result to uint8.  See :func:`compare_geolocation_fused`.
+
+    Args:
+        lat1, lon1, lat2, lon2 (ndarray)
+            Lat/lons of the start and end points, all with the same shape.
+    Returns:
+        ndarray of uint8 RGB, with an additional last dimension of size 3.
+    """
+    (heading, distance) = calc_heading_distance_accurate(
+            lat1, lon1, lat2, lon2)
+    rgb = numpy.asarray(calc_rgb_from_heading_distance(heading, distance))
+    if rgb.dtype.kind != "f" or not rgb.flags.writeable:
+        rgb = rgb.astype("f4")
+    # scale in the dtype of the colours, without further copies
+    numpy.multiply(rgb, 255, out=rgb)
+    numpy.rint(rgb, out=rgb)
+    numpy.clip(rgb, 0, 255, out=rgb)
+    numpy.nan_to_num(rgb, copy=False, nan=0)
+    rgb[numpy.isnan(distance)] = 0
+    return rgb.astype("u1")
+
+
+def compare_geolocation_window(sc, chan, rows, cols, cache=False):
+    """Compare pytroll and EUM geolocation for a window
+
+    Like :func:`compare_geolocation`, but for a window of the channel's
+    area only, see :func:`get_lat_lon_pair_window`.
+
+    Returns:
+        ndarray [n_rows, n_cols, 3] RGB image for the window.
+    """
+
+    (pyt_lat, pyt_lon, eum_lat, eum_lon) = get_lat_lon_pair_window(
+            sc, chan, rows, cols, cache=cache)
 
     (heading, distance) = calc_heading_distance_accurate(
             eum_lat, eum_lon, pyt_lat, pyt_lon)
 
-    rgb = calc_rgb_from_heading_distance(heading, distance)
+    return numpy.asarray(calc_rgb_from_heading_distance(heading, distance))
 
-    return rgb
+
+def write_geolocation_comparison(sc, chan, out, tile_size=1024, fmt=None,
+                                 cache=False):
+    """Write comparison between pytroll and EUM geolocation tile by tile
+
+    Calculate the RGB image from :func:`compare_geolocation` one tile at a
+    time and write each tile to the output before calculating the next,
+    such that memory use depends on the tile size but not on the size of
+    the full disk.
+
+    A GeoTIFF is written as tiled, 8-bit RGB, and needs rasterio.  Zarr
+    output is an array of shape (n_rows, n_cols, 3) with RGB values
+    between 0 and 1 and one chunk per tile, and needs zarr.
+
+    Args:
+        sc (satpy.Scene)
+            satpy Scene object to use for the calculations.
+        chan (str)
+            Channel (or otherwise satpy dataset) for which to calculate the
+            geolocation.  Channel must be already loaded.
+        out (str or pathlib.Path)
+            Path to write to.
+        tile_size (int)
+            Number of rows and columns per tile.  For GeoTIFF, must be a
+            multiple of 16.
+        fmt (str)
+            Either "geotiff" or "zarr".  If not given, use "zarr" if
+            ``out`` ends with ``.zarr``, "geotiff" otherwise.
+        cache (bool)
+            If true, use cached lat/lon grids, see :func:`get_cached_grids`.
+    Returns:
+        pathlib.Path to output written.
+    """
+    out = pathlib.Path(out)
+    if fmt is None:
+        fmt = "zarr" if out.suffix == ".zarr" else "geotiff"
+    if fmt == "geotiff":
+        writer = _write_tiles_geotiff
+    elif fmt == "zarr":
+        writer = _write_tiles_zarr
+    else:
+        raise ValueError(f"Unknown output format: {fmt:s}")
+    ar = sc[chan].area
+    windows = list(iter_windows(ar.shape, tile_size))
+    tiles = ((rows, cols,
+              compare_geolocation_window(sc, chan, rows, cols, cache=cache))
+             for (rows, cols) in windows)
+    with profiling.stage("compute") as rec:
+        rec["n_tiles"] = len(windows)
+        writer(out, ar, tiles, tile_size)
+    return out
+
+
+def _write_tiles_geotiff(out, ar, tiles, tile_size):
+    """Write RGB tiles to a tiled GeoTIFF
+    """
+    import rasterio
+    import rasterio.transform
+    import rasterio.windows
+    (n_rows, n_cols) = ar.shape
+    with rasterio.open(
+            out, "w", driver="GTiff", width=n_cols, height=n_rows,
+            count=3, dtype="uint8", crs=ar.crs.to_wkt(),
+            transform=rasterio.transform.from_bounds(
+                *ar.area_extent, n_cols, n_rows),
+            tiled=True, blockxsize=tile_size, blockysize=tile_size,
+            compress="deflate", photometric="RGB") as dst:
+        for (rows, cols, rgb) in tiles:
+            dst.write(
+                _to_uint8(rgb).transpose(2, 0, 1),
+                window=rasterio.windows.Window.from_slices(rows, cols))
+
+
+def _write_tiles_zarr(out, ar, tiles, tile_size):
+    """Write RGB tiles to a Zarr array
+    """
+    import zarr
+    z = zarr.open_array(
+            str(out), mode="w", shape=ar.shape + (3,), dtype="f4",
+            chunks=(tile_size, tile_size, 3), fill_value=math.nan)
+    z.attrs["crs"] = ar.crs.to_wkt()
+    z.attrs["area_extent"] = list(ar.area_extent)
+    for (rows, cols, rgb) in tiles:
+        z[rows, cols, :] = rgb
+
+
+def _to_uint8(rgb):
+    """Scale RGB between 0 and 1 to uint8, with invalid values as 0
+    """
+    return numpy.nan_to_num(
+            numpy.clip(numpy.round(rgb * 255), 0, 255)).astype("u1")
+
+
+class QuantileSketch:
+    """Approximate quantiles of a stream of non-negative values
+
+    Values are counted in logarithmically spaced buckets, such that each
+    quantile is estimated with a relative error of at most
+    ``relative_accuracy``, as in the DDSketch algorithm.  Memory use
+    depends on the ratio between the largest and smallest positive value
+    added, but not on the number of values.  Sketches can be updated with
+    arrays of values and merged with each other.
+
+    Args:
+        relative_accuracy (float)
+            Maximum relative error of estimated quantiles.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values):
+        """Add values to the sketch
+
+        Args:
+            values (array_like)
+                Non-negative values to add.  Non-finite values are
+                ignored.
+        """
+        values = numpy.asarray(values, dtype="f8").ravel()
+        values = values[numpy.isfinite(values)]
+        if (values < 0).any():
+            raise ValueError("Can only sketch non-negative values")
+        pos = values[values > 0]
+        idx = numpy.ceil(numpy.log(pos) / math.log(self.gamma))
+        for (i, n) in zip(*numpy.unique(idx.astype("i8"),
+                                        return_counts=True)):
+            self.buckets[int(i)] = self.buckets.get(int(i), 0) + int(n)
+        self.zero_count += values.size - pos.size
+        self.count += values.size
+
+    def merge(self, other):
+        """Add the values counted in another sketch to this one
+
+        Args:
+            other (QuantileSketch)
+                Sketch with the same relative accuracy.
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for (i, n) in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimate quantile
+
+        Args:
+            q (float)
+                Quantile, between 0 and 1.
+        Returns:
+            float, estimated quantile, or NaN if no values were added.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        cum = self.zero_count
+        if rank < cum:
+            return 0.0
+        for i in sorted(self.buckets):
+            cum += self.buckets[i]
+            if rank < cum:
+                break
+        return 2 * self.gamma**i / (self.gamma + 1)
+
+
+def calc_distance_statistics(sc, chan, quantiles=(0.5, 0.95), bins=None,
+                             n_rim=100, chunks=1024, relative_accuracy=0.01,
+                             cache=False, dtype="f4"):
+    """Calculate statistics of distance between pytroll and EUM geolocation
+
+    Calculate the distance between the geolocations from
+    :func:`get_lat_lon_pair` one block at a time, and accumulate
+    statistics over the blocks, such that the full distance field is never
+    held in memory.  Full disk quantiles are approximated with a
+    :class:`QuantileSketch`.  Statistics for the pixels nearest the rim
+    are exact.  Pixels nearest the rim are the valid pixels furthest from
+    the centre of the grid, counted in pixels.
+
+    Args:
+        sc (satpy.Scene)
+            satpy Scene object to use for the calculations.
+        chan (str)
+            Channel (or otherwise satpy dataset) for which to calculate the
+            geolocation.  Channel must be already loaded.
+        quantiles (Sequence[float])
+            Quantiles to calculate, between 0 and 1.
+        bins (array_like)
+            Edges of histogram bins in metre.  Distances outside are not
+            counted.  Defaults to 100 bins of 10 metre.
+        n_rim (int)
+            Number of pixels nearest the rim to calculate statistics for.
+        chunks (int, tuple, or str)
+            Blocks to process at once, a chunking policy as for
+            :func:`get_chunks`.
+        relative_accuracy (float)
+            Relative accuracy of the approximate full disk quantiles.
+        cache (bool)
+            If true, use cached lat/lon grids, see :func:`get_cached_grids`.
+        dtype (str)
+            Precision for the lat/lons, see :func:`get_lat_lon_pair`.
+    Returns:
+        dict with keys "count" (number of valid pixels), "median",
+        "quantiles" (dict mapping quantile to distance), "histogram"
+        (tuple of counts and bin edges), and "rim".  The latter is a dict
+        with the "median" and "quantiles" among the pixels nearest the rim
+        and their "distance".  Distances are in metre.
+    """
+    (pyt_lat, pyt_lon, eum_lat, eum_lon) = get_lat_lon_pair(
+            sc, chan, cache=cache, chunks=chunks, dtype=dtype)
+    bins = numpy.arange(0, 1001, 10) if bins is None else numpy.asarray(bins)
+    with profiling.stage("compute") as rec:
+        rec["n_blocks"] = math.prod(pyt_lat.numblocks)
+        sketch = QuantileSketch(relative_accuracy)
+        hist = numpy.zeros(bins.size - 1, dtype="i8")
+        rim_r = numpy.empty(0, dtype="f8")
+        rim_d = numpy.empty(0, dtype="f8")
+        (c_row, c_col) = ((n - 1) / 2 for n in pyt_lat.shape)
+        (row_starts, col_starts) = (numpy.cumsum((0,) + c[:-1])
+                                    for c in pyt_lat.chunks)
+        for idx in numpy.ndindex(*pyt_lat.numblocks):
+            blocks = dask.compute(*(a.blocks[idx] for a in
+                                    (eum_lat, eum_lon, pyt_lat, pyt_lon)))
+            (_, distance) = calc_heading_distance_accurate(*blocks)
+            distance = numpy.asarray(distance, dtype="f8")
+            sketch.add(distance)
+            hist += numpy.histogram(distance, bins=bins)[0]
+            (rows, cols) = numpy.ogrid[
+                    row_starts[idx[0]]:row_starts[idx[0]] + distance.shape[0],
+                    col_starts[idx[1]]:col_starts[idx[1]] + distance.shape[1]]
+            r = numpy.broadcast_to(
+                    numpy.hypot(rows - c_row, cols - c_col), distance.shape)
+            valid = numpy.isfinite(distance)
+            rim_r = numpy.concatenate([rim_r, r[valid]])
+            rim_d = numpy.concatenate([rim_d, distance[valid]])
+            if rim_r.size > n_rim:
+                keep = numpy.argpartition(rim_r, -n_rim)[-n_rim:]
+                (rim_r, rim_d) = (rim_r[keep], rim_d[keep])
+    return {
+        "count": sketch.count,
+        "median": sketch.quantile(0.5),
+        "quantiles": {q: sketch.quantile(q) for q in quantiles},
+        "histogram": (hist, bins),
+        "rim": {
+            "median": numpy.median(rim_d) if rim_d.size else math.nan,
+            "quantiles": {q: (numpy.quantile(rim_d, q) if rim_d.size
+                              else math.nan)
+                          for q in quantiles},
+            "distance": rim_d}}
@@ -1,52 +1,856 @@
 """Utilities related to IO
 """
 
+import contextlib
+import datetime
+import hashlib
+import json
 import logging
+import os
+import pathlib
+import re
+import shutil
+import subprocess
 import tarfile
-import sattools.ptc
-import sattools.io
+import tempfile
+import time
+from . import profiling
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+_copy_bufsize = 16 * 1024 * 1024
+
+# External decompressors that use multiple cores, in order of preference.
+# lbzip2 decompresses any bzip2 stream block-parallel, pbzip2 only those
+# it has compressed itself, xz 5.4 or later decompresses multi-block
+# streams in parallel, and pigz uses separate threads for decompression,
+# reading, writing, and checksumming (gzip itself cannot be split).
+_parallel_decompressors = {
+    ".gz": [["pigz", "-d", "-c", "-p", "{threads:d}"]],
+    ".bz2": [["lbzip2", "-d", "-c", "-n", "{threads:d}"],
+             ["pbzip2", "-d", "-c", "-p{threads:d}"]],
+    ".xz": [["xz", "-d", "-c", "-T", "{threads:d}"]]}
+
+# directory in a cache entry with files converted by unpack_tgz_npy
+_npy_dir = ".npy"
+
+# HDF5 and netCDF4 attributes describing the file structure, not the data
+_internal_attrs = {"CLASS", "NAME", "DIMENSION_LIST", "REFERENCE_LIST",
+                   "_Netcdf4Dimid", "_Netcdf4Coordinates", "_NCProperties",
+                   "_nc3_strict"}
+
+# lock files of cache entries that this process holds while using them,
+# see _hold
+_in_use = {}
+
+_fci_pat = re.compile(
+        r"-(?P<product>FDHSI|HRFI)-.*-CHK-(?P<kind>BODY|TRAIL)-.*"
+        r"_(?P<start_time>\d{14})_\d{14}_.*"
+        r"_(?P<repeat_cycle>\d{4})_(?P<chunk>\d{4})\.nc$")
+
+# channels in each product, as named by the satpy fci_l1c_nc reader, with
+# their resolution in metre: FDHSI files contain all 16 channels at normal
+# resolution, HRFI files four of those at high resolution
+_product_channels = {
+    "FDHSI": {**{ch: 1000 for ch in ("vis_04", "vis_05", "vis_06",
+                                     "vis_08", "vis_09", "nir_13",
+                                     "nir_16", "nir_22")},
+              **{ch: 2000 for ch in ("ir_38", "wv_63", "wv_73", "ir_87",
+                                     "ir_97", "ir_105", "ir_123",
+                                     "ir_133")}},
+    "HRFI": {"vis_06": 500, "nir_22": 500, "ir_38": 1000, "ir_105": 1000}}
+
+
+def _get_cache_key(p, hash_content=False):
+    """Get key identifying archive contents
+
+    Derive a key from the archive's name, size, and modification time,
+    and optionally from a hash of its complete contents.
+    """
+    st = p.stat()
+    h = hashlib.sha256(f"{p.name:s}\0{st.st_size:d}\0{st.st_mtime_ns:d}"
+                       .encode("utf-8"))
+    if hash_content:
+        with p.open("rb") as fp:
+            for block in iter(lambda: fp.read(_copy_bufsize), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
 
-def _get_path_to_unpack_to(p):
+def _get_path_to_unpack_to(p, hash_content=False):
+    import sattools.io
     cd = sattools.io.get_cache_dir(subdir="fcitools")
-    return cd / p.name.replace(".", "_")
+    return cd / (p.name.replace(".", "_") + "-"
+                 + _get_cache_key(p, hash_content=hash_content))
+
+
+def _get_cache_budget(max_bytes=None):
+    """Get maximum cache size in bytes, or None for no limit
+    """
+    if max_bytes is None:
+        max_bytes = os.environ.get("FCITOOLS_CACHE_MAX_BYTES")
+    if max_bytes is None:
+        return None
+    if isinstance(max_bytes, str):
+        import dask.utils
+        return dask.utils.parse_bytes(max_bytes)
+    return int(max_bytes)
+
+
+def _get_index_path(cd):
+    return cd / "index.json"
+
+
+def _get_lock_path(p):
+    return p.with_name(p.name + ".lock")
+
+
+def _lock(p, flags):
+    """Open and lock the lock file associated with path p
+
+    Returns the open lock file, or None if the lock was not acquired
+    because it is held elsewhere and ``flags`` include ``LOCK_NB``.
+    """
+    lockfile = _get_lock_path(p)
+    while True:
+        fp = lockfile.open("a")
+        try:
+            fcntl.flock(fp, flags)
+        except BlockingIOError:
+            fp.close()
+            return None
+        # the lock file is removed when its entry is evicted; if that
+        # happened while waiting, lock the file that replaced it
+        try:
+            if os.stat(lockfile).st_ino == os.fstat(fp.fileno()).st_ino:
+                return fp
+        except FileNotFoundError:
+            pass
+        fp.close()
+
+
+@contextlib.contextmanager
+def _locked(p, blocking=True, shared=False):
+    """Hold a lock associated with path p
+
+    Lock a file next to p, such that other processes calling this with
+    the same path wait until the lock is released.  With ``shared``,
+    several processes may hold the lock at once, but not at the same time
+    as an exclusive lock.  Yields True if the lock was acquired, which is
+    always the case when blocking.  Where file locking is not available,
+    no lock is taken.
+    """
+    if fcntl is None:
+        yield True
+        return
+    fp = _lock(p, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+               | (0 if blocking else fcntl.LOCK_NB))
+    if fp is None:
+        yield False
+        return
+    with fp:
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _get_use_path(to):
+    return to.with_name(to.name + ".use")
+
+
+def _hold(to):
+    """Hold a shared lock on cache entry ``to`` until released
+
+    The entry is not evicted while the lock is held, see
+    :func:`_cache_register`.  Must be called with the lock for ``to``
+    held, such that the entry cannot be evicted before.
+    """
+    if fcntl is None or to in _in_use:
+        return
+    _in_use[to] = _lock(_get_use_path(to), fcntl.LOCK_SH)
+
+
+def release_unpacked():
+    """Release cache entries used by this process
+
+    Entries returned by :func:`unpack_tgz`, :func:`iter_unpack_tgz`, and
+    :func:`unpack_tgz_npy` are protected from eviction by other
+    processes, and by this one, until this is called or the process
+    exits.  Call this when done with the files.
+    """
+    while _in_use:
+        (_, fp) = _in_use.popitem()
+        fp.close()
+
+
+def _read_index(cd):
+    """Read cache index, mapping entry names to sizes and last use
+    """
+    try:
+        with _get_index_path(cd).open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning(f"Corrupt cache index in {cd!s}, rebuilding")
+        return {}
+
+
+def _write_index(cd, index):
+    tmp = _get_index_path(cd).with_suffix(f".{os.getpid():d}.tmp")
+    with tmp.open("w", encoding="utf-8") as fp:
+        json.dump(index, fp, indent=1, sort_keys=True)
+    os.replace(tmp, _get_index_path(cd))
+
+
+def _get_size(d):
+    return sum(p.stat().st_size for p in d.rglob("*") if p.is_file())
+
+
+def _cache_lookup(to):
+    """Check if cache entry exists, and mark it as used if so
+    """
+    cd = to.parent
+    with _locked(_get_index_path(cd)):
+        index = _read_index(cd)
+        if to.name not in index:
+            if not to.exists():
+                return False
+            # created before the index was, or the index was lost
+            index[to.name] = {"bytes": _get_size(to)}
+        elif not to.exists():
+            del index[to.name]
+            _write_index(cd, index)
+            return False
+        index[to.name]["last_used"] = time.time()
+        _write_index(cd, index)
+    return True
 
 
-def unpack_tgz(path_to_tgz):
+def _cache_register(to, source, max_bytes=None):
+    """Register a new or grown cache entry and evict old ones
+
+    Record the size of cache entry ``to``, then remove least recently
+    used entries until the total size fits in the budget.  The entry
+    ``to`` itself is never removed, nor are entries that are being
+    populated or are in use, by this or another process, see
+    :func:`_evict`.
+    """
+    cd = to.parent
+    budget = _get_cache_budget(max_bytes)
+    with _locked(_get_index_path(cd)):
+        index = _read_index(cd)
+        index[to.name] = {"bytes": _get_size(to), "source": str(source),
+                          "last_used": time.time()}
+        total = sum(v["bytes"] for v in index.values())
+        for name in sorted(index, key=lambda k: index[k].get("last_used", 0)):
+            if budget is None or total <= budget:
+                break
+            if name == to.name:
+                continue
+            if not _evict(cd / name):
+                continue
+            total -= index.pop(name)["bytes"]
+        _write_index(cd, index)
+    if budget is not None and total > budget:
+        logger.warning(f"Cache at {cd!s} exceeds budget of {budget:d} "
+                       f"bytes after adding {to.name:s}")
+
+
+def _evict(d):
+    """Remove cache entry d, unless it is locked
+
+    Take non-blocking exclusive locks on the entry, which fail while it
+    is being populated, and on its use lock, which fail while it is in
+    use, see :func:`_hold`.  Remove the entry and its lock files.
+    Returns True if removed.  Must be called with the index locked.
+    """
+    with contextlib.ExitStack() as stack:
+        for p in (d, _get_use_path(d)):
+            if not stack.enter_context(_locked(p, blocking=False)):
+                logger.debug(f"Not evicting {d.name:s}, in use")
+                return False
+        logger.debug(f"Evicting {d.name:s} from cache at {d.parent!s}")
+        shutil.rmtree(d, ignore_errors=True)
+        for p in (d, _get_use_path(d)):
+            _get_lock_path(p).unlink(missing_ok=True)
+    return True
+
+
+def _get_mode(path_to_tgz, stream=False):
+    sep = "|" if stream else ":"
+    if path_to_tgz.suffix == ".tar":
+        return "r" + sep
+    elif path_to_tgz.suffix in {".bz2", ".gz", ".xz"}:
+        return "r" + sep + path_to_tgz.suffix[1:]
+    else:
+        raise ValueError(f"Not a gz/bz2/lzma file: {path_to_tgz!s}")
+
+
+class DecompressorError(OSError):
+    """External decompressor failed to decompress an archive
+    """
+
+
+def _get_decompressor(suffix, threads):
+    """Get command for parallel decompressor, if available
+    """
+    for cmd in _parallel_decompressors.get(suffix, []):
+        if shutil.which(cmd[0]) is not None:
+            return [c.format(threads=threads) for c in cmd]
+    return None
+
+
+@contextlib.contextmanager
+def _open_tar(path_to_tgz, stream=False, threads=None):
+    """Open a tar archive, decompressing in parallel if possible
+
+    If ``threads`` is larger than one and a suitable multi-core
+    decompressor is installed, run it in a subprocess and read the tar
+    stream from its output.  Otherwise, open the archive with the
+    standard library, which decompresses on a single core.  When a
+    decompressor is used, the archive is always opened in stream mode.
+
+    Raises DecompressorError if the external decompressor fails.
+    """
+
+    threads = threads or os.cpu_count() or 1
+    mode = _get_mode(path_to_tgz, stream=stream)
+    cmd = _get_decompressor(path_to_tgz.suffix, threads) if threads > 1 \
+        else None
+    if cmd is None:
+        with tarfile.open(path_to_tgz, mode) as tf:
+            yield tf
+        return
+    logger.debug(f"Decompressing {path_to_tgz!s} with {' '.join(cmd):s}")
+    with path_to_tgz.open("rb") as src, \
+            tempfile.TemporaryFile() as err, \
+            subprocess.Popen(cmd, stdin=src, stdout=subprocess.PIPE,
+                             stderr=err) as proc:
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tf:
+                yield tf
+            # drain padding after the end-of-archive marker
+            while proc.stdout.read(_copy_bufsize):
+                pass
+        except tarfile.ReadError as e:
+            proc.kill()
+            raise DecompressorError(
+                    f"Cannot read output of {cmd[0]:s} for "
+                    f"{path_to_tgz!s}") from e
+        except BaseException:
+            proc.kill()
+            raise
+        if proc.wait() != 0:
+            err.seek(0)
+            raise DecompressorError(
+                    f"{cmd[0]:s} failed on {path_to_tgz!s} with exit code "
+                    f"{proc.returncode:d}: {err.read().decode().strip():s}")
+
+
+def parse_fci_filename(name):
+    """Parse the name of an FCI chunk file
+
+    Extract product, file kind, sensing start time, repeat cycle, and
+    chunk number from the name of an FCI L1c chunk file, such as
+    ``W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-FDHSI-FD--CHK-``
+    ``BODY--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_20130804120330_``
+    ``20130804120345_N__T_0072_0001.nc``.
+
+    Args:
+
+        name (str):
+            Name of the file, may include a leading directory.
+
+    Returns:
+
+        dict with keys ``product`` (str, FDHSI or HRFI), ``kind`` (str,
+        BODY or TRAIL), ``start_time`` (datetime.datetime, sensing start
+        of the chunk), ``repeat_cycle`` (int, counted from the start of
+        the day), and ``chunk`` (int), or None if the name is not
+        recognised as an FCI chunk file.
+    """
+
+    m = _fci_pat.search(name)
+    if m is None:
+        return None
+    return {"product": m.group("product"),
+            "kind": m.group("kind"),
+            "start_time": datetime.datetime.strptime(
+                m.group("start_time"), "%Y%m%d%H%M%S"),
+            "repeat_cycle": int(m.group("repeat_cycle")),
+            "chunk": int(m.group("chunk"))}
+
+
+def _member_selected(name, channels, chunks, resolutions=None):
+    """Check if archive member is needed for channels and chunks
+    """
+    if os.path.isabs(name) or ".." in name.split("/"):
+        return False
+    info = parse_fci_filename(name)
+    if info is None:
+        return False
+    if channels is not None and not _product_selected(
+            info["product"], channels, resolutions):
+        return False
+    if (chunks is not None
+            and info["kind"] == "BODY"
+            and info["chunk"] not in chunks):
+        return False
+    return True
+
+
+def _product_selected(product, channels, resolutions=None):
+    """Check if FCI product contains any of the channels
+
+    Optionally only at one of the resolutions.
+    """
+    return any(
+        ch in _product_channels[product]
+        and (resolutions is None
+             or _product_channels[product][ch] in resolutions)
+        for ch in channels)
+
+
+def unpack_tgz(path_to_tgz, threads=None, hash_content=False,
+               max_bytes=None):
     """Unpack a .tar.gz archive to a cache directory
 
-    Unpack a .tar.gz archive to a cache directory, unless a file from
-    the same path had already been unpacked to this location.  The
-    .tar.gz. must contain exactly one subdirectory.
+    Unpack a .tar.gz archive to a cache directory, unless the same
+    archive had already been unpacked to this location.  The .tar.gz.
+    must contain exactly one subdirectory.
+
+    Cache entries are identified by the name, size, and modification time
+    of the archive, and optionally by a hash of its contents, such that a
+    different or re-released archive with the same name is unpacked
+    again.  An index file in the cache directory records the size and
+    last use of each entry.  When the total size exceeds the budget,
+    least recently used entries are removed.
+
+    The archive is unpacked to a temporary directory, which is renamed
+    to its final name only after unpacking has completed, such that an
+    interrupted run never leaves behind an incomplete cache entry.  If
+    several processes request the same archive at once, one unpacks it
+    while the others wait and then use the result.  The entry is not
+    evicted while in use, that is, until :func:`release_unpacked`.
+
+    If available, decompression uses a multi-core decompressor (pigz,
+    lbzip2, pbzip2, or xz) in a subprocess.  If none is installed or it
+    fails, decompression falls back to the standard library.
 
     Args:
 
         path_to_tgz (str):
             Path to the ``.tar.gz`` file to be unpacked
 
+        threads (Optional[int]):
+            Number of threads for decompression.  Defaults to the number
+            of CPUs.  Pass 1 to always use the standard library.
+
+        hash_content (Optional[bool]):
+            Also identify the archive by a hash of its contents.  This
+            requires reading the complete archive on every call.
+
+        max_bytes (Optional[int or str]):
+            Size budget for the cache, such as ``50e9`` or ``"50 GB"``.
+            Defaults to the environment variable
+            ``FCITOOLS_CACHE_MAX_BYTES``, or no limit if that is not set.
+
     Returns:
 
         iterator with paths to files
     """
 
-    if path_to_tgz.suffix == ".tar":
-        mode = "r"
-    elif path_to_tgz.suffix in {".bz2", ".gz", ".xz"}:
-        mode = "r:" + path_to_tgz.suffix[1:]
-    else:
-        raise ValueError(f"Not a gz/bz2/lzma file: {path_to_tgz!s}")
-    to = _get_path_to_unpack_to(path_to_tgz)
-    if not to.exists():
-        logger.debug(f"Unpacking {path_to_tgz!s} to {to!s}")
-        to.mkdir(parents=True, exist_ok=False)
-        with tarfile.open(path_to_tgz, mode) as tf:
-            tf.extractall(to)
-    else:
-        logger.debug(f"Reading unpacked {path_to_tgz!s} from cache at {to!s}")
-    subdirs = list(to.iterdir())
+    _get_mode(path_to_tgz)  # fail early on unsupported suffix
+    to = _get_path_to_unpack_to(path_to_tgz, hash_content=hash_content)
+    with profiling.stage("unpack_tgz") as rec, _locked(to):
+        rec["cache_hit"] = _cache_lookup(to)
+        if not rec["cache_hit"]:
+            logger.debug(f"Unpacking {path_to_tgz!s} to {to!s}")
+            _extract_atomic(path_to_tgz, to, threads)
+            rec["bytes_read"] = os.path.getsize(path_to_tgz)
+            rec["bytes_decompressed"] = _get_size(to)
+            _cache_register(to, path_to_tgz, max_bytes=max_bytes)
+        else:
+            logger.debug(f"Reading unpacked {path_to_tgz!s} from cache "
+                         f"at {to!s}")
+        _hold(to)
+    subdirs = [d for d in to.iterdir() if d.name != _npy_dir]
     if len(subdirs) != 1:
         raise ValueError(f"Found {len(subdirs):d} files, expected "
                          "exactly one")
     return subdirs[0].iterdir()
+
+
+def _extract_atomic(path_to_tgz, to, threads):
+    """Extract archive to temporary directory, then rename
+
+    Must be called with the lock for ``to`` held.
+    """
+    # left behind by processes that were killed while extracting
+    for stale in to.parent.glob(f".{to.name:s}-*"):
+        logger.debug(f"Removing stale {stale!s}")
+        shutil.rmtree(stale, ignore_errors=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=f".{to.name:s}-",
+                                        dir=to.parent))
+    try:
+        try:
+            with _open_tar(path_to_tgz, threads=threads) as tf:
+                tf.extractall(tmp)
+        except DecompressorError as e:
+            logger.warning(f"{e!s}, falling back to single-core "
+                           "decompression")
+            shutil.rmtree(tmp)
+            tmp.mkdir()
+            with _open_tar(path_to_tgz, threads=1) as tf:
+                tf.extractall(tmp)
+        os.rename(tmp, to)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def iter_unpack_tgz(path_to_tgz, channels=None, chunks=None, threads=None,
+                    hash_content=False, max_bytes=None, resolutions=None):
+    """Unpack selected FCI files from an archive, one at a time
+
+    Stream through a ``.tar.gz`` (or ``.tar``, ``.tar.bz2``, ``.tar.xz``)
+    archive containing FCI test data and extract only those BODY and
+    TRAIL NetCDF files that are needed for the requested channels and
+    chunks.  The archive is decompressed exactly once, in a single pass,
+    and each path is yielded as soon as the corresponding file has been
+    written, such that the caller can start processing before the
+    archive has been read completely.
+
+    If the archive had already been fully unpacked with
+    :func:`unpack_tgz`, the selected files are taken from there without
+    decompressing anything.  Otherwise, files are extracted to a
+    separate cache directory, where files that had already been
+    extracted by an earlier call are reused.  While extracting, the
+    generator holds a lock on this directory, such that concurrent calls
+    for the same archive wait and then reuse the extracted files.  As
+    with :func:`unpack_tgz`, the files are not evicted until
+    :func:`release_unpacked`.
+
+    Args:
+
+        path_to_tgz (pathlib.Path):
+            Path to the archive.
+
+        channels (Optional[Collection[str]]):
+            Channels that are needed, named as by the satpy
+            ``fci_l1c_nc`` reader, such as ``vis_06``.  Only files from
+            FCI products (FDHSI, HRFI) containing at least one of those
+            channels will be extracted.  If not given, files from all
+            products are extracted.
+
+        chunks (Optional[Collection[int]]):
+            Numbers of BODY chunks that are needed.  If not given, all
+            chunks are extracted.  TRAIL files are always extracted.
+
+        threads (Optional[int]):
+            Number of threads for decompression, see :func:`unpack_tgz`.
+
+        hash_content (Optional[bool]):
+            Identify archive by contents, see :func:`unpack_tgz`.
+
+        max_bytes (Optional[int or str]):
+            Size budget for the cache, see :func:`unpack_tgz`.
+
+        resolutions (Optional[Collection[int]]):
+            Resolutions in metre at which the channels are needed.  FDHSI
+            files contain the channels at 1000 or 2000 metre, HRFI files
+            some of them at 500 or 1000 metre.  If not given, files with
+            the channels at any resolution are extracted, as satpy loads
+            the highest resolution available.
+
+    Yields:
+
+        pathlib.Path objects for extracted files, in archive order
+    """
+
+    _get_mode(path_to_tgz)  # fail early on unsupported suffix
+    full = _get_path_to_unpack_to(path_to_tgz, hash_content=hash_content)
+    with _locked(full, blocking=False) as acquired:
+        hit = acquired and _cache_lookup(full)
+        if hit:
+            _hold(full)
+    if hit:
+        logger.debug(f"Selecting from unpacked {path_to_tgz!s} in cache "
+                     f"at {full!s}")
+        for p in sorted(full.rglob("*")):
+            if p.is_file() and _member_selected(p.name, channels, chunks,
+                                                resolutions):
+                yield p
+        return
+    to = full.with_name(full.name + "_partial")
+    with _locked(to):
+        logger.debug(f"Streaming selected files from {path_to_tgz!s} "
+                     f"to {to!s}")
+        _cache_lookup(to)
+        _hold(to)
+        done = set()
+        try:
+            for p in _iter_extract(path_to_tgz, to, channels, chunks,
+                                   resolutions, threads):
+                done.add(p)
+                yield p
+        except DecompressorError as e:
+            logger.warning(f"{e!s}, falling back to single-core "
+                           "decompression")
+            # files completely written before the failure are neither
+            # written nor yielded again
+            for p in _iter_extract(path_to_tgz, to, channels, chunks,
+                                   resolutions, 1):
+                if p not in done:
+                    yield p
+        finally:
+            if to.exists():
+                _cache_register(to, path_to_tgz, max_bytes=max_bytes)
+
+
+def _iter_extract(path_to_tgz, to, channels, chunks, resolutions, threads):
+    """Extract selected members one by one, yielding their paths
+    """
+    with _open_tar(path_to_tgz, stream=True, threads=threads) as tf:
+        for member in tf:
+            if (not member.isfile()
+                    or not _member_selected(member.name, channels, chunks,
+                                            resolutions)):
+                continue
+            dest = to / member.name
+            if not dest.exists() or dest.stat().st_size != member.size:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                # write to a temporary name first, such that an
+                # interrupted extraction never leaves a truncated file
+                # under the final name
+                tmp = dest.with_name(dest.name + ".part")
+                with tf.extractfile(member) as src, tmp.open("wb") as dst:
+                    shutil.copyfileobj(src, dst, _copy_bufsize)
+                os.replace(tmp, dest)
+            yield dest
+
+
+def unpack_tgz_npy(path_to_tgz, hash_content=False, max_bytes=None,
+                   **kwargs):
+    """Unpack archive and convert NetCDF files to memory-mappable arrays
+
+    Unpack with :func:`unpack_tgz`, then convert each NetCDF file with
+    :func:`convert_to_npy`, unless converted by an earlier call.  The
+    converted files are stored in the cache entry of the archive, see
+    :func:`get_npy_path`, and counted towards its size.  Open them with
+    :func:`open_npy`, or read the NetCDF files with satpy and the data
+    from the converted files, see :mod:`fcitools.memmap`.  Either costs
+    no decoding, such that reruns on the same archive read data directly
+    from the page cache.
+
+    Args:
+
+        path_to_tgz (str):
+            Path to the ``.tar.gz`` file to be unpacked
+
+        hash_content, max_bytes:
+            See :func:`unpack_tgz`.
+
+        Remaining keyword arguments are passed on to :func:`unpack_tgz`.
+
+    Returns:
+
+        dict mapping the path of each unpacked NetCDF file to the
+        directory with its converted variables
+    """
+    paths = list(unpack_tgz(path_to_tgz, hash_content=hash_content,
+                            max_bytes=max_bytes, **kwargs))
+    to = _get_path_to_unpack_to(path_to_tgz, hash_content=hash_content)
+    converted = {}
+    with profiling.stage("convert_to_npy") as rec, _locked(to):
+        rec["n_converted"] = 0
+        for p in sorted(paths):
+            if p.suffix != ".nc":
+                continue
+            converted[p] = get_npy_path(p)
+            if not converted[p].exists():
+                convert_to_npy(p, converted[p])
+                rec["n_converted"] += 1
+        if rec["n_converted"]:
+            _cache_register(to, path_to_tgz, max_bytes=max_bytes)
+    return converted
+
+
+def get_npy_path(path):
+    """Get path to converted variables for unpacked NetCDF file
+
+    Args:
+
+        path (pathlib.Path):
+            NetCDF file as unpacked by :func:`unpack_tgz`.
+
+    Returns:
+
+        pathlib.Path to the directory where :func:`unpack_tgz_npy` stores
+        its variables, which may not exist.
+    """
+    path = pathlib.Path(path)
+    return path.parent.parent / _npy_dir / path.name
+
+
+def convert_to_npy(path, out):
+    """Convert NetCDF4/HDF5 file to one ``.npy`` file per variable
+
+    Write each variable, decompressed, to a ``.npy`` file, which can be
+    memory-mapped, under ``out`` in a directory tree following the groups
+    of the file.  Write an index ``index.json`` with, for each variable,
+    its dimensions and attributes, and the global attributes.  Dimensions
+    are named by the path of their dimension scale, such as
+    ``data/vis_06/measured/y``, so that dimensions in different groups
+    are distinct.  Raw values are stored, attributes such as
+    ``scale_factor`` are not applied.  Variables that cannot be
+    memory-mapped, such as strings, are left out.
+
+    The file is converted to a temporary directory, which is renamed to
+    ``out`` when complete.  Needs h5py.
+
+    Args:
+
+        path (pathlib.Path):
+            NetCDF4 or HDF5 file to convert.
+
+        out (pathlib.Path):
+            Directory to write to.  Must not exist.
+    """
+    import h5py
+    out = pathlib.Path(out)
+    if out.exists():
+        raise FileExistsError(f"Already converted: {out!s}")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=f".{out.name:s}-",
+                                        dir=out.parent))
+    index = {"variables": {}}
+    try:
+        with h5py.File(path, "r") as h5:
+            index["attrs"] = _get_attrs(h5)
+
+            def visit(name, obj):
+                if not isinstance(obj, h5py.Dataset):
+                    return
+                if obj.dtype.kind not in "biuf":
+                    logger.debug(f"Not converting {name:s} with dtype "
+                                 f"{obj.dtype!s}")
+                    return
+                if _is_netcdf_dimension(obj):
+                    return
+                dims = [_get_dim_name(obj, i) for i in range(obj.ndim)]
+                _save_variable(tmp, name, obj, dims, _get_attrs(obj),
+                               index)
+            h5.visititems(visit)
+        with (tmp / "index.json").open("w", encoding="utf-8") as fp:
+            json.dump(index, fp, indent=1)
+        os.rename(tmp, out)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    logger.debug(f"Converted {len(index['variables']):d} variables from "
+                 f"{path!s} to {out!s}")
+
+
+def _is_netcdf_dimension(obj):
+    """Check whether HDF5 dataset only defines a netCDF dimension
+    """
+    name = obj.attrs.get("NAME", b"")
+    return (isinstance(name, bytes) and name.startswith(
+        b"This is a netCDF dimension but not a netCDF variable"))
+
+
+def _get_dim_name(obj, i):
+    """Get name of dimension i of HDF5 dataset
+    """
+    if obj.is_scale:
+        return obj.name.lstrip("/")
+    scales = obj.dims[i]
+    if len(scales):
+        return scales[0].name.lstrip("/")
+    return f"{obj.name.lstrip('/'):s}/dim_{i:d}"
+
+
+def _get_attrs(obj):
+    """Get attributes of HDF5 object as JSON-serialisable dict
+    """
+    attrs = {}
+    for (k, v) in obj.attrs.items():
+        if k in _internal_attrs:
+            continue
+        if isinstance(v, bytes):
+            v = v.decode("utf-8", errors="replace")
+        elif hasattr(v, "tolist"):
+            v = v.tolist()
+        try:
+            json.dumps(v)
+        except TypeError:
+            continue
+        attrs[k] = v
+    return attrs
+
+
+def _save_variable(d, name, arr, dims, attrs, index,
+                   block_bytes=64 * 1024 * 1024):
+    """Save array-like to ``.npy`` file, block by block along the first axis
+
+    Adds an entry for the variable to ``index``.
+    """
+    from numpy.lib.format import open_memmap
+    fn = pathlib.Path(name + ".npy")
+    (d / fn).parent.mkdir(parents=True, exist_ok=True)
+    mm = open_memmap(d / fn, mode="w+", dtype=arr.dtype, shape=arr.shape)
+    if mm.ndim == 0:
+        mm[()] = arr[()]
+    else:
+        row_bytes = max(mm[:1].nbytes, 1)
+        n = max(block_bytes // row_bytes, 1)
+        for i in range(0, mm.shape[0], n):
+            mm[i:i + n] = arr[i:i + n]
+    mm.flush()
+    del mm
+    index["variables"][name] = {"file": fn.as_posix(), "dims": dims,
+                                "attrs": attrs}
+
+
+def open_npy(d, chunks="auto"):
+    """Open variables converted by :func:`convert_to_npy`
+
+    Each variable is memory-mapped and wrapped in a dask array, without
+    reading or copying any data until computed.
+
+    Args:
+
+        d (pathlib.Path):
+            Directory written by :func:`convert_to_npy`.
+
+        chunks (Optional):
+            Chunks for the dask arrays, see :func:`dask.array.from_array`.
+
+    Returns:
+
+        :class:`xarray.Dataset` with the global attributes, and variables
+        named by their paths within the original file, such as
+        ``data/vis_06/measured/effective_radiance``.  Variables that are
+        dimension scales are coordinates and read into memory.
+    """
+    import numpy
+    import xarray
+    import dask.array
+    d = pathlib.Path(d)
+    with (d / "index.json").open("r", encoding="utf-8") as fp:
+        index = json.load(fp)
+    variables = {}
+    for (name, var) in index["variables"].items():
+        mm = numpy.load(d / var["file"], mmap_mode="r")
+        variables[name] = xarray.Variable(
+                var["dims"], dask.array.from_array(mm, chunks=chunks),
+                attrs=var["attrs"])
+    return xarray.Dataset(variables, attrs=index["attrs"])
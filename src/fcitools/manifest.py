@@ -0,0 +1,162 @@
+"""Manifest of rendered outputs, for incremental rendering
+
+When rendering incrementally, :func:`fcitools.vis.show_testdata_from_dir`
+keeps a manifest file next to its outputs.  For each output, the manifest
+records what went into it: the input file fingerprints, the definitions of
+the dataset and area, the writer settings, and the versions of fcitools
+and satpy.  An output is up to date if it exists and its recorded entry
+equals the entry it would get now.
+
+Input files are fingerprinted by name, size, and modification time, which
+extracting from an archive preserves, see :func:`fcitools.ioutil.unpack_tgz`.
+Composites are fingerprinted by the class and attributes, such as
+prerequisites, of their compositors in the satpy configuration.
+"""
+
+import os
+import json
+import logging
+import pathlib
+
+from . import ioutil
+
+logger = logging.getLogger(__name__)
+
+manifest_name = "manifest.json"
+
+
+def get_manifest_path(d_out):
+    """Get path to manifest for output directory
+    """
+    return pathlib.Path(d_out) / manifest_name
+
+
+def get_input_fingerprints(files):
+    """Get fingerprints of input files
+
+    Args:
+        files (List[pathlib.Path]): Input files.
+
+    Returns:
+        Dict mapping each file name to a list with its size in bytes and
+        its modification time in nanoseconds.
+    """
+    fps = {}
+    for f in files:
+        st = os.stat(f)
+        fps[pathlib.Path(f).name] = [st.st_size, st.st_mtime_ns]
+    return dict(sorted(fps.items()))
+
+
+def get_composite_definitions(names, sensor="fci"):
+    """Get definitions of composites from the satpy configuration
+
+    Args:
+        names (List[str]): Names of datasets.
+        sensor (Optional[str]): Sensor for which composites are defined.
+
+    Returns:
+        Dict mapping each name to a string describing its compositors, or
+        to None if it is not a composite, such as a channel.
+    """
+    from satpy.composites.config_loader import \
+        load_compositor_configs_for_sensors
+    (comps, _) = load_compositor_configs_for_sensors([sensor])
+    defs = {}
+    for name in names:
+        found = sorted(
+                f"{type(comp).__module__:s}.{type(comp).__qualname__:s}: "
+                + repr(sorted((k, v) for (k, v) in comp.attrs.items()
+                              if k != "_satpy_id"))
+                for (did, comp) in comps.get(sensor, {}).items()
+                if did["name"] == name)
+        defs[name] = "\n".join(found) if found else None
+    return defs
+
+
+def get_entry(inputs, dataset, definition, area, **settings):
+    """Get manifest entry for one output
+
+    Args:
+        inputs (Dict): Input fingerprints, see
+            :func:`get_input_fingerprints`.
+        dataset (str): Name of the dataset written.
+        definition (Optional[str]): Definition of the dataset, see
+            :func:`get_composite_definitions`.
+        area (AreaDefinition or str): Area the dataset is resampled to, or
+            'native'.
+        Remaining keyword arguments are writer settings, which must be
+        serialisable to JSON.
+
+    Returns:
+        Dict, equal to the entry read back from the manifest for the same
+        output as long as nothing changed.
+    """
+    import satpy
+    from . import __version__
+    entry = {"inputs": inputs,
+             "dataset": dataset,
+             "definition": definition,
+             "area": str(area),
+             "settings": settings,
+             "fcitools": __version__,
+             "satpy": satpy.__version__}
+    # round trip such that tuples become lists, as when read back
+    return json.loads(json.dumps(entry))
+
+
+def read_manifest(d_out):
+    """Read manifest for output directory
+
+    Returns:
+        Dict mapping output filenames, relative to ``d_out``, to entries.
+        Empty if there is no manifest or it cannot be read.
+    """
+    p = get_manifest_path(d_out)
+    try:
+        with p.open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning(f"Corrupt manifest {p!s}, regenerating all outputs")
+        return {}
+
+
+def update_manifest(d_out, entries):
+    """Add or replace entries in manifest for output directory
+
+    The manifest is updated under a lock and replaced atomically, such
+    that several processes can write to the same output directory.
+
+    Args:
+        d_out (pathlib.Path): Output directory.
+        entries (Dict): Entries to add, as for :func:`read_manifest`.
+    """
+    p = get_manifest_path(d_out)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with ioutil._locked(p):
+        manifest = read_manifest(d_out)
+        manifest.update(entries)
+        tmp = p.with_suffix(f".{os.getpid():d}.tmp")
+        with tmp.open("w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+        os.replace(tmp, p)
+
+
+def is_up_to_date(d_out, fn, entry, manifest):
+    """Check whether output is up to date
+
+    Args:
+        d_out (pathlib.Path): Output directory.
+        fn (str): Output filename relative to ``d_out``.
+        entry (Dict): Entry the output would get now, see
+            :func:`get_entry`.
+        manifest (Dict): Manifest as read by :func:`read_manifest`.
+
+    Returns:
+        bool, true if the output exists and was written from the same
+        entry.
+    """
+    return (manifest.get(fn) == entry
+            and (pathlib.Path(d_out) / fn).exists())
@@ -0,0 +1,63 @@
+"""Reading FCI data from memory-mapped arrays with satpy
+
+Loading FCI data with satpy spends much of its time decompressing the
+NetCDF files, every run again.  :func:`fcitools.ioutil.unpack_tgz_npy`
+converts the unpacked files once to uncompressed arrays.  Within
+:func:`reader_config`, the satpy ``fci_l1c_nc`` reader opens FDHSI and HRFI
+files with :class:`FCIL1cMemmapFileHandler`, which reads the metadata from
+the NetCDF files as usual, but the data of converted variables from their
+memory-mapped arrays.  Results are the same as without conversion.
+
+Example::
+
+    converted = fcitools.ioutil.unpack_tgz_npy("testdata.tar.gz")
+    with fcitools.memmap.reader_config():
+        sc = satpy.Scene(filenames=[str(p) for p in converted],
+                         reader="fci_l1c_nc")
+    sc.load(["ir_105"])
+"""
+
+import pathlib
+import contextlib
+
+from satpy.readers.fci_l1c_nc import FCIL1cNCFileHandler
+
+from . import ioutil
+
+# satpy configuration directory with the reader configuration merged in
+_config_dir = pathlib.Path(__file__).parent / "etc" / "memmap"
+
+
+@contextlib.contextmanager
+def reader_config():
+    """Context in which satpy reads converted FCI files memory-mapped
+
+    Scenes created within the context read FDHSI and HRFI files with
+    :class:`FCIL1cMemmapFileHandler`, also after leaving the context.
+    """
+    import satpy
+    with satpy.config.set(config_path=[str(_config_dir)]
+                          + list(satpy.config.get("config_path"))):
+        yield
+
+
+class FCIL1cMemmapFileHandler(FCIL1cNCFileHandler):
+    """FCI L1c file handler reading data from memory-mapped arrays
+
+    Read files as :class:`satpy.readers.fci_l1c_nc.FCIL1cNCFileHandler`
+    does, but take the data of variables converted with
+    :func:`fcitools.ioutil.unpack_tgz_npy` from their memory-mapped arrays,
+    see :func:`fcitools.ioutil.get_npy_path`.  Files that are not
+    converted are read from NetCDF only.
+    """
+
+    def __init__(self, filename, filename_info, filetype_info, **kwargs):
+        super().__init__(filename, filename_info, filetype_info, **kwargs)
+        p = ioutil.get_npy_path(self.filename)
+        self.converted = ioutil.open_npy(p) if p.exists() else None
+
+    def _get_variable(self, key, val):
+        var = super()._get_variable(key, val)
+        if self.converted is not None and key in self.converted.variables:
+            var = var.copy(data=self.converted[key].data)
+        return var
@@ -0,0 +1,80 @@
+"""Compare FCI geolocation over many test data archives
+
+For each .tar.gz archive of FCI test data, compare the pytroll geolocation
+with the EUMETSAT geolocation and write difference statistics for all
+archives to a CSV or Parquet table.  Several archives can be processed in
+parallel.
+"""
+
+import sys
+import pathlib
+import argparse
+from .. import drift
+from .show_testdata import expand_paths
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+            "path", action="store", type=str, nargs="+",
+            help="Path to .tar.gz containing testdata.  Can be given "
+                 "multiple times and may contain glob patterns.")
+
+    parser.add_argument(
+            "out", action="store", type=pathlib.Path,
+            help="File to write table to.  Written as Parquet if ending "
+                 "in .parquet, which needs the parquet extra (pip install "
+                 "fcitools[parquet]), as CSV otherwise.")
+
+    parser.add_argument(
+            "--channel", action="store", type=str, default="vis_06",
+            help="Channel for which to compare geolocation.")
+
+    parser.add_argument(
+            "--reader", action="store", type=str, default="fci_l1c_nc",
+            help="Satpy reader to use.")
+
+    parser.add_argument(
+            "--quantiles", action="store", type=float, nargs="+",
+            default=[0.5, 0.95],
+            help="Quantiles of the difference to report.")
+
+    parser.add_argument(
+            "--n-rim", action="store", type=int, default=100,
+            help="Number of pixels nearest the rim to report "
+                 "statistics for.")
+
+    parser.add_argument(
+            "-j", "--jobs", action="store", type=int, default=1,
+            help="Number of archives to process in parallel, each in a "
+                 "worker process.")
+
+    return parser
+
+
+def parse_cmdline():
+    return get_parser().parse_args()
+
+
+def main():
+    p = parse_cmdline()
+    paths = expand_paths(p.path)
+    if not paths:
+        get_parser().error("no archives to process")
+    (rows, failed) = drift.compare_archives(
+            paths, p.channel, reader=p.reader, jobs=p.jobs,
+            quantiles=tuple(p.quantiles), n_rim=p.n_rim)
+    drift.write_table(rows, p.out)
+    for (path, err) in failed.items():
+        print(f"FAILED {path!s}: {err!s}")
+    print(f"Compared {len(paths):d} archives, {len(failed):d} failed, "
+          f"table written to {p.out!s}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Pre-warm the cache of resampling lookup tables
+
+Calculate and store the nearest neighbour lookup tables from the FCI full
+disk grids to the configured areas, such that later runs do not need to
+calculate them.
+"""
+
+import argparse
+from .. import vis
+from .. import resample
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+            "-a", "--areas", action="store", type=str,
+            nargs="+",
+            help="Areas for which to prepare lookup tables.  Defaults to "
+                 "all areas defined in fcitools.")
+
+    parser.add_argument(
+            "-r", "--resolutions", action="store", type=int,
+            nargs="+", choices=sorted(resample._fci_grids),
+            default=sorted(resample._fci_grids),
+            help="Resolutions of the FCI full disk grid, in m.")
+
+    parser.add_argument(
+            "--source-files", action="store", type=str,
+            nargs="+",
+            help="FCI files from which to take the source grids, instead "
+                 "of the built-in grid definitions for --resolutions.")
+
+    parser.add_argument(
+            "--channels", action="store", type=str,
+            nargs="+", default=["vis_06", "ir_105"],
+            help="Channels to load from --source-files to get their "
+                 "grids.")
+
+    parser.add_argument(
+            "--reader", action="store", type=str,
+            default="fci_l1c_nc",
+            help="Reader for --source-files.")
+
+    return parser
+
+
+def parse_cmdline():
+    return get_parser().parse_args()
+
+
+def get_source_areas(p):
+    if p.source_files is None:
+        return [resample.get_fci_fulldisk_area(res)
+                for res in p.resolutions]
+    return resample.get_source_areas(p.source_files, p.channels, p.reader)
+
+
+def main():
+    p = parse_cmdline()
+    if p.areas is None:
+        targets = vis.get_fcitools_areas()
+    else:
+        targets = vis.get_areas(p.areas)
+    for src in get_source_areas(p):
+        for (name, target) in targets.items():
+            if isinstance(target, str):  # native
+                continue
+            resample.get_index(src, target)
+            print("Prepared", name, "from", src.area_id, "at",
+                  resample.get_index_path(src, target))
+
+
+if __name__ == "__main__":
+    main()
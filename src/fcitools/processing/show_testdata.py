@@ -1,12 +1,24 @@
 """Display images based on FCI testdata from .tar.gz archives
 
 From FCI testdata displayed in .tar.gz archives, display selected
-channels and composites for selected areas.
+channels and composites for selected areas.  Several archives can be
+processed in parallel.
 """
 
+import sys
+import glob
+import time
+import logging
 import pathlib
 import argparse
+import datetime
+import contextlib
+import concurrent.futures
 from .. import vis
+from .. import profiling
+from .. import scheduling
+
+logger = logging.getLogger(__name__)
 
 
 def get_parser():
@@ -15,8 +27,9 @@ def get_parser():
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument(
-            "path", action="store", type=pathlib.Path,
-            help="Path to .tar.gz containing testdata")
+            "path", action="store", type=str, nargs="+",
+            help="Path to .tar.gz containing testdata.  Can be given "
+                 "multiple times and may contain glob patterns.")
 
     parser.add_argument(
             "outdir", action="store", type=pathlib.Path,
@@ -53,6 +66,63 @@ def get_parser():
             help="Prepare three blank images showing only coastlines.  "
                  "Backgrounds will be white, black, and transparent.")
 
+    parser.add_argument(
+            "-j", "--jobs", action="store", type=int, default=1,
+            help="Number of archives to process in parallel, each in a "
+                 "worker process.  Workers are reused between archives.")
+
+    parser.add_argument(
+            "--scheduler", action="store", type=str, default="threads",
+            choices=scheduling.schedulers,
+            help="Dask scheduler to use for each archive.  "
+                 "'distributed' starts a local cluster and needs "
+                 "dask.distributed.")
+
+    parser.add_argument(
+            "--workers", action="store", type=int,
+            help="Number of dask threads or processes per archive.  "
+                 "Defaults to the number of CPUs.")
+
+    parser.add_argument(
+            "--memory-limit", action="store", type=str,
+            help="Memory limit per dask worker, such as '4 GB'.  Only "
+                 "with the distributed scheduler.")
+
+    parser.add_argument(
+            "--max-concurrent-writes", action="store", type=int,
+            help="Maximum number of output files to write at once.  "
+                 "Limits memory use, at the cost of reading data again "
+                 "for each batch of files.")
+
+    parser.add_argument(
+            "--format", action="store", type=str, default="tiff",
+            choices=vis.output_formats, dest="fmt",
+            help="Output format.  'cog' writes tiled and compressed Cloud "
+                 "Optimised GeoTIFFs with overviews, which needs "
+                 "rasterio.  'zarr' and 'netcdf' write the raw resampled "
+                 "datasets, with suffix .zarr or .nc instead of that from "
+                 "the filename pattern.")
+
+    parser.add_argument(
+            "--incremental", action="store_true",
+            help="Skip output files that are up to date according to a "
+                 "manifest kept in the output directory.  Files are "
+                 "regenerated when their input files, composite or area "
+                 "definitions, or the fcitools or satpy versions change.")
+
+    parser.add_argument(
+            "--memmap", action="store_true",
+            help="Convert the unpacked files once to uncompressed "
+                 "memory-mapped arrays and read the data from those, "
+                 "such that later runs do not decompress them again.  "
+                 "Needs h5py.")
+
+    parser.add_argument(
+            "--profile-report", action="store", type=pathlib.Path,
+            help="Write JSON report with wall time, CPU time, peak memory, "
+                 "bytes decompressed, and dask task counts per stage for "
+                 "each archive to this file.")
+
     return parser
 
 
@@ -60,17 +130,146 @@ def parse_cmdline():
     return get_parser().parse_args()
 
 
+def expand_paths(patterns):
+    """Expand paths and glob patterns to a sorted list of archives
+    """
+    paths = set()
+    for pat in patterns:
+        if glob.has_magic(pat):
+            found = glob.glob(pat)
+            if not found:
+                logger.warning(f"No archives match {pat:s}")
+            paths.update(found)
+        else:
+            paths.add(pat)
+    return [pathlib.Path(p) for p in sorted(paths)]
+
+
+def _process_archive(path, p):
+    """Process one archive, returning files written and profiled stages
+    """
+    with profiling.collect() as stages:
+        try:
+            res = vis.unpack_and_show_testdata(
+                    path,
+                    p.composites,
+                    p.channels,
+                    p.areas,
+                    p.outdir,
+                    p.filename_pattern,
+                    p.coastline_dir,
+                    p.show_only_coastlines,
+                    max_concurrent_writes=p.max_concurrent_writes,
+                    incremental=p.incremental,
+                    fmt=p.fmt,
+                    memmap=p.memmap)
+        except Exception as e:
+            e.stages = stages
+            raise
+    return (res, stages)
+
+
+def _init_worker(scheduler, workers, memory_limit):
+    """Start the dask scheduler in a worker process
+
+    The scheduler is used for all archives the process handles, and shut
+    down when the process exits.
+    """
+    import multiprocessing.util
+    stack = contextlib.ExitStack()
+    stack.enter_context(
+            scheduling.use_scheduler(scheduler, workers, memory_limit))
+    # unlike atexit handlers, this runs when a pool worker exits
+    multiprocessing.util.Finalize(None, stack.close, exitpriority=0)
+
+
+def process_archives(paths, p):
+    """Process archives, possibly in parallel
+
+    Process each archive in ``paths`` with the settings in the parsed
+    command-line ``p``.  With more than one job, archives are distributed
+    over a pool of worker processes, each of which handles several
+    archives in turn.  The dask scheduler is started once, in each worker
+    process or around processing all archives, and not for every
+    archive.  A failure for one archive does not affect the others.
+
+    Returns:
+        Dict mapping each path to a tuple with either the files written or
+        the exception raised, and the profiled stages, see
+        :mod:`fcitools.profiling`.
+    """
+    results = {}
+    if p.jobs <= 1 or len(paths) <= 1:
+        with scheduling.use_scheduler(
+                p.scheduler, p.workers, p.memory_limit):
+            for path in paths:
+                try:
+                    results[path] = _process_archive(path, p)
+                except Exception as e:
+                    logger.exception(f"Failed to process {path!s}")
+                    results[path] = (e, getattr(e, "stages", []))
+        return results
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(p.jobs, len(paths)),
+            initializer=_init_worker,
+            initargs=(p.scheduler, p.workers, p.memory_limit)) as executor:
+        futures = {executor.submit(_process_archive, path, p): path
+                   for path in paths}
+        for fut in concurrent.futures.as_completed(futures):
+            path = futures[fut]
+            try:
+                results[path] = fut.result()
+            except Exception as e:
+                logger.error(f"Failed to process {path!s}: {e!s}")
+                results[path] = (e, getattr(e, "stages", []))
+    return {path: results[path] for path in paths}
+
+
+def get_report(results, wall_time, cpu_time):
+    """Get run report from results of :func:`process_archives`
+    """
+    return {
+        "argv": sys.argv,
+        "finished": datetime.datetime.now().isoformat(),
+        "wall_time": wall_time,
+        "cpu_time": cpu_time,
+        "peak_rss": profiling.get_peak_rss(),
+        "archives": [
+            {"path": str(path),
+             "status": "failed" if isinstance(res, Exception) else "ok",
+             "error": str(res) if isinstance(res, Exception) else None,
+             "stages": stages}
+            for (path, (res, stages)) in results.items()]}
+
+
 def main():
+    p = parse_cmdline()
     from satpy.utils import debug_on
     debug_on()
-    p = parse_cmdline()
-    fn = vis.unpack_and_show_testdata(
-            p.path,
-            p.composites,
-            p.channels,
-            p.areas,
-            p.outdir,
-            p.filename_pattern,
-            p.coastline_dir,
-            p.show_only_coastlines)
-    print("Files written:", fn)
+    paths = expand_paths(p.path)
+    if not paths:
+        get_parser().error("no archives to process")
+    (t0, c0) = (time.perf_counter(), time.process_time())
+    results = process_archives(paths, p)
+    if p.profile_report is not None:
+        profiling.write_report(
+                get_report(results, time.perf_counter() - t0,
+                           time.process_time() - c0),
+                p.profile_report)
+    failed = 0
+    for (path, (res, _)) in results.items():
+        if isinstance(res, Exception):
+            failed += 1
+            print(f"FAILED {path!s}: {res!s}")
+        elif isinstance(res, vis.IncrementalResult):
+            print(f"OK {path!s}, files written:", res.written,
+                  "files up to date:", res.skipped)
+        else:
+            print(f"OK {path!s}, files written:", res)
+    print(f"Processed {len(results):d} archives, {failed:d} failed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
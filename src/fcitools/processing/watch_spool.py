@@ -0,0 +1,110 @@
+"""Render images from FCI chunk files as they arrive in a spool directory
+
+Watch a directory where FCI chunk files arrive, and render the selected
+channels and composites for each area and repeat cycle as soon as the
+chunk files covering that area have arrived.  Runs until interrupted.
+"""
+
+import pathlib
+import argparse
+from .. import vis
+from .. import spool
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument(
+            "spool", action="store", type=pathlib.Path,
+            help="Directory where FCI chunk files arrive.  Files should "
+                 "appear under their final name only when complete.")
+
+    parser.add_argument(
+            "outdir", action="store", type=pathlib.Path,
+            help="Directory where to write resulting images.")
+
+    parser.add_argument(
+            "--composites", action="store", type=str,
+            nargs="*",
+            default=[],
+            help="Composites to generate")
+
+    parser.add_argument(
+            "--channels", action="store", type=str,
+            nargs="*",
+            default=[],
+            help="Channels to generate.  Should be FCI channel labels.")
+
+    parser.add_argument(
+            "-a", "--areas", action="store", type=str,
+            nargs="+", required=True,
+            help="Areas for which to generate those.")
+
+    parser.add_argument(
+            "--filename-pattern", action="store", type=str,
+            default="{label:s}_{area:s}_{dataset:s}.tiff",
+            help="Filename pattern for output files.  The label is the "
+                 "date and repeat cycle.")
+
+    parser.add_argument(
+            "--coastline-dir", action="store", type=str,
+            help="Path to directory with coastlines.")
+
+    parser.add_argument(
+            "--format", action="store", type=str, default="tiff",
+            choices=vis.output_formats, dest="fmt",
+            help="Output format, see fci-show-testdata.")
+
+    parser.add_argument(
+            "--product", action="store", type=str, default="FDHSI",
+            choices=["FDHSI", "HRFI"],
+            help="FCI product to render.")
+
+    parser.add_argument(
+            "--interval", action="store", type=float, default=1,
+            help="Seconds between scans of the spool directory.")
+
+    parser.add_argument(
+            "--min-age", action="store", type=float, default=0,
+            help="Only use files last modified at least this many seconds "
+                 "ago, for spools where files are written in place.")
+
+    parser.add_argument(
+            "--margin", action="store", type=int, default=1,
+            help="Number of chunks to wait for north and south of those "
+                 "covering an area.")
+
+    parser.add_argument(
+            "--max-cycles", action="store", type=int, default=6,
+            help="Number of most recent repeat cycles to keep track of.  "
+                 "Areas of older cycles are given up on.")
+
+    return parser
+
+
+def parse_cmdline():
+    return get_parser().parse_args()
+
+
+def main():
+    p = parse_cmdline()
+    from satpy.utils import debug_on
+    debug_on()
+    if p.coastline_dir is None:
+        kwargs = {}
+    else:
+        kwargs = {"path_to_coastlines": p.coastline_dir}
+    watcher = spool.SpoolWatcher(
+            p.spool, p.composites, p.channels, p.areas, p.outdir,
+            p.filename_pattern, product=p.product, min_age=p.min_age,
+            margin=p.margin, max_cycles=p.max_cycles, fmt=p.fmt, **kwargs)
+    try:
+        watcher.run(p.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
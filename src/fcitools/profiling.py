@@ -0,0 +1,105 @@
+"""Per-stage timing and memory instrumentation
+
+Functions in fcitools mark their stages with :func:`stage`.  Normally this
+records nothing.  Within :func:`collect`, each stage records its wall
+time, CPU time, and peak memory, plus stage-specific quantities such as
+bytes decompressed or dask task counts, such that the results can be
+written to a machine-readable report.
+
+Example::
+
+    with fcitools.profiling.collect() as stages:
+        fcitools.vis.unpack_and_show_testdata(...)
+    fcitools.profiling.write_report({"stages": stages}, "report.json")
+"""
+
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:  # not on POSIX
+    resource = None
+
+# list of finished stages while collecting, None otherwise
+_records = None
+# stages currently open, innermost last
+_open = []
+
+
+def get_peak_rss():
+    """Get peak resident memory of this process so far, in bytes
+
+    Returns None if not available on this platform.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect stages within this context
+
+    Yields:
+        List to which a dict is appended for each stage when it finishes.
+        See :func:`stage` for the contents.
+    """
+    global _records
+    previous = _records
+    _records = []
+    try:
+        yield _records
+    finally:
+        _records = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Mark a stage to be measured
+
+    When collecting (see :func:`collect`), measure the stage and add a
+    record on exit.  The record contains the stage ``name``, the name of
+    the enclosing ``parent`` stage, if any, the ``wall_time`` and
+    ``cpu_time`` in seconds, where CPU time is summed over all threads,
+    the ``peak_rss`` of the process in bytes at the end of the stage, and
+    ``peak_rss_increase``, by how much the stage raised it.
+
+    Yields:
+        Dict to which the caller may add stage-specific quantities.
+        When not collecting, the dict is discarded.
+    """
+    rec = {"stage": name}
+    if _records is None:
+        yield rec
+        return
+    records = _records
+    rec["parent"] = _open[-1]["stage"] if _open else None
+    rss0 = get_peak_rss()
+    (t0, c0) = (time.perf_counter(), time.process_time())
+    _open.append(rec)
+    try:
+        yield rec
+    finally:
+        _open.pop()
+        rec["wall_time"] = time.perf_counter() - t0
+        rec["cpu_time"] = time.process_time() - c0
+        rec["peak_rss"] = get_peak_rss()
+        rec["peak_rss_increase"] = (
+                None if rss0 is None else rec["peak_rss"] - rss0)
+        records.append(rec)
+
+
+def write_report(report, path):
+    """Write report to JSON file
+
+    Args:
+        report (dict): Report, such as containing lists of stages.
+        path (pathlib.Path): File to write to.
+    """
+    with open(path, "w") as fp:
+        json.dump(report, fp, indent=2, default=str)
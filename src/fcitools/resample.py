@@ -0,0 +1,239 @@
+"""Resampling with persistent lookup tables
+
+The FCI full disk grid and the target areas do not change between repeat
+cycles, and neither does the mapping between them.  This module computes,
+for each pixel in a target area, the nearest pixel in the source grid,
+stores the result on disk, and memory-maps it on later runs, such that
+nearest-neighbour resampling reduces to an indexing operation.
+
+The lookup tables are stored in the fcitools cache directory and keyed on
+the source grid resolution and a hash of the geometry of both areas.  To fill
+the cache in advance for all configured areas, use the command
+``fci-prewarm-resample-cache``.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+import numpy
+import xarray
+import dask.array
+import pyresample.geometry
+from pyresample.resampler import BaseResampler
+import sattools.io
+
+logger = logging.getLogger(__name__)
+
+# lookup tables held in memory in this process, see hold_index
+_held = {}
+
+# FCI level 1c reference grid, per nominal resolution in m: angular
+# pixel size and the offset of the scan angles in rad, and the number of
+# pixels per line and column
+_fci_grids = {
+    500: (1.39717881644274e-05, 1.55596818893146e-01, 22272),
+    1000: (2.79435763233999e-05, 1.55603804756852e-01, 11136),
+    2000: (5.58871526031607e-05, 1.55617776423501e-01, 5568)}
+
+# projection of the FCI level 1c files
+_fci_projection = {"a": 6378137.0, "lon_0": 0.0, "h": 35786400.0,
+                   "rf": 298.257223563, "proj": "geos", "units": "m",
+                   "sweep": "y"}
+
+
+def get_fci_fulldisk_area(resolution):
+    """Get the area definition for the FCI full disk grid
+
+    Get the area as the satpy ``fci_l1c_nc`` reader does, such that lookup
+    tables calculated for it are used when resampling FCI data: upside
+    down, with the first line in the south, and with the ellipsoid and
+    extent from the projection and scan angles in the FCI files.
+
+    Args:
+        resolution (int):
+            Nominal resolution in m at the sub-satellite point, one of 500,
+            1000, or 2000.
+
+    Returns:
+        pyresample.geometry.AreaDefinition
+    """
+    (step, offset, size) = _fci_grids[resolution]
+    h = _fci_projection["h"]
+    # scan angles of the first and last pixel centres are stored as
+    # 1 and size times the step plus the offset; x points to the west
+    (x0, x1) = (-step + offset, -size * step + offset)
+    (y0, y1) = (step - offset, size * step - offset)
+    extent = (-(x0 + step / 2) * h, (y1 + step / 2) * h,
+              -(x1 - step / 2) * h, (y0 - step / 2) * h)
+    (value, unit) = ((resolution // 1000, "km") if resolution >= 1000
+                     else (resolution, "m"))
+    return pyresample.geometry.AreaDefinition(
+            f"mtg_fci_fdss_{value:d}{unit:s}",
+            "MTG FCI Full Disk Scanning Service area definition with "
+            f"{value:d} {unit:s} resolution",
+            "", dict(_fci_projection), size, size, extent)
+
+
+def get_cache_dir():
+    """Get directory where lookup tables are stored
+    """
+    cd = sattools.io.get_cache_dir(subdir="fcitools") / "resample"
+    cd.mkdir(parents=True, exist_ok=True)
+    return cd
+
+
+def _update_grid_hash(area, h):
+    """Update hash with grid geometry of area
+
+    Hash the projection, shape, and extent rounded to the metre, such that
+    areas read from files and those from :func:`get_fci_fulldisk_area`,
+    which may differ by rounding errors, share lookup tables.
+    """
+    h.update(area.crs_wkt.encode("utf-8"))
+    h.update(numpy.array(area.shape))
+    h.update(numpy.array(area.area_extent).round())
+    return h
+
+
+def get_index_path(source_area, target_area):
+    """Get path to lookup table for source and target area
+    """
+    h = _update_grid_hash(source_area, hashlib.sha1())
+    _update_grid_hash(target_area, h)
+    res = abs(round(source_area.pixel_size_x))
+    return get_cache_dir() / (
+            f"{target_area.area_id:s}-{res:d}m-{h.hexdigest()[:16]:s}.npy")
+
+
+def calc_index(source_area, target_area):
+    """Calculate nearest source pixel for each target pixel
+
+    Project each target pixel centre to the source grid and find the
+    source pixel containing it.  This is the nearest pixel in the source
+    projection plane.  Near pixel boundaries, it may differ by one pixel
+    from the nearest pixel by distance on the Earth's surface, which is
+    what the KD-tree based resamplers select.
+
+    Args:
+        source_area (AreaDefinition): Source grid.
+        target_area (AreaDefinition): Target grid.
+
+    Returns:
+        int32 ndarray with shape ``(2, n_rows, n_cols)`` of the target
+        area, containing source rows and columns, or -1 where the target
+        pixel is not covered by the source grid.
+    """
+    (lons, lats) = target_area.get_lonlats()
+    (cols, rows) = source_area.get_array_indices_from_lonlat(lons, lats)
+    return numpy.stack([numpy.ma.filled(rows, -1),
+                        numpy.ma.filled(cols, -1)]).astype("i4")
+
+
+def get_index(source_area, target_area):
+    """Get lookup table from cache, calculating it if needed
+
+    Args:
+        source_area (AreaDefinition): Source grid.
+        target_area (AreaDefinition): Target grid.
+
+    Returns:
+        Memory-mapped lookup table as described in :func:`calc_index`, or
+        the table in memory if held with :func:`hold_index`.
+    """
+    p = get_index_path(source_area, target_area)
+    if p in _held:
+        return _held[p]
+    if not p.exists():
+        logger.debug("Calculating resampling lookup table from "
+                     f"{source_area.area_id:s} to {target_area.area_id:s}")
+        idx = calc_index(source_area, target_area)
+        (fd, tmp) = tempfile.mkstemp(suffix=".npy", dir=p.parent)
+        with os.fdopen(fd, "wb") as fp:
+            numpy.save(fp, idx)
+        os.replace(tmp, p)
+    else:
+        logger.debug(f"Reading resampling lookup table from {p!s}")
+    return numpy.load(p, mmap_mode="r")
+
+
+def hold_index(source_area, target_area):
+    """Get lookup table and hold it in memory in this process
+
+    Get the lookup table with :func:`get_index`, calculating it if needed,
+    and read it into memory, where later calls of :func:`get_index` in
+    this process, such as by :class:`CachedNearestResampler`, find it.
+    For long-running processes, such as :class:`fcitools.spool.SpoolWatcher`.
+
+    Args:
+        source_area (AreaDefinition): Source grid.
+        target_area (AreaDefinition): Target grid.
+
+    Returns:
+        Lookup table as described in :func:`calc_index`.
+    """
+    p = get_index_path(source_area, target_area)
+    if p not in _held:
+        _held[p] = numpy.array(get_index(source_area, target_area))
+    return _held[p]
+
+
+def get_source_areas(files, channels=("vis_06", "ir_105"),
+                     reader="fci_l1c_nc"):
+    """Get source grids as read from FCI files
+
+    Args:
+        files (List[str]): FCI files, such as one or more chunk files of a
+            repeat cycle.  The full disk grids are obtained also if not all
+            chunks are given.
+        channels (Sequence[str]): Channels to load to get their grids.
+            The default channels are on both grids of the FDHSI and of the
+            HRFI products.
+        reader (Optional[str]): satpy reader for the files.
+
+    Returns:
+        List of distinct AreaDefinition objects.
+    """
+    import satpy
+    sc = satpy.Scene(filenames=[str(f) for f in files], reader=reader)
+    sc.load(list(channels))
+    areas = []
+    for ch in channels:
+        if sc[ch].attrs["area"] not in areas:
+            areas.append(sc[ch].attrs["area"])
+    return areas
+
+
+class CachedNearestResampler(BaseResampler):
+    """Nearest neighbour resampler using persistent lookup tables
+
+    Resampler that can be passed to :meth:`satpy.Scene.resample` as the
+    ``resampler`` argument.  On first use for a combination of source and
+    target area, it calculates a lookup table with :func:`calc_index` and
+    stores it on disk.  Later uses memory-map the stored table.
+
+    The source area must be an AreaDefinition.  Pass ``reduce_data=False``
+    to :meth:`satpy.Scene.resample`, such that the source area is the full
+    grid and lookup tables can be shared between runs.
+    """
+
+    def precompute(self, **kwargs):
+        self.index = get_index(self.source_geo_def, self.target_geo_def)
+
+    def compute(self, data, fill_value=numpy.nan, **kwargs):
+        (rows, cols) = self.index
+        valid = rows >= 0
+        rows = numpy.where(valid, rows, 0)
+        cols = numpy.where(valid, cols, 0)
+        arr = dask.array.asarray(data.data)
+        if arr.ndim == 2:
+            res = arr.vindex[rows, cols]
+        else:
+            res = dask.array.stack([a.vindex[rows, cols] for a in arr])
+        res = dask.array.where(valid, res, fill_value)
+        return xarray.DataArray(
+                res, dims=data.dims,
+                coords={k: v for (k, v) in data.coords.items()
+                        if not {"y", "x"} & set(v.dims)},
+                attrs=data.attrs.copy())
@@ -0,0 +1,60 @@
+"""Selection of the dask scheduler
+
+Choose which dask scheduler computes results, how many workers it uses,
+and, for a local distributed cluster, how much memory each worker may use.
+
+Example::
+
+    with fcitools.scheduling.use_scheduler(
+            "distributed", workers=4, memory_limit="4 GB"):
+        fcitools.vis.unpack_and_show_testdata(...)
+"""
+
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+schedulers = ("threads", "processes", "distributed")
+
+
+@contextlib.contextmanager
+def use_scheduler(scheduler="threads", workers=None, memory_limit=None):
+    """Use a dask scheduler within this context
+
+    Args:
+        scheduler (str):
+            One of "threads" (dask's default), "processes", or
+            "distributed" for a local cluster of worker processes, which
+            needs dask.distributed.
+        workers (Optional[int]):
+            Number of threads or processes.  Defaults to the number of
+            CPUs.
+        memory_limit (Optional[int or str]):
+            Memory limit per worker, such as ``"4 GB"``.  Only enforced
+            with "distributed", where workers first spill to disk and are
+            eventually restarted when exceeding it.  Ignored with a
+            warning otherwise.
+
+    Yields:
+        None, or the ``distributed.Client`` for "distributed".
+    """
+    import dask
+    if scheduler not in schedulers:
+        raise ValueError(f"Unknown scheduler: {scheduler!s}, expected one "
+                         f"of {', '.join(schedulers):s}")
+    if scheduler != "distributed":
+        if memory_limit is not None:
+            logger.warning("Memory limit is only enforced with the "
+                           "distributed scheduler, ignoring for "
+                           f"{scheduler:s}")
+        with dask.config.set(scheduler=scheduler, num_workers=workers):
+            yield None
+        return
+    from dask.distributed import Client, LocalCluster
+    kwargs = {} if memory_limit is None else {"memory_limit": memory_limit}
+    with LocalCluster(n_workers=workers, threads_per_worker=1,
+                      processes=True, **kwargs) as cluster, \
+            Client(cluster) as client:
+        logger.debug(f"Computing on local cluster {cluster!s}")
+        yield client
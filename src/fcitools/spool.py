@@ -0,0 +1,250 @@
+"""Near-real-time rendering of FCI chunk files arriving in a spool directory
+
+FCI L1c data arrive as one file per chunk, south to north, over the ten
+minutes of a repeat cycle.  An area covers only some of the 40 BODY
+chunks, see :func:`fcitools.vis.get_needed_chunks`, so it can be rendered
+as soon as those have arrived, without waiting for the full disk.
+
+:class:`SpoolWatcher` polls a spool directory and renders each configured
+area for each repeat cycle as soon as its chunks are in, with
+:func:`fcitools.vis.show_testdata_from_dir`.  It runs as a long-lived
+process, such that satpy is imported and the areas are read once.  When
+the first files arrive, it reads the source grids from them and prepares
+the resampling lookup tables to all areas, holding them in memory, such
+that rendering an area does not wait for its lookup table.
+
+Example::
+
+    watcher = fcitools.spool.SpoolWatcher(
+            "/data/spool", ["natural_color"], [], ["tenerifegomera"],
+            "/data/images")
+    watcher.run(interval=1)
+"""
+
+import os
+import time
+import logging
+import pathlib
+
+from . import ioutil
+from . import resample
+from . import vis
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolWatcher:
+    """Render areas as soon as the chunk files covering them have arrived
+
+    Args:
+        spool (pathlib.Path):
+            Directory where FCI chunk files arrive.  Files must appear
+            under their final name when complete, such as by renaming,
+            or be older than ``min_age``.
+        composites (List[str]):
+            Composites to generate.
+        channels (List[str]):
+            Channels to generate.
+        regions (List[str]):
+            Names of areas to generate those for, see
+            :func:`fcitools.vis.get_areas`.
+        d_out (pathlib.Path):
+            Directory where to write images.
+        fn_out (Optional[str]):
+            Pattern of output filenames, see
+            :func:`fcitools.vis.show_testdata_from_dir`.  The ``label``
+            is the date and repeat cycle, such as ``20130804_0072``.
+        product (Optional[str]):
+            FCI product to render, FDHSI or HRFI.  Files for other
+            products are ignored.
+        min_age (Optional[float]):
+            Only consider files last modified at least this many seconds
+            ago.
+        margin (Optional[int]):
+            Number of chunks to wait for north and south of those covering
+            an area, see :func:`fcitools.vis.get_needed_chunks`.
+        max_cycles (Optional[int]):
+            Number of most recent repeat cycles to keep track of.  Files of
+            older cycles are ignored, and areas not complete by then are
+            not rendered.
+        Remaining keyword arguments are passed on to
+        :func:`fcitools.vis.show_testdata_from_dir`.
+    """
+
+    def __init__(self, spool, composites, channels, regions, d_out,
+                 fn_out="{label:s}_{area:s}_{dataset:s}.tiff",
+                 product="FDHSI", min_age=0, margin=1, max_cycles=6,
+                 **kwargs):
+        # import once, up front
+        import satpy  # noqa: F401
+        self.spool = pathlib.Path(spool)
+        self.composites = list(composites)
+        self.channels = list(channels)
+        self.d_out = pathlib.Path(d_out)
+        self.fn_out = fn_out
+        self.product = product
+        self.min_age = min_age
+        self.max_cycles = max_cycles
+        self.kwargs = kwargs
+        self.areas = vis.get_areas(regions)
+        # chunks covering each area, from the area registry
+        self.needed = {name: vis.get_needed_chunks([area], margin=margin)
+                       for (name, area) in self.areas.items()}
+        # per repeat cycle, the files and BODY chunks seen, and the areas
+        # rendered
+        self.files = {}
+        self.chunks = {}
+        self.done = {}
+        self.last_arrival = {}
+        self.prepared = False
+
+    def scan(self):
+        """Scan the spool directory for new files
+
+        Returns:
+            Set of keys of the repeat cycles for which new files arrived.
+            A key is a tuple with the date and the repeat cycle number.
+        """
+        now = time.time()
+        updated = set()
+        with os.scandir(self.spool) as it:
+            for entry in it:
+                info = ioutil.parse_fci_filename(entry.name)
+                if info is None or info["product"] != self.product:
+                    continue
+                key = (info["start_time"].date(), info["repeat_cycle"])
+                p = pathlib.Path(entry.path)
+                if key in self.files and p in self.files[key]:
+                    continue
+                st = entry.stat()
+                if now - st.st_mtime < self.min_age:
+                    continue
+                if key not in self.files:
+                    if self._expired(key):
+                        continue
+                    self._add_cycle(key)
+                self.files[key].add(p)
+                if info["kind"] == "BODY":
+                    self.chunks[key].add(info["chunk"])
+                self.last_arrival[key] = max(self.last_arrival[key],
+                                             st.st_mtime)
+                updated.add(key)
+        return updated
+
+    def _expired(self, key):
+        return (len(self.done) >= self.max_cycles
+                and key < min(self.done))
+
+    def _add_cycle(self, key):
+        self.files[key] = set()
+        self.chunks[key] = set()
+        self.done[key] = set()
+        self.last_arrival[key] = 0
+        while len(self.done) > self.max_cycles:
+            old = min(self.done)
+            missing = set(self.areas) - self.done[old]
+            if missing:
+                logger.warning(
+                    f"Giving up on {', '.join(sorted(missing)):s} for "
+                    f"{self._get_label(old):s}, chunks did not arrive")
+            for d in (self.files, self.chunks, self.done,
+                      self.last_arrival):
+                del d[old]
+
+    @staticmethod
+    def _get_label(key):
+        (date, repeat_cycle) = key
+        return f"{date:%Y%m%d}_{repeat_cycle:>04d}"
+
+    def prepare(self, key):
+        """Prepare resampling lookup tables for all areas
+
+        Read the source grids from the files of a repeat cycle, see
+        :func:`fcitools.resample.get_source_areas`, and hold the lookup
+        tables from those to each area in memory, see
+        :func:`fcitools.resample.hold_index`, calculating them if needed.
+        If the grids cannot be read from the files, try again when more
+        files arrive.
+        """
+        try:
+            sources = resample.get_source_areas(
+                    sorted(self.files[key]),
+                    reader=self.kwargs.get("reader", "fci_l1c_nc"))
+        except Exception as e:
+            logger.warning("Cannot read source grids to prepare lookup "
+                           f"tables, trying again later: {e!s}")
+            return
+        for src in sources:
+            for (name, area) in self.areas.items():
+                if isinstance(area, str):  # native
+                    continue
+                resample.hold_index(src, area)
+        logger.info(f"Prepared lookup tables for {len(self.areas):d} areas "
+                    f"from {len(sources):d} grids")
+        self.prepared = True
+
+    def get_ready(self, key):
+        """Get areas ready to render for a repeat cycle
+
+        Returns:
+            List of names of areas that are not rendered yet, but for which
+            all needed chunks have arrived.
+        """
+        return [name for name in self.areas
+                if name not in self.done[key]
+                and self.needed[name] <= self.chunks[key]]
+
+    def render(self, key, names):
+        """Render areas for a repeat cycle
+
+        Returns:
+            List of filenames written.  If rendering fails, the error is
+            logged and nothing is returned, without retrying.
+        """
+        label = self._get_label(key)
+        self.done[key].update(names)
+        try:
+            written = vis.show_testdata_from_dir(
+                    sorted(self.files[key]), self.composites, self.channels,
+                    {name: self.areas[name] for name in names}, self.d_out,
+                    self.fn_out, label=label, **self.kwargs)
+        except Exception:
+            logger.exception(f"Failed to render {', '.join(names):s} for "
+                             f"{label:s}")
+            return []
+        logger.info(f"Rendered {', '.join(names):s} for {label:s}, "
+                    f"{time.time() - self.last_arrival[key]:.1f} s after "
+                    "the last file arrived")
+        return written
+
+    def poll(self):
+        """Scan the spool directory once and render what is ready
+
+        Returns:
+            List of filenames written.
+        """
+        written = []
+        for key in sorted(self.scan()):
+            if not self.prepared:
+                self.prepare(key)
+            names = self.get_ready(key)
+            if names:
+                written.extend(self.render(key, names))
+        return written
+
+    def run(self, interval=1, n_polls=None):
+        """Poll the spool directory repeatedly
+
+        Args:
+            interval (float): Seconds to wait between polls.
+            n_polls (Optional[int]): Number of polls.  If not given, poll
+                forever.
+        """
+        logger.info(f"Watching {self.spool!s} for "
+                    f"{', '.join(self.areas):s}")
+        i = 0
+        while n_polls is None or i < n_polls:
+            self.poll()
+            i += 1
+            if n_polls is None or i < n_polls:
+                time.sleep(interval)
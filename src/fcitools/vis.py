@@ -1,12 +1,80 @@
 """Routines related to visualisation
 """
 
+import logging
 import pathlib
-import sattools.vis
-import sattools.ptc
+import collections
+import collections.abc
+import concurrent.futures
+from . import areas as _areas
 from . import ioutil
+from . import profiling
 
+logger = logging.getLogger(__name__)
 
+_n_chunks = _areas._n_chunks
+
+# backgrounds for images showing only coastlines
+_blanks = (("white", (1, 1, 1)),
+           ("black", (0, 0, 0)),
+           ("transparent", (0, 0, 0, 0)))
+
+# output formats, see show_testdata_from_dir
+output_formats = ("tiff", "cog", "zarr", "netcdf")
+_format_suffixes = {"zarr": ".zarr", "netcdf": ".nc"}
+
+# tile size in pixels for tiled output formats
+_tile_size = 512
+
+IncrementalResult = collections.namedtuple(
+        "IncrementalResult", ["written", "skipped"])
+
+
+def get_fcitools_areas():
+    """Get areas defined in fcitools
+
+    Returns:
+        Dict[str, AreaDefinition] with the areas in ``etc/areas.yaml``,
+        from the area registry, see :mod:`fcitools.areas`.
+    """
+    return _areas.get_fcitools_areas()
+
+
+def get_areas(regions=None):
+    """Get area definitions for regions
+
+    Look up regions among the areas known to satpy and those defined
+    in the fcitools ``etc/areas.yaml``, using the area registry, see
+    :mod:`fcitools.areas`.
+
+    Args:
+        regions (Optional[List[str]]):
+            Names of regions/areas.  The special region 'native' means no
+            reprojection is applied and is passed on as is.  If not
+            given, return all known areas.
+
+    Returns:
+        Dict[str, AreaDefinition] with the requested areas, in the order
+        requested.
+
+    Raises:
+        KeyError if any region is not known.
+    """
+    all_areas = _areas.get_all_areas()
+    if regions is None:
+        return all_areas
+    areas = {}
+    for region in regions:
+        if region == "native":
+            areas[region] = region
+        elif region in all_areas:
+            areas[region] = all_areas[region]
+        else:
+            raise KeyError(f"Unknown area: {region:s}")
+    return areas
+
+
+@profiling.stage("unpack_and_show_testdata")
 def unpack_and_show_testdata(
         path_to_tgz,
         composites,
@@ -15,12 +83,21 @@ def unpack_and_show_testdata(
         d_out,
         fn_out="{area:s}_{dataset:s}.tiff",
         path_to_coastlines=None,
-        show_only_coastlines=False):
+        show_only_coastlines=False,
+        max_concurrent_writes=None,
+        incremental=False,
+        fmt="tiff",
+        memmap=False):
     """Unpack and show image from testdata
 
     Taking a ``.tar.gz``-archived file from the FCI test data, unpack such a
     file and write the desired composites and channels for each of the desired
-    regions.
+    regions.  Only the chunk files covering the regions, see
+    :func:`get_needed_chunks`, from FCI products containing the channels
+    are unpacked, see :func:`fcitools.ioutil.iter_unpack_tgz`; the channels
+    needed for composites are not known in advance, so with composites all
+    products are unpacked.  The unpacked files are protected from eviction
+    from the cache until done, see :func:`fcitools.ioutil.release_unpacked`.
 
     Args:
         path_to_tgz (str):
@@ -33,7 +110,9 @@ def unpack_and_show_testdata(
             List of channels (datasets) to be generated
 
         regions (List[str]):
-            List of regions/areas these shall be generated for
+            List of regions/areas these shall be generated for.  The
+            special region 'native' means no reprojection is applied.  If
+            None, generate for all known areas.
 
         d_out (pathlib.Path):
             Path to directory where output files shall be written.
@@ -49,19 +128,218 @@ def unpack_and_show_testdata(
         show_only_coastlines (Optional[bool]):
             If true, prepare an image showing only coastlines.
 
+        max_concurrent_writes (Optional[int]):
+            Maximum number of output files to write at once, see
+            :func:`show_testdata_from_dir`.
+
+        incremental (Optional[bool]):
+            If true, skip files that are up to date, see
+            :func:`show_testdata_from_dir`.
+
+        fmt (Optional[str]):
+            Output format, see :func:`show_testdata_from_dir`.
+
+        memmap (Optional[bool]):
+            If true, convert the unpacked files to memory-mapped arrays
+            with :func:`fcitools.ioutil.unpack_tgz_npy` and read the data
+            from those, see :func:`show_testdata_from_dir`.
+
     Returns:
-        List of filenames written
+        List of filenames written, or :class:`IncrementalResult` if
+        incremental.
     """
 
-    paths = ioutil.unpack_tgz(path_to_tgz)
-    areas = sattools.ptc.get_all_areas()
+    areas = get_areas(regions)
+    with profiling.stage("unpack") as rec:
+        if memmap:
+            paths = list(ioutil.unpack_tgz_npy(path_to_tgz))
+            reader = "fci_l1c_nc"
+        else:
+            paths = list(ioutil.iter_unpack_tgz(
+                path_to_tgz,
+                channels=_get_needed_channels(composites, channels),
+                chunks=get_needed_chunks(list(areas.values()))))
+            reader = "fci_l1c_fdhsi"
+        rec["n_files"] = len(paths)
     p = pathlib.Path(path_to_tgz).stem.split(".")[0]  # true stem
 
-    return sattools.vis.show(
-        paths, composites, channels, areas, d_out, fn_out, "fci_l1c_fdhsi",
-        path_to_coastlines, label=p, show_only_coastlines=show_only_coastlines)
+    try:
+        return show_testdata_from_dir(
+            paths, composites, channels, areas, d_out, fn_out,
+            path_to_coastlines, label=p,
+            show_only_coastlines=show_only_coastlines, reader=reader,
+            max_concurrent_writes=max_concurrent_writes,
+            incremental=incremental, fmt=fmt, memmap=memmap)
+    finally:
+        ioutil.release_unpacked()
+
+
+def _get_needed_channels(composites, channels):
+    """Get channels to unpack for composites and channels
+
+    Returns None, meaning all channels, if there are composites, as their
+    prerequisites are known only to satpy, or if channels are not given by
+    name.
+    """
+    known = set().union(*ioutil._product_channels.values())
+    if composites or not channels or not set(channels) <= known:
+        return None
+    return list(channels)
+
+
+def _get_area_items(regions):
+    """Get (name, area) pairs for regions
+
+    Regions may be a mapping of names to areas or a list of areas, area
+    names, or 'native'.
+    """
+    if isinstance(regions, collections.abc.Mapping):
+        return list(regions.items())
+    items = []
+    for region in regions:
+        if isinstance(region, str):
+            items.extend(get_areas([region]).items())
+        else:
+            items.append((region.area_id, region))
+    return items
+
+
+def _add_blanks(sc, channel):
+    """Add blank RGB(A) datasets to the scene, for coastlines only
+
+    Add datasets with a white, black, and transparent background, shaped
+    and geolocated like ``channel``.  Returns their names.
+    """
+    import xarray
+    import dask.array
+    ref = sc[channel]
+    names = []
+    for (name, values) in _blanks:
+        bands = "RGBA"[:len(values)]
+        data = dask.array.stack(
+            [dask.array.full(ref.shape, v, dtype="f4", chunks=ref.data.chunks)
+             for v in values])
+        dn = f"coastlines_{name:s}"
+        sc[dn] = xarray.DataArray(
+            data, dims=("bands", "y", "x"), coords={"bands": list(bands)},
+            attrs={"name": dn, "area": ref.attrs["area"],
+                   "start_time": ref.attrs.get("start_time"),
+                   "mode": bands})
+        names.append(dn)
+    return names
+
+
+def get_needed_chunks(areas, margin=1):
+    """Get numbers of FCI chunk files covering areas
+
+    Determine which of the FCI full disk BODY chunk files contain the
+    lines needed to cover the union of the areas.  Chunk boundaries are
+    approximated by dividing the full disk into chunks with equal numbers
+    of lines, so a margin of neighbouring chunks is added.  For areas in
+    the area registry, the chunks are looked up, see
+    :func:`fcitools.areas.get_area_chunks`.
+
+    Args:
+        areas (List[AreaDefinition]):
+            Areas to cover.  The special area 'native' needs the full disk.
+
+        margin (Optional[int]):
+            Number of chunks to add north and south of those needed.
+
+    Returns:
+        Set[int] of chunk numbers, where chunk 1 is southernmost.  Areas
+        not on the disk need no chunks.
+    """
+    if any(isinstance(area, str) for area in areas):  # native
+        return set(range(1, _n_chunks + 1))
+    needed = set()
+    for area in areas:
+        chunks = _areas.get_area_chunks(area)
+        if not chunks:
+            continue
+        needed.update(
+            c for c in range(min(chunks) - margin, max(chunks) + margin + 1)
+            if 1 <= c <= _n_chunks)
+    return needed
+
+
+def select_segments(files, areas, margin=1):
+    """Select FCI chunk files needed for areas
+
+    From FCI files, select those BODY chunk files that are needed to cover
+    the areas, as determined by :func:`get_needed_chunks`.  Other files,
+    including TRAIL files and files not recognised as FCI chunk files,
+    are always selected.
+
+    Args:
+        files (List[pathlib.Path]):
+            Paths to FCI files.
+
+        areas (List[AreaDefinition]):
+            Areas to cover.
 
+        margin (Optional[int]):
+            Number of chunks to add, see :func:`get_needed_chunks`.
 
+    Returns:
+        List[pathlib.Path] of selected files.
+    """
+    files = list(files)
+    needed = get_needed_chunks(areas, margin=margin)
+    selected = []
+    for f in files:
+        info = ioutil.parse_fci_filename(pathlib.Path(f).name)
+        if (info is None or info["kind"] != "BODY"
+                or info["chunk"] in needed):
+            selected.append(f)
+    logger.debug(f"Selected {len(selected):d} out of {len(files):d} files")
+    return selected
+
+
+def _get_writer_functions():
+    """Get satpy functions to compute and split delayed writer results
+    """
+    try:
+        from satpy.writers.core.compute import (compute_writer_results,
+                                                split_results)
+    except ImportError:  # satpy before 0.57
+        from satpy.writers import compute_writer_results, split_results
+    return (compute_writer_results, split_results)
+
+
+def count_tasks(results):
+    """Count tasks in delayed writer results
+
+    Count the tasks in the dask graphs of delayed writer results, such as
+    returned by :meth:`satpy.Scene.save_dataset` with ``compute=False``,
+    both per result and after merging all graphs.  The difference is the
+    number of tasks that are shared between results, such as reading and
+    resampling channels used in several outputs, which are computed once
+    if all results are computed together.
+
+    Args:
+        results (List): Delayed writer results.
+
+    Returns:
+        Tuple[int, int] with the total number of tasks summed over
+        results, and the number of unique tasks.
+    """
+    import dask
+    (_, split_results) = _get_writer_functions()
+    total = 0
+    unique = set()
+    for res in results:
+        (sources, _, delayeds) = split_results([res])
+        keys = set()
+        for c in sources + delayeds:
+            if dask.is_dask_collection(c):
+                keys.update(c.__dask_graph__().keys())
+        total += len(keys)
+        unique |= keys
+    return (total, len(unique))
+
+
+@profiling.stage("show_testdata_from_dir")
 def show_testdata_from_dir(
         files,
         composites,
@@ -71,15 +349,37 @@ def show_testdata_from_dir(
         fn_out,
         path_to_coastlines=None,
         label="",
-        show_only_coastlines=False):
+        show_only_coastlines=False,
+        reader="fci_l1c_nc",
+        segments=True,
+        max_concurrent_writes=None,
+        incremental=False,
+        fmt="tiff",
+        memmap=False):
     """Visualise a directory of EUM FCI test data
 
     From a directory containing EUMETSAT FCI test data, visualise composites
     and channels for the given regions/areas, possibly adding coastlines.
 
+    Resampling uses nearest neighbour lookup tables that are stored on
+    disk and reused in later runs, see :mod:`fcitools.resample`.  Unless
+    disabled, only those FCI chunk files that cover the regions are read,
+    see :func:`select_segments`.
+
+    Coastlines are rasterised once per area and coastline resolution and
+    cached on disk, see :mod:`fcitools.coastlines`.  They are blended into
+    each image, including the three backgrounds when showing only
+    coastlines.
+
+    Unless limited by ``max_concurrent_writes``, all outputs are written
+    in a single dask computation, such that channels shared between
+    composites are read once and each dataset is resampled once per
+    region.  The number of tasks saved by this is logged.
+
     Args:
-        files (List[pathlib.Path]):
-            Paths to files
+        files (Iterable[pathlib.Path]):
+            Paths to files, such as returned by
+            :func:`fcitools.ioutil.unpack_tgz`.
 
         composites (List[str]):
             List of composites to be generated
@@ -88,8 +388,10 @@ def show_testdata_from_dir(
             List of channels (datasets) to be generated
 
         regions (List[str]):
-            List of AreaDefinition objects these shall be generated for.
-            The special region 'native' means no reprojection is applied.
+            List of AreaDefinition objects or area names these shall be
+            generated for, or a mapping of names to AreaDefinition
+            objects.  The special region 'native' means no reprojection is
+            applied.
 
         d_out (pathlib.Path):
             Path to directory where output files shall be written.
@@ -110,10 +412,274 @@ def show_testdata_from_dir(
             one channel to be loaded.  Backgrounds will be white, black, and
             transparent.
 
+        reader (Optional[str]):
+            Satpy reader to use.
+
+        segments (Optional[bool]):
+            If true (default), read only the FCI chunk files that cover
+            the regions.  The reader fills the other segments with
+            missing values.  This selects from files already unpacked;
+            :func:`unpack_and_show_testdata` does not unpack the others
+            in the first place.
+
+        max_concurrent_writes (Optional[int]):
+            If given, write at most this many output files in one dask
+            computation, and compute the rest in further batches, in the
+            order of the regions.  This bounds the memory used, but tasks
+            shared between files in different batches, such as reading
+            the data, are repeated.  If not given, write all files at
+            once.
+
+        incremental (Optional[bool]):
+            If true, record for each file written what went into it in a
+            manifest in ``d_out``, see :mod:`fcitools.manifest`, and skip
+            files that exist and for which this has not changed: the
+            input files, the definitions of the composite and area, the
+            writer settings, and the versions of fcitools and satpy.
+            Only datasets and regions with files to write are loaded and
+            resampled.
+
+        fmt (Optional[str]):
+            Output format, one of :data:`output_formats`.  With "tiff"
+            (default), write images with the satpy geotiff writer.  With
+            "cog", write Cloud Optimised GeoTIFFs: tiled, compressed, and
+            with internal overviews.  With "zarr" or "netcdf", write the
+            resampled datasets themselves, without enhancement or
+            overlay, tiled and compressed, replacing the suffix from
+            ``fn_out`` by ``.zarr`` or ``.nc``.  For all formats, tiles
+            are written in parallel as they are computed, without holding
+            the full image in memory.
+
+        memmap (Optional[bool]):
+            If true, read the data of files converted with
+            :func:`fcitools.ioutil.unpack_tgz_npy` from their
+            memory-mapped arrays rather than decompressing them, see
+            :mod:`fcitools.memmap`.  Needs the ``fci_l1c_nc`` reader.
+            Files that are not converted are read as usual.
+
+    Returns:
+        List of filenames written, or if incremental,
+        :class:`IncrementalResult` with lists of filenames written and
+        skipped.
+    """
+    import satpy
+    from . import resample
+    if fmt not in output_formats:
+        raise ValueError(f"Unknown output format: {fmt!s}, expected one of "
+                         f"{', '.join(output_formats):s}")
+    if memmap and reader != "fci_l1c_nc":
+        raise ValueError("Reading memory-mapped arrays needs the "
+                         f"fci_l1c_nc reader, not {reader!s}")
+    # may be an iterator, which is used more than once below
+    files = list(files)
+    area_items = _get_area_items(regions)
+    if path_to_coastlines is None:
+        overlay = None
+    else:
+        overlay = {"coast_dir": str(path_to_coastlines), "color": "red"}
+    if show_only_coastlines:
+        datasets = [f"coastlines_{name:s}" for (name, _) in _blanks]
+        enhance = False
+    else:
+        datasets = list(composites) + list(channels)
+        enhance = None
+    todo = {name: list(datasets) for (name, _) in area_items}
+    skipped = []
+    entries = {}
+    if incremental:
+        from . import manifest
+        (todo, skipped, entries) = _get_todo(
+                files, datasets, area_items, d_out, fn_out, label, fmt,
+                reader=reader, overlay=overlay, enhance=enhance)
+        area_items = [(name, area) for (name, area) in area_items
+                      if todo[name]]
+        if not area_items:
+            logger.info(f"All {len(skipped):d} files up to date")
+            return IncrementalResult([], skipped)
+    with profiling.stage("load") as rec:
+        if segments:
+            files = select_segments(files, [ar for (_, ar) in area_items])
+        rec["n_files"] = len(files)
+        if memmap:
+            from . import memmap as mm
+            with mm.reader_config():
+                sc = satpy.Scene(
+                        filenames=[str(f) for f in files],
+                        reader=reader)
+        else:
+            sc = satpy.Scene(
+                    filenames=[str(f) for f in files],
+                    reader=reader)
+        if show_only_coastlines:
+            sc.load(list(composites) + list(channels))
+            _add_blanks(sc, channels[0])
+        else:
+            sc.load(sorted(set().union(*todo.values()),
+                           key=datasets.index))
+    written = []
+    keys = []
+    results = []
+    with profiling.stage("resample"):
+        for (name, area) in area_items:
+            if isinstance(area, str) and area == "native":
+                ls = sc.resample(resampler="native")
+            else:
+                ls = sc.resample(
+                        area, resampler=resample.CachedNearestResampler,
+                        reduce_data=False)
+            for dn in todo[name]:
+                key = _get_output_name(
+                        fn_out, fmt, area=name, dataset=dn, label=label)
+                fn = pathlib.Path(d_out) / key
+                results.append(_save(ls, dn, fn, fmt, overlay, enhance))
+                written.append(fn)
+                keys.append(key)
+    with profiling.stage("compute") as rec:
+        (total, unique) = count_tasks(results)
+        logger.info(f"Writing {len(written):d} files with {unique:d} tasks, "
+                    f"{total - unique:d} duplicate tasks shared between "
+                    "files")
+        rec.update(n_outputs=len(written), tasks=unique,
+                   shared_tasks=total - unique)
+        (compute_writer_results, _) = _get_writer_functions()
+        n = max_concurrent_writes or len(results) or 1
+        for i in range(0, len(results), n):
+            compute_writer_results(results[i:i + n])
+            if fmt == "cog":
+                _convert_to_cog(written[i:i + n])
+            if incremental:
+                manifest.update_manifest(
+                        d_out, {key: entries[key] for key in keys[i:i + n]})
+    if incremental:
+        return IncrementalResult(written, skipped)
+    return written
+
+
+def _get_output_name(fn_out, fmt, **fields):
+    """Get output filename relative to the output directory
+    """
+    name = fn_out.format(**fields)
+    if fmt in _format_suffixes:
+        name = str(pathlib.PurePath(name).with_suffix(_format_suffixes[fmt]))
+    return name
+
+
+def _get_cog_tmp(fn):
+    return fn.with_name(fn.name + ".tmp.tif")
+
+
+def _save(ls, dn, fn, fmt, overlay, enhance):
+    """Prepare delayed writing of a dataset in an output format
+
+    Returns a writer result as for :meth:`satpy.Scene.save_dataset`, to be
+    computed with ``compute_writer_results``.
+    """
+    if fmt in ("tiff", "cog"):
+        kwargs = {}
+        if fmt == "cog":
+            # GDAL creates COGs only by copying a complete file, so stream
+            # tiles into a tiled GeoTIFF first, see _convert_to_cog
+            fn = _get_cog_tmp(fn)
+            kwargs = {"tiled": True, "blockxsize": _tile_size,
+                      "blockysize": _tile_size, "compress": "DEFLATE",
+                      "num_threads": "ALL_CPUS"}
+        if overlay is not None:
+            return _save_with_coastlines(
+                    ls[dn], fn, overlay, enhance, **kwargs)
+        return ls.save_dataset(
+                dn, filename=str(fn), overlay=None, enhance=enhance,
+                compute=False, **kwargs)
+    if overlay is not None:
+        logger.warning(f"Not adding overlay to raw dataset in {fmt:s}")
+    ds = ls.to_xarray(datasets=[dn], include_lonlats=False)
+    # zarr needs regular chunks
+    ds = ds.chunk({"y": _tile_size, "x": _tile_size})
+    if fmt == "zarr":
+        return [ds.to_zarr(fn, mode="w", compute=False)]
+    return [ds.to_netcdf(
+        fn, encoding={v: {"zlib": True, "complevel": 4,
+                          "chunksizes": ds[v].data.chunksize}
+                      for v in ds.data_vars},
+        compute=False)]
+
+
+def _get_image_functions():
+    """Get satpy functions to load a writer and enhance a dataset
+    """
+    try:
+        from satpy.writers.core.config import load_writer
+        from satpy.enhancements.enhancer import get_enhanced_image
+    except ImportError:  # satpy before 0.57
+        from satpy.writers import load_writer, get_enhanced_image
+    return (load_writer, get_enhanced_image)
+
+
+def _save_with_coastlines(dataset, fn, overlay, enhance, **kwargs):
+    """Prepare delayed writing of an image with coastlines
+
+    Like :meth:`satpy.Scene.save_dataset` with an overlay, but blending in
+    coastlines rasterised once per area, see :mod:`fcitools.coastlines`.
+    """
+    from . import coastlines
+    (load_writer, get_enhanced_image) = _get_image_functions()
+    writer_name = ("geotiff" if pathlib.Path(fn).suffix in (".tif", ".tiff")
+                   else "simple_image")
+    (writer, save_kwargs) = load_writer(
+            writer_name, filename=str(fn), enhance=enhance, **kwargs)
+    img = get_enhanced_image(dataset.squeeze(), enhance=writer.enhancer)
+    img = coastlines.add_coastlines(
+            img, dataset.attrs["area"], overlay["coast_dir"],
+            color=overlay["color"])
+    return writer.save_image(
+            img, filename=str(fn), compute=False, **save_kwargs)
+
+
+def _convert_to_cog(fns):
+    """Convert streamed tiled GeoTIFFs to Cloud Optimised GeoTIFFs
+
+    GDAL reads the source block by block and builds the overviews, with
+    several threads per file and one file per thread.
+    """
+    import rasterio.shutil
+
+    def convert(fn):
+        tmp = _get_cog_tmp(fn)
+        rasterio.shutil.copy(
+                tmp, fn, driver="COG", compress="DEFLATE",
+                blocksize=_tile_size, overview_resampling="average",
+                num_threads="ALL_CPUS")
+        tmp.unlink()
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        list(executor.map(convert, fns))
+
+
+def _get_todo(files, datasets, area_items, d_out, fn_out, label, fmt,
+              **settings):
+    """Get files to write when rendering incrementally
+
     Returns:
-        List of filenames written
+        Tuple with a dict mapping each region name to the list of
+        datasets to write for it, a list of paths to files that are up to
+        date, and a dict with the manifest entries for all files.
     """
-    return sattools.vis.show(
-        files, composites, channels, regions, d_out, fn_out, "fci_l1c_nc",
-        path_to_coastlines, label=label,
-        show_only_coastlines=show_only_coastlines)
+    from . import manifest
+    inputs = manifest.get_input_fingerprints(files)
+    definitions = manifest.get_composite_definitions(datasets)
+    current = manifest.read_manifest(d_out)
+    todo = {}
+    skipped = []
+    entries = {}
+    for (name, area) in area_items:
+        todo[name] = []
+        for dn in datasets:
+            fn = _get_output_name(
+                    fn_out, fmt, area=name, dataset=dn, label=label)
+            entries[fn] = manifest.get_entry(
+                    inputs, dn, definitions[dn], area, fmt=fmt, **settings)
+            if manifest.is_up_to_date(d_out, fn, entries[fn], current):
+                skipped.append(pathlib.Path(d_out) / fn)
+            else:
+                todo[name].append(dn)
+    logger.debug(f"{len(skipped):d} files up to date, "
+                 f"{len(entries) - len(skipped):d} to write")
+    return (todo, skipped, entries)
@@ -35,3 +35,123 @@ def areas():
              'x_0': 0, 'y_0': 0},
             750, 300, (2500000, 4000000, 3000000, 40000000))
     return [ad]
+
+
+@pytest.fixture
+def fci_tfs(tmp_path):
+    """Archive with files named like FCI chunk files."""
+    ptd = tmp_path / "tartest2"
+    sd = ptd / "RC0072"
+    sd.mkdir(exist_ok=False, parents=True)
+    names = [f"W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-{prod:s}-"
+             f"FD--CHK-{kind:s}--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_"
+             f"20130804120330_20130804120345_N__T_0072_{chunk:>04d}.nc"
+             for (prod, kind, chunk) in
+             [("FDHSI", "BODY", i) for i in (1, 2, 3, 4, 11, 12, 13, 14)]
+             + [("FDHSI", "TRAIL", 41), ("HRFI", "BODY", 1)]]
+    for name in names + ["README.txt"]:
+        with (sd / name).open("wb") as fp:
+            fp.write(b"abcd")
+    tfn = ptd / "fci.tar.gz"
+    with tarfile.open(tfn, "w:gz") as tf:
+        tf.add(sd, arcname=sd.name)
+    return tfn
+
+
+_fci_channels = {
+        **{ch: 1000 for ch in ("vis_04", "vis_05", "vis_06", "vis_08",
+                               "vis_09", "nir_13", "nir_16", "nir_22")},
+        **{ch: 2000 for ch in ("ir_38", "wv_63", "wv_73", "ir_87", "ir_97",
+                               "ir_105", "ir_123", "ir_133")}}
+
+
+def _make_fci_channel(data, ch, resolution, nrows):
+    import numpy
+    import fcitools.resample
+    (step, offset, size) = fcitools.resample._fci_grids[resolution]
+    m = data.createGroup(ch).createGroup("measured")
+    m.createDimension("y", nrows)
+    m.createDimension("x", size)
+    r0 = size - nrows + 1
+    m.createVariable("start_position_row", "i4")[...] = r0
+    m.createVariable("end_position_row", "i4")[...] = size
+    for (k, v) in (("radiance_to_bt_conversion_coefficient_wavenumber",
+                    930.659),
+                   ("radiance_to_bt_conversion_coefficient_a", 0.9991),
+                   ("radiance_to_bt_conversion_coefficient_b", 0.1287),
+                   ("radiance_to_bt_conversion_constant_c1", 1.19104271e-16),
+                   ("radiance_to_bt_conversion_constant_c2", 0.01438775),
+                   ("radiance_unit_conversion_coefficient", 1.0),
+                   ("channel_effective_solar_irradiance", 1.0)):
+        m.createVariable(k, "f4")[...] = v
+    x = m.createVariable("x", "u2", ("x",))
+    x[:] = numpy.arange(1, size + 1)
+    x.setncatts({"scale_factor": -step, "add_offset": offset})
+    y = m.createVariable("y", "u2", ("y",))
+    y[:] = numpy.arange(r0, size + 1)
+    y.setncatts({"scale_factor": step, "add_offset": -offset})
+    er = m.createVariable("effective_radiance", "u2", ("y", "x"),
+                          zlib=True, fill_value=65535)
+    er.setncatts({"scale_factor": 0.005, "add_offset": 0.0,
+                  "units": "mW m-2 sr-1 (cm-1)-1",
+                  "valid_range": numpy.array([0, 4095], "u2"),
+                  "warm_scale_factor": 0.005, "warm_add_offset": 0.0,
+                  "long_name": "Effective radiance",
+                  "ancillary_variables": "pixel_quality"})
+    er.set_auto_maskandscale(False)
+    er[:] = numpy.arange(nrows * size).reshape(nrows, size) % 4000
+    for k in ("pixel_quality", "index_map"):
+        v = m.createVariable(k, "u2", ("y", "x"), zlib=True)
+        v.set_auto_maskandscale(False)
+        v[:] = 1
+
+
+@pytest.fixture
+def fci_nc(tmp_path):
+    """Minimal FCI FDHSI chunk file that the satpy reader can read.
+
+    Holds the northernmost rows of the full disk, 2 rows at 2 km and 4 at
+    1 km, with all variables the satpy ``fci_l1c_nc`` reader needs.
+    """
+    netCDF4 = pytest.importorskip("netCDF4")
+    sd = tmp_path / "fci" / "RC0072"
+    sd.mkdir(parents=True)
+    p = sd / ("W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-FDHSI-FD--"
+              "CHK-BODY--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_"
+              "20130804120330_20130804120345_N__T_0072_0040.nc")
+    with netCDF4.Dataset(p, "w") as nc:
+        nc.platform = "MTI1"
+        data = nc.createGroup("data")
+        data.createVariable("mtg_geos_projection", "i4").setncatts(
+                {"sweep_angle_axis": "y",
+                 "perspective_point_height": 35786400.0,
+                 "semi_major_axis": 6378137.0,
+                 "longitude_of_projection_origin": 0.0,
+                 "inverse_flattening": 298.257223563})
+        for (ch, res) in _fci_channels.items():
+            _make_fci_channel(data, ch, res, 4000 // res)
+        data.createVariable("swath_direction", "i1")[...] = 0
+        data.createVariable("swath_number", "i2")[...] = 1
+        nc.createDimension("index", 1)
+        nc.createVariable("index", "u2", ("index",))[:] = 1
+        nc.createVariable("time", "f8", ("index",))[:] = 0
+        for (g, k, v) in (
+                ("celestial", "earth_sun_distance", 1.5e8),
+                ("celestial", "subsolar_latitude", 10.),
+                ("celestial", "subsolar_longitude", 5.),
+                ("celestial", "sun_satellite_distance", 1.5e8),
+                ("platform", "platform_altitude", 35786400.),
+                ("platform", "subsatellite_latitude", 0.),
+                ("platform", "subsatellite_longitude", 0.)):
+            grp = nc.createGroup("state").createGroup(g)
+            if "index" not in grp.dimensions:
+                grp.createDimension("index", 1)
+            grp.createVariable(k, "f8", ("index",))[:] = v
+    return p
+
+
+@pytest.fixture(autouse=True)
+def release_unpacked():
+    yield
+    import fcitools.ioutil
+    fcitools.ioutil.release_unpacked()
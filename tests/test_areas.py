@@ -0,0 +1,70 @@
+"""Test the area registry
+"""
+
+import os
+import logging
+from unittest.mock import patch
+
+
+def test_get_registry(tmp_path, caplog, monkeypatch):
+    import fcitools.areas
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    monkeypatch.setattr(fcitools.areas, "_registry", None)
+    with caplog.at_level(logging.DEBUG):
+        reg = fcitools.areas.get_registry()
+        assert "Building area registry" in caplog.text
+    assert fcitools.areas.get_cache_path().exists()
+    assert fcitools.areas.get_registry() is reg
+    assert "crete" in reg.fcitools
+    assert "eurol" in reg.areas and "eurol" not in reg.fcitools
+    # read from disk in a new process
+    monkeypatch.setattr(fcitools.areas, "_registry", None)
+    caplog.clear()
+    with caplog.at_level(logging.DEBUG):
+        reg2 = fcitools.areas.get_registry()
+        assert "Building" not in caplog.text
+    assert reg2.areas["crete"] == reg.areas["crete"]
+    # rebuilt when an area file changes
+    yml = tmp_path / "areas.yaml"
+    yml.write_text(fcitools.areas._areas_file.read_text())
+    with patch("fcitools.areas._areas_file", yml), \
+            caplog.at_level(logging.DEBUG):
+        caplog.clear()
+        fcitools.areas.get_registry()
+        assert "Building" in caplog.text
+        caplog.clear()
+        fcitools.areas.get_registry()
+        assert "Building" not in caplog.text
+        os.utime(yml, ns=(0, 0))
+        fcitools.areas.get_registry()
+        assert "Building" in caplog.text
+    # corrupt cache
+    monkeypatch.setattr(fcitools.areas, "_registry", None)
+    fcitools.areas.get_cache_path().write_bytes(b"bork")
+    with caplog.at_level(logging.WARNING):
+        fcitools.areas.get_registry()
+        assert "Cannot read area registry" in caplog.text
+
+
+def test_chunks(areas):
+    import pyresample.geometry
+    import fcitools.areas
+    fa = fcitools.areas.get_fcitools_areas()
+    assert fcitools.areas.get_area_chunks(fa["crete"]) == {33}
+    assert fcitools.areas.get_area_chunks(fa["ileeuropa"]) == {12}
+    assert "crete" in fcitools.areas.get_areas_for_chunk(33)
+    assert "crete" not in fcitools.areas.get_areas_for_chunk(12)
+    assert fcitools.areas.get_areas_for_chunk(41) == frozenset()
+    # not registered, or registered under the same name but different
+    with patch("fcitools.areas.calc_chunks", autospec=True) as fac:
+        fcitools.areas.get_area_chunks(areas[0])
+        fac.assert_called_once_with(areas[0])
+        other = fa["crete"].copy(area_id="gavdos")
+        fcitools.areas.get_area_chunks(other)
+        fac.assert_called_with(other)
+    # not on the disk
+    ar = pyresample.geometry.AreaDefinition(
+            "pacific", "pacific", "pacific",
+            {"proj": "eqc", "ellps": "WGS84", "units": "m", "lon_0": 180},
+            10, 10, (-1e5, -1e5, 1e5, 1e5))
+    assert fcitools.areas.calc_chunks(ar) == frozenset()
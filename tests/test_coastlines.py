@@ -0,0 +1,76 @@
+"""Test coastline overlays
+"""
+
+import os
+from unittest.mock import patch
+
+import numpy
+
+
+def _get_area(res):
+    import pyresample.geometry
+    return pyresample.geometry.AreaDefinition(
+            "test", "test", "test",
+            {"proj": "eqc", "ellps": "WGS84", "units": "m"},
+            10, 10, (0, 0, 10 * res, 10 * res))
+
+
+def test_get_coast_resolution():
+    import pyresample.geometry
+    import fcitools.coastlines
+    assert [fcitools.coastlines.get_coast_resolution(_get_area(res))
+            for res in (30_000, 6000, 2000, 500, 100)] == list("clihf")
+    ar = pyresample.geometry.AreaDefinition(
+            "ll", "ll", "ll", {"proj": "longlat", "ellps": "WGS84"},
+            10, 10, (0, 0, 1, 1))
+    assert fcitools.coastlines.get_coast_resolution(ar) == "l"
+
+
+@patch("fcitools.coastlines.rasterise", autospec=True)
+def test_get_raster(fcr, tmp_path):
+    import fcitools.coastlines
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    fcr.return_value = numpy.eye(10, dtype="u1")
+    ar = _get_area(2000)
+    r1 = fcitools.coastlines.get_raster(ar, tmp_path)
+    r2 = fcitools.coastlines.get_raster(ar, tmp_path)
+    fcr.assert_called_once_with(ar, tmp_path, "i", 0.5)
+    numpy.testing.assert_array_equal(r1, r2)
+    assert isinstance(r2, numpy.memmap)
+    fcitools.coastlines.get_raster(ar, tmp_path, resolution="f")
+    fcitools.coastlines.get_raster(ar, tmp_path, width=1)
+    fcitools.coastlines.get_raster(_get_area(1000), tmp_path)
+    assert fcr.call_count == 4
+
+
+@patch("fcitools.coastlines.rasterise", autospec=True)
+def test_add_coastlines(fcr, tmp_path):
+    import xarray
+    import dask.array
+    from trollimage.xrimage import XRImage
+    import fcitools.coastlines
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    raster = numpy.zeros((10, 10), dtype="u1")
+    raster[0, :] = 255
+    raster[1, :] = 51
+    fcr.return_value = raster
+    data = numpy.full((4, 10, 10), 0.5, dtype="f4")
+    data[:, :, 0] = numpy.nan
+    data[3] = 0
+    img = XRImage(xarray.DataArray(
+        dask.array.from_array(data, chunks=5), dims=("bands", "y", "x"),
+        coords={"bands": list("RGBA")}))
+    res = fcitools.coastlines.add_coastlines(
+            img, _get_area(2000), tmp_path, color=(0, 0, 255))
+    assert res.mode == "RGBA"
+    assert res.data.chunks == img.data.chunks
+    out = res.data.values
+    numpy.testing.assert_allclose(out[:, 0, 0], [0, 0, 1, 1])
+    numpy.testing.assert_allclose(out[:, 1, 1], [0.4, 0.4, 0.6, 0.2])
+    numpy.testing.assert_array_equal(out[:, 2:, 1:], data[:, 2:, 1:])
+    assert numpy.isnan(out[:3, 2:, 0]).all()
+    res = fcitools.coastlines.add_coastlines(
+            XRImage(img.data.sel(bands=["R"]).assign_coords(bands=["L"])),
+            _get_area(2000), tmp_path)
+    assert res.mode == "RGB"
+    numpy.testing.assert_allclose(res.data.values[:, 0, 1], [1, 0, 0])
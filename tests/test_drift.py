@@ -0,0 +1,81 @@
+"""Test geolocation drift comparisons
+"""
+
+import os
+import datetime
+import pytest
+from unittest.mock import patch
+
+
+def _fake_stats(sc, chan, quantiles, n_rim, chunks, cache):
+    return {"count": 100, "median": 8.5,
+            "quantiles": {q: q * 100 for q in quantiles},
+            "rim": {"median": 73.0,
+                    "quantiles": {q: q * 300 for q in quantiles}}}
+
+
+@patch("fcitools.geo.calc_distance_statistics", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_compare_archive(sS, fgc, tfs, tmp_path):
+    import fcitools.drift
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    fgc.side_effect = _fake_stats
+    sS.return_value.start_time = datetime.datetime(2013, 8, 4, 12)
+    sS.return_value.__getitem__.return_value.area.resolution = (
+            -1000.0001, 1000.0001)
+    row = fcitools.drift.compare_archive(tfs[0], "vis_06")
+    assert len(sS.call_args[1]["filenames"]) == 3
+    sS.return_value.load.assert_called_once_with(["vis_06"])
+    assert fgc.call_args[1]["cache"]
+    assert row == {
+            "archive": "file.tar", "start_time": "2013-08-04T12:00:00",
+            "channel": "vis_06", "resolution": 1000, "count": 100,
+            "median": 8.5, "q0.5": 50, "q0.95": 95, "rim_median": 73.0,
+            "rim_q0.5": 150, "rim_q0.95": 285}
+
+
+@patch("fcitools.drift.compare_archive", autospec=True)
+def test_compare_archives(fdc, tmp_path):
+    import concurrent.futures
+    import fcitools.drift
+    paths = [tmp_path / f"rc{i:d}.tar.gz" for i in range(4)]
+
+    def compare(path, chan, reader, **kwargs):
+        if path == paths[1]:
+            raise ValueError("corrupt archive")
+        return {"archive": path.name, "start_time": "2020-04-01"}
+    fdc.side_effect = compare
+    (rows, failed) = fcitools.drift.compare_archives(paths, "vis_06")
+    assert [r["archive"] for r in rows] == [
+            "rc0.tar.gz", "rc2.tar.gz", "rc3.tar.gz"]
+    assert list(failed) == [paths[1]]
+    with patch("concurrent.futures.ProcessPoolExecutor",
+               concurrent.futures.ThreadPoolExecutor):
+        (rows2, failed2) = fcitools.drift.compare_archives(
+                paths, "vis_06", jobs=3, n_rim=5)
+    assert rows2 == rows
+    assert list(failed2) == [paths[1]]
+    assert fdc.call_args[1] == {"n_rim": 5}
+
+
+def test_write_table(tmp_path):
+    import csv
+    import fcitools.drift
+    rows = [{"archive": "a", "median": 1.5}, {"archive": "b", "median": 2}]
+    fcitools.drift.write_table(rows, tmp_path / "drift.csv")
+    with (tmp_path / "drift.csv").open() as fp:
+        assert list(csv.DictReader(fp)) == [
+                {"archive": "a", "median": "1.5"},
+                {"archive": "b", "median": "2"}]
+    fcitools.drift.write_table([], tmp_path / "empty.csv")
+    assert (tmp_path / "empty.csv").read_text().strip() == ""
+
+
+def test_write_table_parquet(tmp_path):
+    pandas = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    import fcitools.drift
+    rows = [{"archive": "a", "median": 1.5}, {"archive": "b", "median": 2}]
+    fcitools.drift.write_table(rows, tmp_path / "drift.parquet")
+    df = pandas.read_parquet(tmp_path / "drift.parquet")
+    assert list(df["archive"]) == ["a", "b"]
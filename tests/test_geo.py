@@ -1,3 +1,5 @@
+import pytest
+
 from unittest.mock import patch, MagicMock
 
 
@@ -32,3 +34,314 @@ def test_compare_geolocation():
             rtol=0.01)
 
     np.testing.assert_allclose(rgb2, np.zeros(shape=(3, 3, 3)))
+
+
+def test_iter_windows():
+    import fcitools.geo
+    wins = list(fcitools.geo.iter_windows((5, 3), tile_size=2))
+    assert wins == [(slice(0, 2), slice(0, 2)), (slice(0, 2), slice(2, 3)),
+                    (slice(2, 4), slice(0, 2)), (slice(2, 4), slice(2, 3)),
+                    (slice(4, 5), slice(0, 2)), (slice(4, 5), slice(2, 3))]
+
+
+def _get_sc_eumsecret():
+    """Get mocked scene and eumsecret module
+
+    Mocked EUMETSAT geolocation is the pytroll geolocation, displaced
+    northward by 0.1° in the lower half.
+    """
+    import numpy as np
+    import dask.array
+    import pyresample.geometry
+    sc = MagicMock()
+    ar = pyresample.geometry.AreaDefinition(
+            "tile", "tile", "tile",
+            {"proj": "eqc", "ellps": "WGS84", "units": "m"},
+            10, 10, (1000000, 1000000, 1100000, 1100000))
+    sc["vis_06"].area = ar
+    (lon, lat) = ar.get_lonlats(dtype="f4")
+    lat = lat + np.where(np.arange(ar.height) >= ar.height // 2,
+                         0.1, 0)[:, np.newaxis]
+
+    def pixcoord2geocoord(x, y, *args):
+        def f(x, y, a):
+            return a[x.astype("i4") - 1, y.astype("i4") - 1]
+        if isinstance(x, dask.array.Array):
+            return tuple(dask.array.map_blocks(f, x, y, a=a, dtype=a.dtype)
+                         for a in (lat, lon))
+        return (f(x, y, lat), f(x, y, lon))
+    fs = MagicMock()
+    fs.pixcoord2geocoord.side_effect = pixcoord2geocoord
+    return (sc, fs)
+
+
+def test_compare_geolocation_window():
+    import numpy as np
+    import fcitools.geo
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        rgb = fcitools.geo.compare_geolocation_window(
+                sc, "vis_06", slice(0, 10), slice(0, 10))
+        rgb2 = fcitools.geo.compare_geolocation_window(
+                sc, "vis_06", slice(8, 10), slice(3, 7))
+    assert rgb.shape == (10, 10, 3)
+    np.testing.assert_array_equal(rgb[:5], 0)
+    assert (rgb[5:, :, 2] > 0).all()
+    np.testing.assert_array_equal(rgb2, rgb[8:10, 3:7])
+
+
+def test_write_geolocation_comparison(tmp_path):
+    import numpy as np
+    import zarr
+    import fcitools.geo
+    import fcitools.profiling
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        ref = fcitools.geo.compare_geolocation_window(
+                sc, "vis_06", slice(0, 10), slice(0, 10))
+        fs.pixcoord2geocoord.reset_mock()
+        with fcitools.profiling.collect() as stages:
+            out = fcitools.geo.write_geolocation_comparison(
+                    sc, "vis_06", tmp_path / "comp.zarr", tile_size=4)
+    # the tiles are calculated while writing
+    assert [(st["stage"], st["n_tiles"]) for st in stages] == [
+            ("compute", 9)]
+    assert fs.pixcoord2geocoord.call_count == 9
+    assert max(c[0][0].size for c in
+               fs.pixcoord2geocoord.call_args_list) == 16
+    z = zarr.open_array(str(out), mode="r")
+    assert z.chunks == (4, 4, 3)
+    np.testing.assert_allclose(z[:], ref, rtol=1e-6)
+    with pytest.raises(ValueError):
+        fcitools.geo.write_geolocation_comparison(
+                sc, "vis_06", tmp_path / "comp.png", fmt="png")
+
+
+def test_write_geolocation_comparison_geotiff(tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    import fcitools.geo
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        out = fcitools.geo.write_geolocation_comparison(
+                sc, "vis_06", tmp_path / "comp.tif", tile_size=16)
+    with rasterio.open(out) as src:
+        assert src.count == 3
+        assert src.shape == (10, 10)
+        assert src.block_shapes == [(16, 16)] * 3
+        assert (src.read()[:, :5, :] == 0).all()
+
+
+def test_quantile_sketch():
+    import numpy as np
+    import fcitools.geo
+    rng = np.random.default_rng(42)
+    values = rng.lognormal(2, 1.5, size=10000)
+    values[:100] = 0
+    sk = fcitools.geo.QuantileSketch(relative_accuracy=0.01)
+    assert np.isnan(sk.quantile(0.5))
+    sk.add(values[:5000])
+    sk2 = fcitools.geo.QuantileSketch(relative_accuracy=0.01)
+    sk2.add(np.append(values[5000:], np.nan))
+    sk.merge(sk2)
+    assert sk.count == 10000
+    assert sk.quantile(0) == 0
+    for q in (0.1, 0.5, 0.95, 0.999):
+        np.testing.assert_allclose(
+                sk.quantile(q), np.quantile(values, q, method="lower"),
+                rtol=0.01)
+    with pytest.raises(ValueError):
+        sk.add([-1])
+    with pytest.raises(ValueError):
+        sk.merge(fcitools.geo.QuantileSketch(relative_accuracy=0.05))
+
+
+def test_calc_distance_statistics():
+    import numpy as np
+    import fcitools.geo
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        ref = fcitools.geo.get_lat_lon_pair(sc, "vis_06")
+        (_, dist) = fcitools.geo.calc_heading_distance_accurate(
+                *(np.asarray(a) for a in ref[2:] + ref[:2]))
+        stats = fcitools.geo.calc_distance_statistics(
+                sc, "vis_06", quantiles=(0.5, 0.9), bins=[0, 1, 20000],
+                n_rim=4, chunks=3)
+        stats8 = fcitools.geo.calc_distance_statistics(
+                sc, "vis_06", bins=[0, 1, 20000], chunks=5, dtype="f8")
+    assert stats["count"] == 100
+    assert stats8["count"] == 100
+    np.testing.assert_array_equal(stats8["histogram"][0], [50, 50])
+    assert stats["quantiles"][0.5] == stats["median"]
+    np.testing.assert_allclose(
+            stats["quantiles"][0.9], np.quantile(dist, 0.9), rtol=0.01)
+    np.testing.assert_array_equal(stats["histogram"][0], [50, 50])
+    # the four corners, two of them displaced
+    assert stats["rim"]["distance"].size == 4
+    np.testing.assert_allclose(
+            stats["rim"]["median"],
+            np.median(dist[[0, 0, 9, 9], [0, 9, 0, 9]]))
+    assert 0 < stats["rim"]["median"] < stats["rim"]["quantiles"][0.9]
+
+
+def test_get_cached_grids(tmp_path):
+    import os
+    import numpy as np
+    import fcitools.geo
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    (sc, fs) = _get_sc_eumsecret()
+    ar = sc["vis_06"].area
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        ref = fcitools.geo.get_lat_lon_pair_window(
+                sc, "vis_06", slice(0, 10), slice(0, 10))
+        fs.pixcoord2geocoord.reset_mock()
+        grids = fcitools.geo.get_cached_grids(ar, tile_size=4)
+        assert fs.pixcoord2geocoord.call_count == 9
+        p = fcitools.geo.get_grid_cache_path(ar)
+        pr = fcitools.geo.get_reference_cache_path(ar)
+        assert sorted(f.name for f in p.iterdir()) == [
+                "pyt_lat.npy", "pyt_lon.npy"]
+        assert sorted(f.name for f in pr.iterdir()) == [
+                "eum_lat.npy", "eum_lon.npy"]
+        assert sorted(f.name for f in p.parent.iterdir()
+                      if f.suffix != ".lock") == sorted([p.name, pr.name])
+        for (g, r) in zip(grids, ref):
+            assert g.dtype == np.dtype("f4")
+            np.testing.assert_allclose(g, r, rtol=1e-6)
+        fs.pixcoord2geocoord.reset_mock()
+        win = fcitools.geo.get_lat_lon_pair_window(
+                sc, "vis_06", slice(2, 5), slice(1, 9), cache=True)
+        pair = fcitools.geo.get_lat_lon_pair(sc, "vis_06", cache=True)
+        rgb = fcitools.geo.compare_geolocation(sc, "vis_06", cache=True)
+        fs.pixcoord2geocoord.assert_not_called()
+        # reference grid shared with other areas of the same size
+        ar2 = ar.copy(area_id="other", area_extent=(0, 0, 100000, 100000))
+        assert fcitools.geo.get_grid_cache_path(ar2) != p
+        assert fcitools.geo.get_reference_cache_path(ar2) == pr
+        fs.h = 35786400
+        assert fcitools.geo.get_reference_cache_path(ar) != pr
+        assert fcitools.geo.get_grid_cache_path(ar) == p
+    for (w, r) in zip(win, ref):
+        np.testing.assert_allclose(w, r[2:5, 1:9], rtol=1e-6)
+    for (w, r) in zip(pair, ref):
+        np.testing.assert_allclose(w, r, rtol=1e-6)
+    assert rgb.shape == (10, 10, 3)
+
+
+def test_get_cached_concurrent(tmp_path):
+    import threading
+    import time
+    import concurrent.futures
+    import numpy as np
+    import fcitools.geo
+    barrier = threading.Barrier(4)
+    calls = []
+
+    def calc(rows, cols):
+        calls.append((rows, cols))
+        time.sleep(0.2)
+        return (np.ones((rows.stop - rows.start, cols.stop - cols.start)),)
+
+    def worker():
+        barrier.wait()
+        return fcitools.geo._get_cached(
+                tmp_path / "grid", ("a",), (3, 3), calc, 3)[0]
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: worker(), range(4)))
+    assert len(calls) == 1
+    for r in results:
+        np.testing.assert_array_equal(r, 1)
+    assert sorted(f.name for f in tmp_path.iterdir()) == [
+            "grid", "grid.lock"]
+
+
+def test_get_chunks():
+    import fcitools.geo
+    assert fcitools.geo.get_chunks((300, 200), 128) == (
+            (128, 128, 44), (128, 72))
+    assert fcitools.geo.get_chunks((300, 200), (100, 200)) == (
+            (100, 100, 100), (200,))
+    assert fcitools.geo.get_chunks(
+            (5568, 5568), "auto", "f4", memory_budget="16MiB") == (
+            ((2048,) * 2 + (1472,),) * 2)
+    assert fcitools.geo.get_chunks(
+            (5568, 5568), "auto", "f8", memory_budget="16MiB") == (
+            ((1448,) * 3 + (1224,),) * 2)
+    native = fcitools.geo.get_chunks((5568, 5568), "native")
+    assert len(native[0]) == 40
+    assert set(native[0]) == {139, 140}
+    assert sum(native[0]) == 5568
+    assert native[1] == (5568,)
+    assert fcitools.geo.get_chunks((10, 10), "native")[0] == (1,) * 10
+
+
+def test_get_lat_lon_pair_chunks_dtype(tmp_path):
+    import os
+    import fcitools.geo
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        for (chunks, exp) in ((128, ((10,), (10,))),
+                              (4, ((4, 4, 2), (4, 4, 2))),
+                              ((5, 10), ((5, 5), (10,)))):
+            pair = fcitools.geo.get_lat_lon_pair(sc, "vis_06", chunks=chunks)
+            assert all(a.chunks == exp for a in pair)
+        pair = fcitools.geo.get_lat_lon_pair(sc, "vis_06", dtype="f8")
+        assert pair[0].dtype == "f8"
+        pair = fcitools.geo.get_lat_lon_pair(
+                sc, "vis_06", cache=True, chunks=5)
+        assert all(a.chunks == ((5, 5), (5, 5)) for a in pair)
+        with pytest.raises(ValueError):
+            fcitools.geo.get_lat_lon_pair(sc, "vis_06", dtype="f2")
+        with pytest.raises(ValueError):
+            fcitools.geo.get_lat_lon_pair(
+                    sc, "vis_06", cache=True, dtype="f8")
+
+
+def test_compare_geolocation_fused():
+    import numpy as np
+    import fcitools.geo
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}):
+        ref = np.asarray(fcitools.geo.compare_geolocation(sc, "vis_06"))
+        rgb = fcitools.geo.compare_geolocation_fused(sc, "vis_06", chunks=4)
+        assert rgb.dtype == np.dtype("u1")
+        assert rgb.chunks == ((4, 4, 2), (4, 4, 2), (3,))
+        rgb = rgb.compute()
+    assert rgb.shape == (10, 10, 3)
+    assert (rgb[5:, :, 2] > 0).all()
+    np.testing.assert_allclose(rgb, ref * 255, atol=1)
+
+
+def test_compare_geolocation_profiled():
+    import numpy as np
+    import fcitools.geo
+    import fcitools.profiling
+    (sc, fs) = _get_sc_eumsecret()
+    with patch.dict("sys.modules", {"fcitools.eumsecret": fs}), \
+            fcitools.profiling.collect() as stages:
+        ref = fcitools.geo.compare_geolocation(sc, "vis_06", chunks=4)
+        rgb = fcitools.geo.compare_geolocation(sc, "vis_06", chunks=4,
+                                               compute=True)
+    assert isinstance(rgb, np.ndarray)
+    np.testing.assert_array_equal(rgb, np.asarray(ref))
+    assert [st["stage"] for st in stages] == [
+            "compare_geolocation", "compute", "compare_geolocation"]
+    assert stages[1]["parent"] == "compare_geolocation"
+
+
+def test_calc_rgb_block():
+    import numpy as np
+    import fcitools.geo
+    lat1 = np.array([[0, 10], [np.nan, 45]], dtype="f4")
+    lon1 = np.array([[0, 10], [0, -45]], dtype="f4")
+    (lat2, lon2) = (lat1 + 0.5, lon1 - 0.2)
+    ref = np.asarray(fcitools.geo.calc_rgb_from_heading_distance(
+            *fcitools.geo.calc_heading_distance_accurate(
+                lat1, lon1, lat2, lon2)))
+    rgb = fcitools.geo.calc_rgb_block(lat1, lon1, lat2, lon2)
+    assert rgb.shape == (2, 2, 3)
+    assert rgb.dtype == np.dtype("u1")
+    assert (rgb[1, 0] == 0).all()
+    ok = ~np.isnan(lat1)
+    np.testing.assert_allclose(rgb[ok], ref[ok] * 255, atol=0.5)
@@ -0,0 +1,34 @@
+"""Test the geolocation_drift script
+"""
+
+import pytest
+from unittest.mock import patch
+
+
+@patch("argparse.ArgumentParser", autospec=True)
+def test_get_parser(ap):
+    import fcitools.processing.geolocation_drift
+    fcitools.processing.geolocation_drift.parse_cmdline()
+    assert ap.return_value.add_argument.call_count == 7
+
+
+@patch("fcitools.drift.compare_archives", autospec=True)
+@patch("fcitools.processing.geolocation_drift.parse_cmdline", autospec=True)
+def test_main(fpgp, fdc, tfs, tmp_path, capsys):
+    import fcitools.processing.geolocation_drift
+    fpgp.return_value = fcitools.processing.geolocation_drift.\
+        get_parser().parse_args([
+                str(tfs[0]), str(tfs[1]), str(tmp_path / "drift.csv"),
+                "-j", "2", "--quantiles", "0.5", "0.99"])
+    fdc.return_value = ([{"archive": "file.tar", "median": 8.6}], {})
+    fcitools.processing.geolocation_drift.main()
+    fdc.assert_called_once_with(
+            [tfs[0], tfs[1]], "vis_06", reader="fci_l1c_nc", jobs=2,
+            quantiles=(0.5, 0.99), n_rim=100)
+    assert (tmp_path / "drift.csv").read_text().splitlines() == [
+            "archive,median", "file.tar,8.6"]
+    assert "Compared 2 archives, 0 failed" in capsys.readouterr().out
+    fdc.return_value = ([], {tfs[0]: ValueError("broken")})
+    with pytest.raises(SystemExit):
+        fcitools.processing.geolocation_drift.main()
+    assert f"FAILED {tfs[0]!s}: broken" in capsys.readouterr().out
@@ -1,15 +1,25 @@
+import concurrent.futures
+import datetime
+import io
 import logging
 import pathlib
 import pytest
 import types
 import os
+import subprocess
+import tarfile
+import threading
+import time
+from unittest.mock import patch
 
 
 def test_unpack_tgz(tmp_path, tfs, caplog):
     import fcitools.ioutil
     (tf1, tf2) = tfs
     os.environ["XDG_CACHE_HOME"] = str(tmp_path)
-    exp = tmp_path / "fcitools" / "file_tar" / "subdir"
+    exp = fcitools.ioutil._get_path_to_unpack_to(tf1) / "subdir"
+    assert exp.parent.parent == tmp_path / "fcitools"
+    assert exp.parent.name.startswith("file_tar-")
     with caplog.at_level(logging.DEBUG):
         paths1 = fcitools.ioutil.unpack_tgz(tf1)
         assert isinstance(paths1, types.GeneratorType)
@@ -35,3 +45,311 @@ def test_unpack_tgz(tmp_path, tfs, caplog):
 
     with pytest.raises(ValueError):
         fcitools.ioutil.unpack_tgz(tmp_path / "bad.tar")
+
+
+def test_parse_fci_filename():
+    import fcitools.ioutil
+    assert fcitools.ioutil.parse_fci_filename(
+        "W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-FDHSI-FD--CHK-"
+        "BODY--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_20130804120330_"
+        "20130804120345_N__T_0072_0001.nc") == {
+                "product": "FDHSI", "kind": "BODY",
+                "start_time": datetime.datetime(2013, 8, 4, 12, 3, 30),
+                "repeat_cycle": 72, "chunk": 1}
+    assert fcitools.ioutil.parse_fci_filename("file0.dat") is None
+
+
+def test_iter_unpack_tgz(tmp_path, fci_tfs, tfs, caplog):
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    with caplog.at_level(logging.DEBUG):
+        paths = fcitools.ioutil.iter_unpack_tgz(
+                fci_tfs, channels=["vis_06"], chunks=[2, 3])
+        assert isinstance(paths, types.GeneratorType)
+        first = next(paths)
+        assert first.exists()
+        paths = [first] + list(paths)
+        assert "Streaming" in caplog.text
+    info = [fcitools.ioutil.parse_fci_filename(p.name) for p in paths]
+    assert sorted((i["kind"], i["chunk"]) for i in info) == [
+            ("BODY", 2), ("BODY", 3), ("TRAIL", 41)]
+    assert all(i["product"] == "FDHSI" for i in info)
+    assert not any(p.name.endswith(".part") for p in paths[0].parent.iterdir())
+    # second pass reuses what is there and adds what is new
+    paths2 = set(fcitools.ioutil.iter_unpack_tgz(fci_tfs))
+    assert set(paths) < paths2
+    assert len(paths2) == 10
+    # selecting from a fully unpacked archive does not decompress again
+    set(fcitools.ioutil.unpack_tgz(fci_tfs))
+    caplog.clear()
+    with caplog.at_level(logging.DEBUG):
+        paths3 = list(fcitools.ioutil.iter_unpack_tgz(
+            fci_tfs, channels=["vis_06"], resolutions=[500]))
+        assert "Selecting from unpacked" in caplog.text
+    assert [fcitools.ioutil.parse_fci_filename(p.name)["product"]
+            for p in paths3] == ["HRFI"]
+    # channels in both products select both, unless limited by resolution
+    info = [fcitools.ioutil.parse_fci_filename(p.name) for p in
+            fcitools.ioutil.iter_unpack_tgz(
+                fci_tfs, channels=["ir_105"], chunks=[1])]
+    assert sorted((i["product"], i["kind"]) for i in info) == [
+            ("FDHSI", "BODY"), ("FDHSI", "TRAIL"), ("HRFI", "BODY")]
+    info = [fcitools.ioutil.parse_fci_filename(p.name) for p in
+            fcitools.ioutil.iter_unpack_tgz(
+                fci_tfs, channels=["ir_105"], chunks=[1],
+                resolutions=[2000])]
+    assert {i["product"] for i in info} == {"FDHSI"}
+    assert list(fcitools.ioutil.iter_unpack_tgz(
+        fci_tfs, channels=["wv_63"], resolutions=[500])) == []
+    # non-FCI files are never selected
+    assert list(fcitools.ioutil.iter_unpack_tgz(tfs[1])) == []
+
+
+def test_unpack_tgz_parallel(tmp_path, tfs, caplog):
+    import tarfile
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    txz = tmp_path / "file.tar.xz"
+    with tarfile.open(tfs[0]) as src, tarfile.open(txz, "w:xz") as dst:
+        for member in src:
+            dst.addfile(member, src.extractfile(member))
+    exp = {f"file{i:d}.dat" for i in range(3)}
+    with patch.dict(fcitools.ioutil._parallel_decompressors,
+                    {".xz": [["xz", "-d", "-c", "-T", "{threads:d}"]]}), \
+            patch("shutil.which", return_value="/usr/bin/xz"), \
+            patch("subprocess.Popen", wraps=subprocess.Popen) as sP:
+        paths = set(fcitools.ioutil.unpack_tgz(txz, threads=4))
+        assert sP.call_args[0][0] == ["xz", "-d", "-c", "-T", "4"]
+    assert {p.name for p in paths} == exp
+    assert all(p.read_bytes() == b"abcd" for p in paths)
+    # with one thread, the standard library is used
+    with patch("subprocess.Popen") as sP:
+        fcitools.ioutil.unpack_tgz(tfs[1], threads=1)
+        sP.assert_not_called()
+    # failing decompressor falls back to standard library
+    with patch.dict(fcitools.ioutil._parallel_decompressors,
+                    {".gz": [["false", "{threads:d}"]]}), \
+            caplog.at_level(logging.WARNING):
+        os.environ["XDG_CACHE_HOME"] = str(tmp_path / "other")
+        paths = set(fcitools.ioutil.unpack_tgz(tfs[1], threads=2))
+        assert "falling back" in caplog.text
+    assert {p.name for p in paths} == exp
+
+
+def test_unpack_cache(tmp_path, tfs, caplog):
+    import json
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path / "cache")
+    cd = tmp_path / "cache" / "fcitools"
+    (tf1, tf2) = tfs
+    p1 = next(fcitools.ioutil.unpack_tgz(tf1)).parent.parent
+    idx = json.loads((cd / "index.json").read_text())
+    assert idx[p1.name]["bytes"] == 12
+    assert idx[p1.name]["source"] == str(tf1)
+    # an archive with the same name but different contents is not served
+    # from the cache
+    other = tmp_path / "other" / tf1.name
+    other.parent.mkdir()
+    with tarfile.open(other, "w") as tf:
+        ti = tarfile.TarInfo("subdir/other.dat")
+        ti.size = 3
+        tf.addfile(ti, io.BytesIO(b"xyz"))
+    assert {p.name for p in fcitools.ioutil.unpack_tgz(other)} == {
+            "other.dat"}
+    # same name, size, and mtime, but different contents needs hash_content
+    same = tmp_path / "same" / tf1.name
+    same.parent.mkdir()
+    data = bytearray(tf1.read_bytes())
+    data[-1] ^= 1
+    same.write_bytes(data)
+    t = tf1.stat().st_mtime_ns
+    os.utime(same, ns=(t, t))
+    assert (fcitools.ioutil._get_path_to_unpack_to(tf1)
+            == fcitools.ioutil._get_path_to_unpack_to(same))
+    assert (fcitools.ioutil._get_path_to_unpack_to(tf1, hash_content=True)
+            != fcitools.ioutil._get_path_to_unpack_to(same,
+                                                      hash_content=True))
+    # entries in use are not evicted
+    idx = json.loads((cd / "index.json").read_text())
+    assert len(idx) == 2
+    with caplog.at_level(logging.DEBUG):
+        p2 = next(fcitools.ioutil.unpack_tgz(
+            tf2, max_bytes="12 B")).parent.parent
+        assert "Not evicting" in caplog.text
+        assert "Evicting" not in caplog.text
+    assert p1.exists()
+    # least recently used entries are evicted once released, with their
+    # lock files
+    fcitools.ioutil.release_unpacked()
+    with caplog.at_level(logging.DEBUG):
+        fcitools.ioutil._cache_register(p2, tf2, max_bytes="12 B")
+        assert "Evicting" in caplog.text
+    idx = json.loads((cd / "index.json").read_text())
+    assert set(idx) == {p2.name}
+    assert not p1.exists()
+    assert {p.name for p in cd.iterdir()} == {
+            "index.json", "index.json.lock", p2.name, p2.name + ".lock",
+            p2.name + ".use.lock"}
+    # lost index is rebuilt, lookup registers existing entries
+    (cd / "index.json").unlink()
+    with caplog.at_level(logging.DEBUG):
+        set(fcitools.ioutil.unpack_tgz(tf2))
+        assert "Reading unpacked" in caplog.text
+    idx = json.loads((cd / "index.json").read_text())
+    assert idx[p2.name]["bytes"] == 12
+    os.environ["FCITOOLS_CACHE_MAX_BYTES"] = "1"
+    try:
+        with caplog.at_level(logging.WARNING):
+            set(fcitools.ioutil.unpack_tgz(tfs[0]))
+            assert "exceeds budget" in caplog.text
+    finally:
+        del os.environ["FCITOOLS_CACHE_MAX_BYTES"]
+
+
+def test_locked_removed(tmp_path):
+    import time
+    import fcitools.ioutil
+    p = tmp_path / "entry"
+    lockfile = tmp_path / "entry.lock"
+    got = []
+
+    def worker():
+        with fcitools.ioutil._locked(p):
+            got.append(lockfile.exists())
+            with fcitools.ioutil._locked(p, blocking=False) as acquired:
+                got.append(acquired)
+
+    with fcitools.ioutil._locked(p, shared=True):
+        with fcitools.ioutil._locked(p, shared=True, blocking=False) as a:
+            assert a
+        with fcitools.ioutil._locked(p, blocking=False) as a:
+            assert not a
+        t = threading.Thread(target=worker)
+        t.start()
+        time.sleep(0.2)
+        # removed as on eviction, while the worker waits for the lock
+        lockfile.unlink()
+    t.join()
+    # the worker locked the new lock file rather than the removed one
+    assert got == [True, False]
+
+
+def test_unpack_tgz_atomic(tmp_path, tfs):
+    import tarfile
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    to = fcitools.ioutil._get_path_to_unpack_to(tfs[0])
+    # interrupted extraction leaves nothing behind
+    with patch("tarfile.TarFile.extractall",
+               side_effect=KeyboardInterrupt), \
+            pytest.raises(KeyboardInterrupt):
+        fcitools.ioutil.unpack_tgz(tfs[0])
+    assert not to.exists()
+    assert not list(to.parent.glob(f".{to.name:s}-*"))
+    # so does a killed process, which is cleaned up next time
+    (to.parent / f".{to.name:s}-stale" / "subdir").mkdir(parents=True)
+    assert len(set(fcitools.ioutil.unpack_tgz(tfs[0]))) == 3
+    assert not list(to.parent.glob(f".{to.name:s}-*"))
+    # an existing entry is not extracted again
+    with patch("tarfile.TarFile.extractall") as tTe:
+        fcitools.ioutil.unpack_tgz(tfs[0])
+        tTe.assert_not_called()
+    # concurrent workers extract only once
+    to = fcitools.ioutil._get_path_to_unpack_to(tfs[1])
+    barrier = threading.Barrier(4)
+    orig = tarfile.TarFile.extractall
+    calls = []
+
+    def slow_extractall(self, *args, **kwargs):
+        calls.append(args)
+        time.sleep(0.2)
+        return orig(self, *args, **kwargs)
+
+    def worker():
+        barrier.wait()
+        return sorted(fcitools.ioutil.unpack_tgz(tfs[1]))
+
+    with patch("tarfile.TarFile.extractall", slow_extractall), \
+            concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: worker(), range(4)))
+    assert len(calls) == 1
+    assert all(r == results[0] for r in results)
+    assert len(results[0]) == 3
+
+
+def _fake_convert(path, out):
+    import json
+    import numpy
+    import fcitools.ioutil
+    out.mkdir(parents=True)
+    index = {"variables": {}, "attrs": {"source": path.name}}
+    fcitools.ioutil._save_variable(
+            out, "data/ir_105/measured/effective_radiance",
+            numpy.arange(12, dtype="u2").reshape(4, 3), ["y", "x"],
+            {"scale_factor": 0.5}, index, block_bytes=6)
+    with (out / "index.json").open("w") as fp:
+        json.dump(index, fp)
+
+
+def test_open_npy(tmp_path):
+    import numpy
+    import fcitools.ioutil
+    _fake_convert(tmp_path / "source.nc", tmp_path / "npy")
+    ds = fcitools.ioutil.open_npy(tmp_path / "npy", chunks=2)
+    assert ds.attrs == {"source": "source.nc"}
+    assert list(ds.data_vars) == ["data/ir_105/measured/effective_radiance"]
+    da = ds["data/ir_105/measured/effective_radiance"]
+    assert da.dims == ("y", "x")
+    assert da.attrs == {"scale_factor": 0.5}
+    assert da.dtype == numpy.dtype("u2")
+    assert da.data.chunks == ((2, 2), (2, 1))
+    numpy.testing.assert_array_equal(
+            da.values, numpy.arange(12).reshape(4, 3))
+    # backed by the file, not a copy in memory
+    assert any(isinstance(v, numpy.memmap) for v in da.data.dask.values())
+
+
+def test_convert_to_npy(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    import numpy
+    import fcitools.ioutil
+    with h5py.File(tmp_path / "source.nc", "w") as h5:
+        h5.attrs["title"] = b"test"
+        y = h5.create_dataset("y", data=numpy.arange(4))
+        y.make_scale("y")
+        g = h5.create_group("data")
+        v = g.create_dataset("radiance", data=numpy.ones((4, 3), "f4"),
+                             compression="gzip")
+        v.attrs["units"] = "mW"
+        v.dims[0].attach_scale(y)
+        g.create_dataset("name", data=b"text")
+    fcitools.ioutil.convert_to_npy(tmp_path / "source.nc", tmp_path / "npy")
+    ds = fcitools.ioutil.open_npy(tmp_path / "npy")
+    assert ds.attrs == {"title": "test"}
+    assert "data/name" not in ds.variables
+    assert ds["data/radiance"].dims == ("y", "data/radiance/dim_1")
+    assert ds["data/radiance"].attrs == {"units": "mW"}
+    numpy.testing.assert_array_equal(ds["data/radiance"], 1)
+    with pytest.raises(FileExistsError):
+        fcitools.ioutil.convert_to_npy(tmp_path / "source.nc",
+                                       tmp_path / "npy")
+    assert not list(tmp_path.glob(".npy-*"))
+
+
+def test_unpack_tgz_npy(tmp_path, fci_tfs):
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    to = fcitools.ioutil._get_path_to_unpack_to(fci_tfs)
+    with patch("fcitools.ioutil.convert_to_npy", autospec=True,
+               side_effect=_fake_convert) as fic:
+        converted = fcitools.ioutil.unpack_tgz_npy(fci_tfs)
+        assert fic.call_count == 10
+        assert len(converted) == 10
+        assert all(p.suffix == ".nc" for p in converted)
+        assert all(d.parent == to / ".npy" for d in converted.values())
+        size = fcitools.ioutil._read_index(to.parent)[to.name]["bytes"]
+        assert size > 11 * 4
+        # converted once, and unpacked files are still found
+        assert fcitools.ioutil.unpack_tgz_npy(fci_tfs) == converted
+        assert fic.call_count == 10
+        assert len(list(fcitools.ioutil.unpack_tgz(fci_tfs))) == 11
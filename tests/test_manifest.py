@@ -0,0 +1,48 @@
+"""Test manifest of rendered outputs
+"""
+
+import os
+
+
+def test_get_input_fingerprints(tmp_path):
+    import fcitools.manifest
+    (tmp_path / "b").write_bytes(b"abc")
+    (tmp_path / "a").write_bytes(b"")
+    os.utime(tmp_path / "b", ns=(0, 42))
+    fps = fcitools.manifest.get_input_fingerprints(
+            [tmp_path / "b", tmp_path / "a"])
+    assert list(fps) == ["a", "b"]
+    assert fps["b"] == [3, 42]
+
+
+def test_get_composite_definitions():
+    import fcitools.manifest
+    defs = fcitools.manifest.get_composite_definitions(
+            ["natural_color", "vis_06"])
+    assert "GenericCompositor" in defs["natural_color"]
+    assert "prerequisites" in defs["natural_color"]
+    assert defs["vis_06"] is None
+
+
+def test_entry(tmp_path, areas):
+    import fcitools.manifest
+    inputs = {"a": [1, 2]}
+    entry = fcitools.manifest.get_entry(
+            inputs, "comp", "def", areas[0], overlay=None,
+            size=(1, 2))
+    assert entry["settings"]["size"] == [1, 2]
+    assert "shrubbery" in entry["area"]
+    assert fcitools.manifest.get_entry(
+            inputs, "comp", "def", "native")["area"] == "native"
+    assert fcitools.manifest.read_manifest(tmp_path) == {}
+    fcitools.manifest.update_manifest(tmp_path, {"x.tiff": entry})
+    fcitools.manifest.update_manifest(tmp_path, {"y.tiff": {}})
+    m = fcitools.manifest.read_manifest(tmp_path)
+    assert set(m) == {"x.tiff", "y.tiff"}
+    assert not fcitools.manifest.is_up_to_date(tmp_path, "x.tiff", entry, m)
+    (tmp_path / "x.tiff").touch()
+    assert fcitools.manifest.is_up_to_date(tmp_path, "x.tiff", entry, m)
+    entry["dataset"] = "other"
+    assert not fcitools.manifest.is_up_to_date(tmp_path, "x.tiff", entry, m)
+    fcitools.manifest.get_manifest_path(tmp_path).write_text("{")
+    assert fcitools.manifest.read_manifest(tmp_path) == {}
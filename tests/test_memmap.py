@@ -0,0 +1,41 @@
+"""Test reading FCI data from memory-mapped arrays
+"""
+
+import pytest
+
+
+def test_reader_config(fci_nc):
+    pytest.importorskip("h5py")
+    import numpy
+    import satpy
+    import fcitools.ioutil
+    import fcitools.memmap
+    fcitools.ioutil.convert_to_npy(
+            fci_nc, fcitools.ioutil.get_npy_path(fci_nc))
+    sc = satpy.Scene(filenames=[str(fci_nc)], reader="fci_l1c_nc")
+    with fcitools.memmap.reader_config():
+        sc_mm = satpy.Scene(filenames=[str(fci_nc)], reader="fci_l1c_nc")
+    (fh,) = sc_mm._readers["fci_l1c_nc"].file_handlers["fci_l1c_fdhsi"]
+    assert isinstance(fh, fcitools.memmap.FCIL1cMemmapFileHandler)
+    assert fh.converted is not None
+    # configuration does not leak out of the context
+    sc_nc = satpy.Scene(filenames=[str(fci_nc)], reader="fci_l1c_nc")
+    (fh,) = sc_nc._readers["fci_l1c_nc"].file_handlers["fci_l1c_fdhsi"]
+    assert not isinstance(fh, fcitools.memmap.FCIL1cMemmapFileHandler)
+    for s in (sc, sc_mm):
+        s.load(["ir_105", "vis_06"], calibration="radiance")
+    for ch in ("ir_105", "vis_06"):
+        assert sc_mm[ch].attrs["area"] == sc[ch].attrs["area"]
+        numpy.testing.assert_array_equal(sc_mm[ch].values, sc[ch].values)
+        assert not numpy.isnan(sc_mm[ch].values[-1]).any()
+
+
+def test_not_converted(fci_nc):
+    import satpy
+    import fcitools.memmap
+    with fcitools.memmap.reader_config():
+        sc = satpy.Scene(filenames=[str(fci_nc)], reader="fci_l1c_nc")
+    (fh,) = sc._readers["fci_l1c_nc"].file_handlers["fci_l1c_fdhsi"]
+    assert fh.converted is None
+    sc.load(["ir_105"], calibration="radiance")
+    assert sc["ir_105"].shape == (5568, 5568)
@@ -0,0 +1,37 @@
+"""Test the prewarm_resample_cache script
+"""
+
+import os
+from unittest.mock import patch
+
+
+@patch("argparse.ArgumentParser", autospec=True)
+def test_get_parser(ap):
+    import fcitools.processing.prewarm_resample_cache
+    fcitools.processing.prewarm_resample_cache.parse_cmdline()
+    assert ap.return_value.add_argument.call_count == 5
+
+
+# the 2 km grid with 200 by 200 pixels
+@patch("fcitools.resample._fci_grids",
+       {55680: (5.58871526031607e-05 * 27.84,
+                1.55617776423501e-01 + 5.58871526031607e-05 * 13.42, 200)})
+@patch("fcitools.processing.prewarm_resample_cache.parse_cmdline",
+       autospec=True)
+def test_main(fpsp, tmp_path, capsys):
+    import fcitools.processing.prewarm_resample_cache
+    import fcitools.resample
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    fpsp.return_value = fcitools.processing.prewarm_resample_cache.\
+        get_parser().parse_args(["-a", "crete", "gavdos", "native"])
+    fcitools.processing.prewarm_resample_cache.main()
+    cd = tmp_path / "fcitools" / "resample"
+    assert len(list(cd.glob("crete-55680m-*.npy"))) == 1
+    assert len(list(cd.glob("gavdos-55680m-*.npy"))) == 1
+    assert len(list(cd.iterdir())) == 2
+    assert "Prepared crete" in capsys.readouterr().out
+    fpsp.return_value = fcitools.processing.prewarm_resample_cache.\
+        get_parser().parse_args([])
+    fcitools.processing.prewarm_resample_cache.main()
+    assert len(list(cd.iterdir())) == len(fcitools.vis.get_fcitools_areas())
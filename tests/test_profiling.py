@@ -0,0 +1,42 @@
+"""Test profiling instrumentation
+"""
+
+import time
+
+
+def test_stage():
+    import fcitools.profiling
+
+    @fcitools.profiling.stage("outer")
+    def outer():
+        with fcitools.profiling.stage("inner") as rec:
+            rec["tasks"] = 5
+            time.sleep(0.01)
+        return 42
+
+    # not collecting: no records
+    assert outer() == 42
+    with fcitools.profiling.collect() as stages:
+        assert outer() == 42
+        with fcitools.profiling.collect() as stages2:
+            outer()
+        assert len(stages2) == 2
+    assert outer() == 42
+    assert [st["stage"] for st in stages] == ["inner", "outer"]
+    (inner, outer_) = stages
+    assert inner["parent"] == "outer"
+    assert outer_["parent"] is None
+    assert inner["tasks"] == 5
+    assert 0.01 <= inner["wall_time"] <= outer_["wall_time"]
+    assert inner["peak_rss"] >= inner["peak_rss_increase"] >= 0
+
+
+def test_write_report(tmp_path):
+    import json
+    import pathlib
+    import fcitools.profiling
+    fcitools.profiling.write_report(
+            {"path": pathlib.Path("/tmp"), "stages": []},
+            tmp_path / "report.json")
+    with (tmp_path / "report.json").open() as fp:
+        assert json.load(fp) == {"path": "/tmp", "stages": []}
@@ -0,0 +1,220 @@
+"""Test resampling with cached lookup tables
+"""
+
+import os
+import logging
+import pytest
+from unittest.mock import patch
+
+
+def _get_source_area(size=200):
+    """Get coarse full disk area, upside down as from the FCI reader
+    """
+    import pyresample.geometry
+    import fcitools.resample
+    half = 5567999.994203018
+    return pyresample.geometry.AreaDefinition(
+            "coarse", "coarse full disk", "",
+            fcitools.resample._fci_projection,
+            size, size, (-half, half, half, -half))
+
+
+def _assert_near(actual, desired, size=200):
+    """Assert source indices encoded as values differ by at most a pixel
+    """
+    import numpy as np
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(desired))
+    ok = ~np.isnan(actual)
+    (ar, ac) = np.divmod(actual[ok].astype("i8"), size)
+    (dr, dc) = np.divmod(desired[ok].astype("i8"), size)
+    assert (abs(ar - dr) <= 1).all()
+    assert (abs(ac - dc) <= 1).all()
+    assert (actual[ok] == desired[ok]).mean() > 0.7
+
+
+def test_get_fci_fulldisk_area():
+    import fcitools.resample
+    ar = fcitools.resample.get_fci_fulldisk_area(2000)
+    assert ar.shape == (5568, 5568)
+    assert ar.area_id == "mtg_fci_fdss_2km"
+    assert abs(ar.pixel_size_x - 2000) < 0.01
+    # upside down, as the FCI data
+    assert ar.area_extent[1] > ar.area_extent[3]
+    assert fcitools.resample.get_fci_fulldisk_area(500).area_id == \
+        "mtg_fci_fdss_500m"
+
+
+def _get_reader_area(resolution, rows=None):
+    """Get area from the satpy FCI reader for a file with the full grid
+
+    Get the area as the reader calculates it from the projection and scan
+    angles in a file, for all lines or for ``rows``, as for a chunk.
+    """
+    import numpy as np
+    import xarray
+    import fcitools.resample
+    fci_l1c_nc = pytest.importorskip("satpy.readers.fci_l1c_nc")
+    (step, offset, size) = fcitools.resample._fci_grids[resolution]
+    counts = np.arange(1, size + 1, dtype="u2")
+    rows = slice(None) if rows is None else rows
+    meas = "data/ir_105/measured"
+    content = {
+        f"{meas:s}/effective_radiance/shape": (len(counts[rows]), size),
+        f"{meas:s}/x": xarray.DataArray(
+            counts, dims=("x",),
+            attrs={"scale_factor": -step, "add_offset": offset}),
+        f"{meas:s}/y": xarray.DataArray(
+            counts[rows], dims=("y",),
+            attrs={"scale_factor": step, "add_offset": -offset})}
+    for (k, v) in {"sweep_angle_axis": "y",
+                   "perspective_point_height": "35786400.0",
+                   "semi_major_axis": "6378137.0",
+                   "longitude_of_projection_origin": "0.0",
+                   "inverse_flattening": "298.257223563"}.items():
+        content[f"data/mtg_geos_projection/attr/{k:s}"] = v
+
+    class FakeFileHandler(fci_l1c_nc.FCIL1cNCFileHandler):
+        def __init__(self):
+            self._cache = {}
+            self.filetype_info = {"file_type": "fci_l1c_fdhsi"}
+
+        def __getitem__(self, key):
+            return content[key]
+
+        def get_and_cache_npxr(self, key):
+            return content[key]
+
+    return FakeFileHandler().get_area_def(
+            {"name": "ir_105", "resolution": resolution})
+
+
+@pytest.mark.parametrize("resolution", [500, 1000, 2000])
+def test_get_fci_fulldisk_area_as_reader(resolution, tmp_path):
+    import numpy as np
+    import pyresample.geometry
+    import fcitools.resample
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    ar = fcitools.resample.get_fci_fulldisk_area(resolution)
+    ref = _get_reader_area(resolution)
+    assert ar == ref
+    assert ar.area_id == ref.area_id
+    # the reader stacks the areas of the chunks
+    bounds = np.linspace(0, ar.height, 41).round().astype("i4")
+    stacked = pyresample.geometry.StackedAreaDefinition(
+            *(_get_reader_area(resolution, slice(r0, r1))
+              for (r0, r1) in zip(bounds[:-1], bounds[1:]))).squeeze()
+    tgt = fcitools.vis.get_fcitools_areas()["crete"]
+    for src in (ref, stacked):
+        assert (fcitools.resample.get_index_path(src, tgt)
+                == fcitools.resample.get_index_path(ar, tgt))
+    # not a north-up grid
+    north_up = pyresample.geometry.AreaDefinition(
+            ar.area_id, ar.description, "", ar.crs, ar.width, ar.height,
+            (ar.area_extent[0], ar.area_extent[3],
+             ar.area_extent[2], ar.area_extent[1]))
+    assert (fcitools.resample.get_index_path(north_up, tgt)
+            != fcitools.resample.get_index_path(ar, tgt))
+
+
+def test_calc_index(areas):
+    import numpy as np
+    import fcitools.resample
+    import fcitools.vis
+    import pyresample.kd_tree
+    src = _get_source_area()
+    tgt = fcitools.vis.get_fcitools_areas()["crete"]
+    idx = fcitools.resample.calc_index(src, tgt)
+    assert idx.shape == (2,) + tgt.shape
+    assert idx.dtype == np.dtype("i4")
+    data = np.arange(src.size, dtype="f8").reshape(src.shape)
+    exp = pyresample.kd_tree.resample_nearest(
+            src, data, tgt, radius_of_influence=500000)
+    _assert_near(data[idx[0], idx[1]], exp)
+    # shrubbery is partly outside the disk; near the limb, the nearest
+    # pixel differs more between methods, but the KD-tree finds
+    # neighbours within its radius of influence even beyond the limb
+    idx = fcitools.resample.calc_index(src, areas[0])
+    exp = pyresample.kd_tree.resample_nearest(
+            src, data, areas[0], radius_of_influence=500000,
+            fill_value=None)
+    assert ((idx[0] == -1) == (idx[1] == -1)).all()
+    assert (idx == -1).any()
+    assert not ((idx[0] >= 0) & exp.mask).any()
+
+
+def test_get_index(tmp_path, caplog):
+    import numpy as np
+    import fcitools.resample
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    src = _get_source_area()
+    tgt = fcitools.vis.get_fcitools_areas()["gavdos"]
+    p = fcitools.resample.get_index_path(src, tgt)
+    assert p.parent == tmp_path / "fcitools" / "resample"
+    assert p.name.startswith("gavdos-55680m-")
+    with caplog.at_level(logging.DEBUG):
+        idx1 = fcitools.resample.get_index(src, tgt)
+        assert "Calculating" in caplog.text
+    assert p.exists()
+    with caplog.at_level(logging.DEBUG), \
+            patch("fcitools.resample.calc_index") as frc:
+        idx2 = fcitools.resample.get_index(src, tgt)
+        frc.assert_not_called()
+        assert "Reading" in caplog.text
+    assert isinstance(idx2, np.memmap)
+    np.testing.assert_array_equal(idx1, idx2)
+    assert (fcitools.resample.get_index_path(
+        src, fcitools.vis.get_fcitools_areas()["crete"]) != p)
+
+
+def test_hold_index(tmp_path, monkeypatch):
+    import numpy as np
+    import fcitools.resample
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    monkeypatch.setattr(fcitools.resample, "_held", {})
+    src = _get_source_area()
+    tgt = fcitools.vis.get_fcitools_areas()["gavdos"]
+    idx = fcitools.resample.hold_index(src, tgt)
+    assert not isinstance(idx, np.memmap)
+    assert fcitools.resample.hold_index(src, tgt) is idx
+    # found without reading the file
+    fcitools.resample.get_index_path(src, tgt).unlink()
+    assert fcitools.resample.get_index(src, tgt) is idx
+
+
+def test_cached_nearest_resampler(tmp_path, areas):
+    import numpy as np
+    import xarray
+    import dask.array
+    import satpy
+    import fcitools.resample
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    src = _get_source_area()
+    sc = satpy.Scene()
+    data = dask.array.arange(src.size, dtype="f4", chunks=1000).reshape(
+            src.shape).rechunk(50)
+    sc["vis_06"] = xarray.DataArray(
+            data, dims=("y", "x"), attrs={"area": src, "name": "vis_06"})
+    sc["rgb"] = xarray.DataArray(
+            dask.array.stack([data, data, data]), dims=("bands", "y", "x"),
+            coords={"bands": ["R", "G", "B"]},
+            attrs={"area": src, "name": "rgb"})
+    for tgt in (fcitools.vis.get_fcitools_areas()["socotra"], areas[0]):
+        ls = sc.resample(tgt, resampler=fcitools.resample
+                         .CachedNearestResampler, reduce_data=False)
+        ref = sc.resample(tgt, resampler="nearest",
+                          radius_of_influence=500000)
+        assert ls["vis_06"].attrs["area"] == tgt
+        assert isinstance(ls["vis_06"].data, dask.array.Array)
+        if tgt is areas[0]:
+            assert not (np.isnan(ref["vis_06"].values)
+                        & ~np.isnan(ls["vis_06"].values)).any()
+        else:
+            _assert_near(ls["vis_06"].values, ref["vis_06"].values)
+        assert ls["rgb"].dims == ("bands", "y", "x")
+        assert list(ls["rgb"].coords["bands"].values) == ["R", "G", "B"]
+        np.testing.assert_array_equal(ls["rgb"][0].values,
+                                      ls["vis_06"].values)
@@ -0,0 +1,30 @@
+"""Test dask scheduler selection
+"""
+
+import pytest
+
+
+def test_use_scheduler(caplog):
+    import dask
+    import fcitools.scheduling
+    with fcitools.scheduling.use_scheduler("processes", workers=2) as c:
+        assert c is None
+        assert dask.config.get("scheduler") == "processes"
+        assert dask.config.get("num_workers") == 2
+    assert dask.config.get("scheduler", None) != "processes"
+    with fcitools.scheduling.use_scheduler("threads", memory_limit="1 GB"):
+        assert dask.config.get("scheduler") == "threads"
+    assert "only enforced with the distributed" in caplog.text
+    with pytest.raises(ValueError):
+        with fcitools.scheduling.use_scheduler("carrier pigeons"):
+            pass
+
+
+def test_use_scheduler_distributed():
+    pytest.importorskip("distributed")
+    import dask.array
+    import fcitools.scheduling
+    with fcitools.scheduling.use_scheduler(
+            "distributed", workers=1, memory_limit="1 GB") as client:
+        assert len(client.scheduler_info()["workers"]) == 1
+        assert dask.array.ones(10, chunks=5).sum().compute() == 10
@@ -2,32 +2,193 @@
 """
 
 import os
+import sys
+import time
+import subprocess
+import pathlib
+import concurrent.futures
 from unittest.mock import patch
 
+import pytest
+
 
 @patch("argparse.ArgumentParser", autospec=True)
 def test_get_parser(ap):
     import fcitools.processing.show_testdata
     fcitools.processing.show_testdata.parse_cmdline()
-    assert ap.return_value.add_argument.call_count == 8
+    assert ap.return_value.add_argument.call_count == 17
 
 
 @patch("satpy.Scene", autospec=True)
 @patch("fcitools.processing.show_testdata.parse_cmdline", autospec=True)
-def test_main(fpsp, sS, tfs, tmp_path):
+def test_main(fpsp, sS, fci_tfs, tmp_path):
     import fcitools.processing.show_testdata
+    import fcitools.ioutil
     fpsp.return_value = fcitools.processing.show_testdata.\
         get_parser().parse_args([
-                str(tfs[1]),
+                str(fci_tfs),
                 str(tmp_path),
                 "--composites", "overview", "natural_color", "fog",
                 "--channels", "vis_04", "nir_13", "ir_38", "wv_87",
                 "-a", "socotra", "bornholm"])
 
     os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
     fcitools.processing.show_testdata.main()
-    sS.assert_called_once_with(
-        filenames=[str(tmp_path / "fcitools" / "file_tar_gz"
-                       / "subdir" / f"file{i:d}.dat")
-                   for i in (1, 2, 0)],
-        reader="fci_l1c_fdhsi")
+    sS.assert_called_once()
+    files = [pathlib.Path(f) for f in sS.call_args[1]["filenames"]]
+    assert files
+    # only FCI files are unpacked
+    assert all(f.exists() for f in files)
+    assert all(fcitools.ioutil.parse_fci_filename(f.name) for f in files)
+    assert sS.call_args[1]["reader"] == "fci_l1c_fdhsi"
+
+
+def test_expand_paths(tmp_path, caplog):
+    import fcitools.processing.show_testdata
+    for n in ("a", "b", "c"):
+        (tmp_path / f"{n:s}.tar.gz").touch()
+    paths = fcitools.processing.show_testdata.expand_paths(
+            [str(tmp_path / "*.tar.gz"), str(tmp_path / "a.tar.gz"),
+             str(tmp_path / "x*.tar.gz"), "/no/such.tar.gz"])
+    assert paths == sorted(
+            [tmp_path / f"{n:s}.tar.gz" for n in ("a", "b", "c")]
+            + [pathlib.Path("/no/such.tar.gz")])
+    assert "No archives match" in caplog.text
+
+
+@patch("fcitools.processing.show_testdata._process_archive", autospec=True)
+@patch("fcitools.processing.show_testdata.parse_cmdline", autospec=True)
+def test_main_batch(fpsp, fpsp_, tmp_path, capsys):
+    import fcitools.processing.show_testdata
+    for n in ("a", "b", "c"):
+        (tmp_path / f"{n:s}.tar.gz").touch()
+    fpsp.return_value = fcitools.processing.show_testdata.\
+        get_parser().parse_args([
+                str(tmp_path / "*.tar.gz"), str(tmp_path), "-j", "2"])
+
+    def process(path, p):
+        if path.name == "b.tar.gz":
+            raise ValueError("shrubbery")
+        return ([path.with_suffix(".tiff")], [])
+    fpsp_.side_effect = process
+    # threads instead of processes, such that the mock is used
+    with patch("concurrent.futures.ProcessPoolExecutor",
+               concurrent.futures.ThreadPoolExecutor):
+        with pytest.raises(SystemExit) as exc:
+            fcitools.processing.show_testdata.main()
+        assert exc.value.code == 1
+        assert fpsp_.call_count == 3
+        out = capsys.readouterr().out
+        assert f"FAILED {tmp_path!s}/b.tar.gz: shrubbery" in out
+        assert f"OK {tmp_path!s}/a.tar.gz" in out
+        assert "Processed 3 archives, 1 failed" in out
+        fpsp_.side_effect = None
+        fpsp_.return_value = ([], [])
+        fcitools.processing.show_testdata.main()
+        assert "Processed 3 archives, 0 failed" in capsys.readouterr().out
+    fpsp.return_value = fcitools.processing.show_testdata.\
+        get_parser().parse_args([str(tmp_path / "x*"), str(tmp_path)])
+    with pytest.raises(SystemExit) as exc:
+        fcitools.processing.show_testdata.main()
+    assert exc.value.code == 2
+
+
+@patch("satpy.Scene", autospec=True)
+@patch("fcitools.processing.show_testdata.parse_cmdline", autospec=True)
+def test_main_profile_report(fpsp, sS, fci_tfs, tmp_path):
+    import json
+    import fcitools.processing.show_testdata
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    fpsp.return_value = fcitools.processing.show_testdata.\
+        get_parser().parse_args([
+                str(fci_tfs), str(tmp_path), "--channels", "vis_04",
+                "-a", "socotra", "--profile-report",
+                str(tmp_path / "report.json")])
+    fcitools.processing.show_testdata.main()
+    with (tmp_path / "report.json").open() as fp:
+        report = json.load(fp)
+    assert report["wall_time"] > 0
+    (arch,) = report["archives"]
+    assert arch["path"] == str(fci_tfs)
+    assert arch["status"] == "ok"
+    stages = {st["stage"]: st for st in arch["stages"]}
+    assert list(stages) == [
+            "unpack", "load", "resample", "compute",
+            "show_testdata_from_dir", "unpack_and_show_testdata"]
+    # the archive has no chunks covering socotra, only the TRAIL file
+    assert stages["unpack"]["n_files"] == 1
+    assert stages["load"]["parent"] == "show_testdata_from_dir"
+    assert stages["load"]["n_files"] == 1
+    assert stages["compute"]["n_outputs"] == 1
+    for st in stages.values():
+        assert st["wall_time"] >= 0
+        assert st["cpu_time"] >= 0
+        assert st["peak_rss"] > 0
+
+
+@patch("fcitools.scheduling.use_scheduler", autospec=True)
+@patch("fcitools.vis.unpack_and_show_testdata", autospec=True)
+@patch("fcitools.processing.show_testdata.parse_cmdline", autospec=True)
+def test_main_scheduler(fpsp, fvu, fsu, tfs, tmp_path):
+    import fcitools.processing.show_testdata
+    fpsp.return_value = fcitools.processing.show_testdata.\
+        get_parser().parse_args([
+                str(tfs[1]), str(tmp_path), "--channels", "vis_04",
+                "--scheduler", "processes", "--workers", "2",
+                "--max-concurrent-writes", "3"])
+    fvu.return_value = []
+    fcitools.processing.show_testdata.main()
+    fsu.assert_called_once_with("processes", 2, None)
+    fsu.return_value.__enter__.assert_called_once()
+    assert fvu.call_args[1]["max_concurrent_writes"] == 3
+    # with several archives, once for each worker and not for each archive
+    fsu.reset_mock()
+    for n in ("a", "b", "c"):
+        (tmp_path / f"{n:s}.tar.gz").touch()
+    fpsp.return_value = fcitools.processing.show_testdata.\
+        get_parser().parse_args([
+                str(tmp_path / "*.tar.gz"), str(tmp_path),
+                "--scheduler", "processes", "--workers", "2", "-j", "2"])
+    # threads instead of processes, such that the mocks are used
+    with patch("concurrent.futures.ProcessPoolExecutor",
+               concurrent.futures.ThreadPoolExecutor):
+        fcitools.processing.show_testdata.main()
+    assert fvu.call_count == 4
+    assert 1 <= fsu.call_count <= 2
+    fsu.assert_called_with("processes", 2, None)
+    # serially, once for all archives
+    fsu.reset_mock()
+    fpsp.return_value.jobs = 1
+    fcitools.processing.show_testdata.main()
+    assert fvu.call_count == 7
+    fsu.assert_called_once_with("processes", 2, None)
+
+
+def test_startup_lazy_imports():
+    # the scripts must print --help without importing the heavy stack
+    heavy = ["satpy", "pyresample", "xarray", "dask", "numpy", "pyproj",
+             "sattools"]
+    code = ("import sys, fcitools.processing.show_testdata, "
+            "fcitools.processing.geolocation_drift; "
+            f"print([m for m in {heavy!r} if m in sys.modules])")
+    out = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True,
+            text=True, env=os.environ)
+    assert out.stdout.strip() == "[]"
+    # generous bound relative to a bare interpreter, as importing satpy
+    # alone takes well over a second
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True,
+                   env=os.environ)
+    t1 = time.perf_counter()
+    out = subprocess.run(
+            [sys.executable, "-m", "fcitools.processing.show_testdata",
+             "--help"], check=True, capture_output=True, text=True,
+            env=os.environ)
+    t2 = time.perf_counter()
+    assert "--profile-report" in out.stdout
+    assert t2 - t1 < (t1 - t0) + 1
@@ -0,0 +1,123 @@
+"""Test rendering from a spool directory
+"""
+
+import os
+import time
+import logging
+from unittest.mock import patch
+
+
+def _fn(chunk, kind="BODY", rc=72, prod="FDHSI"):
+    return (f"W_XX-EUMETSAT-Darmstadt,IMG+SAT,MTI1+FCI-1C-RRAD-{prod:s}-"
+            f"FD--CHK-{kind:s}--L2P-NC4E_C_EUMT_20130804120845_GTT_DEV_"
+            f"20130804120330_20130804120345_N__T_{rc:>04d}_{chunk:>04d}.nc")
+
+
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.vis.get_needed_chunks", autospec=True)
+@patch("fcitools.vis.get_areas", autospec=True)
+def test_spool_watcher(fvga, fvgn, fvs, tmp_path, caplog):
+    import datetime
+    import fcitools.spool
+    fvga.return_value = {"south": "S", "north": "N"}
+    fvgn.side_effect = lambda areas, margin: (
+            {1, 2} if areas == ["S"] else {2, 3, 4})
+    fvs.side_effect = lambda files, comp, chan, regions, *args, **kwargs: [
+            f"{name:s}.tiff" for name in regions]
+    sp = tmp_path / "spool"
+    sp.mkdir()
+    watcher = fcitools.spool.SpoolWatcher(
+            sp, ["comp"], [], ["south", "north"], tmp_path / "out",
+            max_cycles=2, fmt="zarr")
+    fvgn.assert_any_call(["S"], margin=1)
+    assert watcher.poll() == []
+    for name in (_fn(1), _fn(1, prod="HRFI"), "README.txt", _fn(2) + ".part"):
+        (sp / name).touch()
+    assert watcher.poll() == []
+    (sp / _fn(2)).touch()
+    with caplog.at_level(logging.INFO):
+        assert watcher.poll() == ["south.tiff"]
+    assert "Rendered south for 20130804_0072" in caplog.text
+    (files, comp, chan, regions, d_out, fn_out) = fvs.call_args[0]
+    assert files == [sp / _fn(1), sp / _fn(2)]
+    assert regions == {"south": "S"}
+    assert fvs.call_args[1] == {"label": "20130804_0072", "fmt": "zarr"}
+    # nothing new, nothing rendered again
+    assert watcher.poll() == []
+    assert fvs.call_count == 1
+    for c in (3, 4):
+        (sp / _fn(c)).touch()
+    (sp / _fn(41, kind="TRAIL")).touch()
+    assert watcher.poll() == ["north.tiff"]
+    assert len(fvs.call_args[0][0]) == 5
+    # next cycles, failure for one does not stop the others
+    fvs.side_effect = [ValueError("broken"), ["south2.tiff"]]
+    for rc in (73, 74):
+        for c in (1, 2):
+            (sp / _fn(c, rc=rc)).touch()
+    with caplog.at_level(logging.WARNING):
+        assert watcher.poll() == ["south2.tiff"]
+        assert "Failed to render south for 20130804_0073" in caplog.text
+    assert set(watcher.done) == {(datetime.date(2013, 8, 4), rc)
+                                 for rc in (73, 74)}
+    # cycle 72 is forgotten and ignored
+    (sp / _fn(5)).touch()
+    assert watcher.scan() == set()
+    # giving up on a cycle
+    for rc in (75, 76):
+        (sp / _fn(1, rc=rc)).touch()
+    with caplog.at_level(logging.WARNING):
+        watcher.scan()
+    assert "Giving up on north for 20130804_0074" in caplog.text
+
+
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.vis.get_needed_chunks", autospec=True)
+@patch("fcitools.vis.get_areas", autospec=True)
+def test_spool_watcher_min_age(fvga, fvgn, fvs, tmp_path):
+    import fcitools.spool
+    fvga.return_value = {"south": "S"}
+    fvgn.return_value = {1}
+    fvs.return_value = ["south.tiff"]
+    watcher = fcitools.spool.SpoolWatcher(
+            tmp_path, ["comp"], [], ["south"], tmp_path, min_age=60)
+    (tmp_path / _fn(1)).touch()
+    with patch("time.sleep", autospec=True) as ts:
+        watcher.run(interval=5, n_polls=2)
+    ts.assert_called_once_with(5)
+    fvs.assert_not_called()
+    t = time.time() - 120
+    os.utime(tmp_path / _fn(1), (t, t))
+    assert watcher.poll() == ["south.tiff"]
+
+
+@patch("fcitools.resample.hold_index", autospec=True)
+@patch("fcitools.resample.get_source_areas", autospec=True)
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.vis.get_areas", autospec=True)
+def test_spool_watcher_prepare(fvga, fvs, frg, frh, tmp_path, areas, caplog):
+    import fcitools.spool
+    fvga.return_value = {"shrubbery": areas[0], "native": "native"}
+    fvs.return_value = []
+    frg.side_effect = [ValueError("No supported files"), ["src1", "src2"]]
+    watcher = fcitools.spool.SpoolWatcher(
+            tmp_path, ["comp"], [], ["shrubbery", "native"], tmp_path,
+            reader="fci_l1c_nc")
+    watcher.poll()
+    frg.assert_not_called()
+    (tmp_path / _fn(41, kind="TRAIL")).touch()
+    with caplog.at_level(logging.WARNING):
+        watcher.poll()
+    assert "trying again later" in caplog.text
+    frh.assert_not_called()
+    (tmp_path / _fn(1)).touch()
+    watcher.poll()
+    frg.assert_called_with([tmp_path / _fn(1), tmp_path / _fn(41, "TRAIL")],
+                           reader="fci_l1c_nc")
+    assert frh.call_args_list == [(("src1", areas[0]),),
+                                  (("src2", areas[0]),)]
+    # only once
+    (tmp_path / _fn(2)).touch()
+    watcher.poll()
+    assert frg.call_count == 2
+    assert frh.call_count == 2
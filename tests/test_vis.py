@@ -2,15 +2,18 @@
 """
 
 import pathlib
+import pytest
 
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 
 @patch("satpy.Scene", autospec=True)
-@patch("sattools.ptc.get_all_areas", autospec=True)
+@patch("fcitools.areas.get_all_areas", autospec=True)
 def test_unpack_and_show_testdata(ga, sS, tfs, tmp_path, areas):
     import fcitools.vis
     ga.return_value = {"shrubbery": areas[0]}
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
     fcitools.vis.unpack_and_show_testdata(
             tfs[0], ["mars_rgb"], ["vis_00"],
             ["shrubbery"], tmp_path)
@@ -18,12 +21,389 @@ def test_unpack_and_show_testdata(ga, sS, tfs, tmp_path, areas):
     # more rigorous testing in test_show_testdata
 
 
-@patch("sattools.vis.show", autospec=True)
-@patch("glob.glob", autospec=True)
-def test_show_testdata(gl, sc, areas):
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.areas.get_all_areas", autospec=True)
+def test_unpack_and_show_testdata_regions(ga, svs, tfs, tmp_path, areas):
     import fcitools.vis
-    # just a thin wrapper…
-    fcitools.vis.show_testdata_from_dir(
-            "/tmp/pinguin/telly", "comps", "chans", "areas",
+    import fcitools.areas
+    ga.return_value = {**fcitools.areas.get_fcitools_areas(),
+                       "shrubbery": areas[0], "other": areas[0]}
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[0], ["mars_rgb"], ["vis_00"],
+            ["shrubbery", "native", "gavdos"], tmp_path)
+    regions = svs.call_args[0][3]
+    assert list(regions) == ["shrubbery", "native", "gavdos"]
+    assert regions["shrubbery"] is areas[0]
+    assert regions["gavdos"].shape == (336, 388)
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[0], ["mars_rgb"], ["vis_00"], None, tmp_path)
+    assert {"shrubbery", "other", "crete"} <= set(svs.call_args[0][3])
+
+
+def test_get_areas():
+    import fcitools.vis
+    assert fcitools.vis.get_areas(["native"]) == {"native": "native"}
+    assert fcitools.vis.get_areas(["crete"])["crete"].area_id == "crete"
+    # known to satpy
+    assert fcitools.vis.get_areas(["eurol"])["eurol"].area_id == "eurol"
+    with pytest.raises(KeyError):
+        fcitools.vis.get_areas(["atlantis"])
+
+
+@patch("fcitools.vis._save_with_coastlines", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata(sS, fvs, areas, tmp_path):
+    import fcitools.vis
+    import fcitools.resample
+    fvs.return_value = ([], [])
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    fns = fcitools.vis.show_testdata_from_dir(
+            [pathlib.Path("/tmp/pinguin/telly")], ["comp"], ["chan"],
+            [areas[0], "native"],
             pathlib.Path("/out"), "{label:s}_{area:s}_{dataset:s}.tiff",
             path_to_coastlines="/coast", label="fish")
+    sS.assert_called_once_with(
+            filenames=["/tmp/pinguin/telly"], reader="fci_l1c_nc")
+    sc = sS.return_value
+    sc.load.assert_called_once_with(["comp", "chan"])
+    assert sc.resample.call_count == 2
+    sc.resample.assert_any_call(
+            areas[0], resampler=fcitools.resample.CachedNearestResampler,
+            reduce_data=False)
+    sc.resample.assert_any_call(resampler="native")
+    assert fns == [pathlib.Path("/out") / f"fish_{a:s}_{d:s}.tiff"
+                   for a in ("shrubbery", "native") for d in ("comp", "chan")]
+    ls = sc.resample.return_value
+    ls.save_dataset.assert_not_called()
+    fvs.assert_any_call(
+            ls.__getitem__.return_value,
+            pathlib.Path("/out/fish_shrubbery_comp.tiff"),
+            {"coast_dir": "/coast", "color": "red"}, None)
+    # only coastlines
+    sc.reset_mock()
+    sc.__getitem__.return_value.shape = (10, 10)
+    sc.__getitem__.return_value.data.chunks = ((10,), (10,))
+    fns = fcitools.vis.show_testdata_from_dir(
+            [pathlib.Path("/tmp/pinguin/telly")], [], ["chan"],
+            [areas[0]], tmp_path, "{area:s}_{dataset:s}.tiff",
+            show_only_coastlines=True)
+    assert [fn.name for fn in fns] == [
+            f"shrubbery_coastlines_{bg:s}.tiff"
+            for bg in ("white", "black", "transparent")]
+    (k, v) = sc.__setitem__.call_args_list[2][0]
+    assert k == "coastlines_transparent"
+    assert v.shape == (4, 10, 10)
+    assert (v.values == 0).all()
+    ls.save_dataset.assert_called_with(
+            "coastlines_transparent",
+            filename=str(tmp_path / "shrubbery_coastlines_transparent.tiff"),
+            overlay=None, enhance=False, compute=False)
+
+
+def test_count_tasks():
+    import dask.array
+    import fcitools.vis
+    a = dask.array.ones((10, 10), chunks=5)
+    b = a * 2
+    results = [([b + 1], [None]), ([b + 2], [None]),
+               [dask.array.zeros(3, chunks=3)]]
+    (total, unique) = fcitools.vis.count_tasks(results)
+    # the tasks for b are in the first two results, but computed once
+    assert total - unique == len(b.__dask_graph__())
+    assert fcitools.vis.count_tasks([]) == (0, 0)
+
+
+@patch("fcitools.vis._get_writer_functions", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_single_compute(sS, fvg, areas, caplog):
+    import logging
+    import fcitools.vis
+    (cwr, sr) = (MagicMock(), MagicMock())
+    fvg.return_value = (cwr, sr)
+    sr.return_value = ([], [], [])
+    with caplog.at_level(logging.INFO):
+        fcitools.vis.show_testdata_from_dir(
+                [], ["comp1", "comp2"], ["chan"], [areas[0], "native"],
+                pathlib.Path("/out"), "{area:s}_{dataset:s}.tiff")
+        assert "Writing 6 files" in caplog.text
+    cwr.assert_called_once()
+    assert len(cwr.call_args[0][0]) == 6
+    cwr.reset_mock()
+    fcitools.vis.show_testdata_from_dir(
+            [], ["comp1", "comp2"], ["chan"], [areas[0], "native"],
+            pathlib.Path("/out"), "{area:s}_{dataset:s}.tiff",
+            max_concurrent_writes=4)
+    assert [len(c[0][0]) for c in cwr.call_args_list] == [4, 2]
+
+
+@patch("fcitools.manifest.get_composite_definitions", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_incremental(sS, fmg, areas, tmp_path):
+    import os
+    import fcitools.vis
+    fmg.side_effect = lambda names: {n: f"def {n:s}" for n in names}
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    inp = tmp_path / "in.nc"
+    inp.write_bytes(b"x")
+    d_out = tmp_path / "out"
+
+    def show(composites=("comp1", "comp2")):
+        res = fcitools.vis.show_testdata_from_dir(
+                [inp], list(composites), ["chan"], [areas[0], "native"],
+                d_out, "{area:s}_{dataset:s}.tiff", segments=False,
+                incremental=True)
+        # the mocked scene writes nothing
+        d_out.mkdir(exist_ok=True)
+        for fn in res.written:
+            fn.touch()
+        return res
+    res = show()
+    assert isinstance(res, fcitools.vis.IncrementalResult)
+    assert len(res.written) == 6
+    assert res.skipped == []
+    # all up to date: nothing loaded
+    sS.reset_mock()
+    res = show()
+    assert res.written == []
+    assert len(res.skipped) == 6
+    sS.assert_not_called()
+    # new composite: only that one is loaded and written
+    res = show(["comp1", "comp2", "comp3"])
+    assert [fn.name for fn in res.written] == [
+            "shrubbery_comp3.tiff", "native_comp3.tiff"]
+    assert len(res.skipped) == 6
+    sS.return_value.load.assert_called_once_with(["comp3"])
+    # changed definition
+    fmg.side_effect = lambda names: {n: "new" if n == "comp1" else
+                                     f"def {n:s}" for n in names}
+    res = show()
+    assert {fn.name for fn in res.written} == {
+            "shrubbery_comp1.tiff", "native_comp1.tiff"}
+    # changed input and deleted output
+    os.utime(inp, ns=(0, 0))
+    assert len(show().written) == 6
+    (d_out / "native_chan.tiff").unlink()
+    assert [fn.name for fn in show().written] == ["native_chan.tiff"]
+
+
+@patch("fcitools.manifest.get_composite_definitions", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_incremental_iterator(sS, fmg, areas, tmp_path):
+    import fcitools.vis
+    fmg.side_effect = lambda names: {n: None for n in names}
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    d_in = tmp_path / "in"
+    d_in.mkdir()
+    for i in range(3):
+        (d_in / f"in{i:d}.nc").write_bytes(b"x")
+    # as passed on from unpack_tgz
+    res = fcitools.vis.show_testdata_from_dir(
+            d_in.iterdir(), [], ["chan"], [areas[0]], tmp_path / "out",
+            "{area:s}_{dataset:s}.tiff", segments=False, incremental=True)
+    assert len(res.written) == 1
+    assert sorted(sS.call_args[1]["filenames"]) == [
+            str(d_in / f"in{i:d}.nc") for i in range(3)]
+
+
+@patch("fcitools.vis._convert_to_cog", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_formats(sS, fvc, areas, tmp_path):
+    import numpy
+    import xarray
+    import dask.array
+    import fcitools.vis
+    ls = sS.return_value.resample.return_value
+    ls.save_dataset.return_value = ([], [])
+
+    def show(fmt):
+        return fcitools.vis.show_testdata_from_dir(
+                [], [], ["chan"], [areas[0]], tmp_path,
+                "{area:s}_{dataset:s}.tiff", segments=False, fmt=fmt)
+    fns = show("cog")
+    assert fns == [tmp_path / "shrubbery_chan.tiff"]
+    ls.save_dataset.assert_called_once_with(
+            "chan", filename=str(tmp_path / "shrubbery_chan.tiff.tmp.tif"),
+            overlay=None, enhance=None, tiled=True, blockxsize=512,
+            blockysize=512, compress="DEFLATE", num_threads="ALL_CPUS",
+            compute=False)
+    fvc.assert_called_once_with(fns)
+    ls.to_xarray.return_value = xarray.Dataset(
+            {"chan": (("y", "x"),
+                      dask.array.arange(600 * 700, dtype="f4",
+                                        chunks=300).reshape(600, 700))})
+    fns = show("zarr")
+    assert fns == [tmp_path / "shrubbery_chan.zarr"]
+    ls.to_xarray.assert_called_with(datasets=["chan"], include_lonlats=False)
+    ds = xarray.open_zarr(fns[0])
+    assert ds["chan"].data.chunksize == (512, 512)
+    numpy.testing.assert_array_equal(
+            ds["chan"].values, ls.to_xarray.return_value["chan"].values)
+    with pytest.raises(ValueError):
+        show("gif")
+    pytest.importorskip("netCDF4")
+    fns = show("netcdf")
+    with xarray.open_dataset(fns[0]) as ds:
+        assert ds["chan"].encoding["zlib"]
+
+
+def test_convert_to_cog(tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    import numpy
+    import rasterio.enums
+    import rasterio.transform
+    import fcitools.vis
+    data = (numpy.arange(3 * 1200 * 1100) % 251).astype("u1").reshape(
+            3, 1200, 1100)
+    fns = [tmp_path / f"img{i:d}.tiff" for i in range(2)]
+    for fn in fns:
+        with rasterio.open(
+                fcitools.vis._get_cog_tmp(fn), "w", driver="GTiff",
+                width=1100, height=1200, count=3, dtype="uint8",
+                crs="EPSG:4326",
+                transform=rasterio.transform.from_bounds(
+                    0, 0, 11, 12, 1100, 1200),
+                tiled=True, blockxsize=512, blockysize=512) as dst:
+            dst.write(data)
+    fcitools.vis._convert_to_cog(fns)
+    for fn in fns:
+        assert not fcitools.vis._get_cog_tmp(fn).exists()
+        with rasterio.open(fn) as src:
+            assert src.tags(ns="IMAGE_STRUCTURE")["LAYOUT"] == "COG"
+            assert src.block_shapes == [(fcitools.vis._tile_size,) * 2] * 3
+            assert src.compression == rasterio.enums.Compression.deflate
+            assert src.overviews(1) == [2, 4]
+            numpy.testing.assert_array_equal(src.read(), data)
+
+
+@patch("fcitools.coastlines.rasterise", autospec=True)
+def test_save_with_coastlines(fcr, areas, tmp_path):
+    import os
+    import numpy
+    import xarray
+    import dask.array
+    import PIL.Image
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    ar = areas[0]
+    raster = numpy.zeros(ar.shape, dtype="u1")
+    raster[5, :] = 255
+    fcr.return_value = raster
+    da = xarray.DataArray(
+            dask.array.full(ar.shape, 0.5, chunks=100),
+            dims=("y", "x"), attrs={"area": ar, "name": "chan"})
+    for bg in ("white", "black"):
+        res = fcitools.vis._save_with_coastlines(
+                da, tmp_path / f"{bg:s}.png",
+                {"coast_dir": "/coast", "color": "red"}, False)
+        fcitools.vis._get_writer_functions()[0]([res])
+        img = numpy.asarray(PIL.Image.open(tmp_path / f"{bg:s}.png"))
+        numpy.testing.assert_array_equal(img[5, 0, :3], [255, 0, 0])
+        numpy.testing.assert_array_equal(img[4, 0, :3], [128, 128, 128])
+    # rasterised once
+    fcr.assert_called_once_with(ar, "/coast", "h", 0.5)
+
+
+def test_get_needed_chunks(tmp_path, areas):
+    import os
+    import fcitools.vis
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    ar = fcitools.vis.get_fcitools_areas()
+    # Crete is at 35°N, Île Europa at 22°S, chunk 1 is southernmost
+    assert fcitools.vis.get_needed_chunks([ar["crete"]], margin=0) == {33}
+    assert fcitools.vis.get_needed_chunks([ar["crete"]]) == {32, 33, 34}
+    assert fcitools.vis.get_needed_chunks(
+            [ar["crete"], ar["ileeuropa"]], margin=0) == {12, 33}
+    assert fcitools.vis.get_needed_chunks([ar["bornholm"]], margin=3) == {
+            35, 36, 37, 38, 39, 40}
+    assert fcitools.vis.get_needed_chunks(
+            [ar["crete"], "native"]) == set(range(1, 41))
+
+
+def test_select_segments(tmp_path, fci_tfs):
+    import os
+    import fcitools.vis
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    files = list(fcitools.ioutil.unpack_tgz(fci_tfs))
+    ar = fcitools.vis.get_fcitools_areas()
+    selected = fcitools.vis.select_segments(files, [ar["ileeuropa"]])
+    # chunks 11-13, TRAIL, and non-FCI README
+    assert sorted(p.name[-7:] for p in selected) == [
+            "0011.nc", "0012.nc", "0013.nc", "0041.nc", "DME.txt"]
+    assert len(fcitools.vis.select_segments(files, ["native"])) == 11
+
+
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_segments(sS, tmp_path, fci_tfs):
+    import os
+    import fcitools.vis
+    import fcitools.ioutil
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path)
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    files = list(fcitools.ioutil.unpack_tgz(fci_tfs))
+    fcitools.vis.show_testdata_from_dir(
+            files, ["comp"], [], ["ileeuropa"], tmp_path, "{area:s}.tiff")
+    assert len(sS.call_args[1]["filenames"]) == 5
+    fcitools.vis.show_testdata_from_dir(
+            files, ["comp"], [], ["ileeuropa"], tmp_path, "{area:s}.tiff",
+            segments=False)
+    assert len(sS.call_args[1]["filenames"]) == 11
+
+
+@patch("fcitools.memmap.reader_config", autospec=True)
+@patch("satpy.Scene", autospec=True)
+def test_show_testdata_memmap(sS, fmr, areas, tmp_path):
+    import fcitools.vis
+    sS.return_value.resample.return_value.save_dataset.return_value = (
+            [], [])
+    fcitools.vis.show_testdata_from_dir(
+            [], [], ["chan"], [areas[0]], tmp_path,
+            "{area:s}_{dataset:s}.tiff", segments=False, memmap=True)
+    fmr.assert_called_once_with()
+    fmr.return_value.__enter__.assert_called_once()
+    sS.assert_called_once_with(filenames=[], reader="fci_l1c_nc")
+    with pytest.raises(ValueError):
+        fcitools.vis.show_testdata_from_dir(
+                [], [], ["chan"], [areas[0]], tmp_path,
+                "{area:s}_{dataset:s}.tiff", reader="fci_l1c_fdhsi",
+                memmap=True)
+
+
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.ioutil.iter_unpack_tgz", autospec=True)
+def test_unpack_and_show_testdata_channels(fii, svs, tfs, tmp_path):
+    import fcitools.vis
+    fii.return_value = iter([tmp_path / "a.nc"])
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[1], [], ["vis_06", "ir_105"], ["native"], tmp_path)
+    assert fii.call_args[1]["channels"] == ["vis_06", "ir_105"]
+    assert fii.call_args[1]["chunks"] == set(range(1, 41))
+    assert svs.call_args[0][0] == [tmp_path / "a.nc"]
+    assert svs.call_args[1]["reader"] == "fci_l1c_fdhsi"
+    # channels for composites are unknown
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[1], ["overview"], ["vis_06"], ["native"], tmp_path)
+    assert fii.call_args[1]["channels"] is None
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[1], [], [0.6], ["crete"], tmp_path)
+    assert fii.call_args[1]["channels"] is None
+    assert fii.call_args[1]["chunks"] == fcitools.vis.get_needed_chunks(
+            [fcitools.vis.get_areas(["crete"])["crete"]])
+    assert len(fii.call_args[1]["chunks"]) < 40
+
+
+@patch("fcitools.vis.show_testdata_from_dir", autospec=True)
+@patch("fcitools.ioutil.unpack_tgz_npy", autospec=True)
+def test_unpack_and_show_testdata_memmap(fiu, svs, tfs, tmp_path):
+    import fcitools.vis
+    fiu.return_value = {tmp_path / "a.nc": tmp_path / ".npy" / "a.nc"}
+    fcitools.vis.unpack_and_show_testdata(
+            tfs[1], [], ["vis_06"], ["native"], tmp_path, memmap=True)
+    fiu.assert_called_once_with(tfs[1])
+    assert svs.call_args[0][0] == [tmp_path / "a.nc"]
+    assert svs.call_args[1]["reader"] == "fci_l1c_nc"
+    assert svs.call_args[1]["memmap"]
@@ -0,0 +1,30 @@
+"""Test the watch_spool script
+"""
+
+from unittest.mock import patch
+
+
+@patch("argparse.ArgumentParser", autospec=True)
+def test_get_parser(ap):
+    import fcitools.processing.watch_spool
+    fcitools.processing.watch_spool.parse_cmdline()
+    assert ap.return_value.add_argument.call_count == 13
+
+
+@patch("fcitools.spool.SpoolWatcher", autospec=True)
+@patch("fcitools.processing.watch_spool.parse_cmdline", autospec=True)
+def test_main(fpwp, fsS, tmp_path):
+    import fcitools.processing.watch_spool
+    fpwp.return_value = fcitools.processing.watch_spool.\
+        get_parser().parse_args([
+                str(tmp_path / "spool"), str(tmp_path / "out"),
+                "--composites", "natural_color", "-a", "tenerifegomera",
+                "--coastline-dir", "/coast", "--interval", "0.5"])
+    fsS.return_value.run.side_effect = KeyboardInterrupt
+    fcitools.processing.watch_spool.main()
+    fsS.assert_called_once_with(
+            tmp_path / "spool", ["natural_color"], [], ["tenerifegomera"],
+            tmp_path / "out", "{label:s}_{area:s}_{dataset:s}.tiff",
+            product="FDHSI", min_age=0, margin=1, max_cycles=6, fmt="tiff",
+            path_to_coastlines="/coast")
+    fsS.return_value.run.assert_called_once_with(0.5)